@@ -0,0 +1,181 @@
+"""
+Network analytics for social spheres
+Connected components, degree statistics, clustering coefficient and average path length, all worked out on the compressed sparse row
+form of the network (see Graph.CSRGraph), so that a generated (or loaded) social sphere can be checked quickly before a long run
+Components and degree statistics take time linear in the size of the network. Clustering and path length are exact for small networks,
+and estimated from a random sample of investors for big ones
+
+Every function takes a Graph.CSRGraph, a Graph.Graph or a SocialSphere.SocialSphere
+
+To run from the terminal: python Analytics.py [config file]
+Builds (or loads) the social sphere described by the config file, and prints a summary of it
+"""
+
+import Graph
+import random
+import sys
+import timeit
+import numpy
+
+def csrOf(graph):
+    "Returns the CSR form of a CSRGraph, Graph or SocialSphere"
+    if(isinstance(graph, Graph.CSRGraph)):
+        return graph
+    if(isinstance(graph, Graph.Graph)):
+        return graph.freeze()
+    return graph.get_csr()
+
+def firstOccurrences(ids, scratch):
+    "Returns ids with repeats removed (keeping the first of each), in linear time. scratch is an array at least as big as the largest id"
+    positions = numpy.arange(len(ids))
+    scratch[ids[::-1]] = positions[::-1]
+    return ids[scratch[ids] == positions]
+
+def bfsLevels(csr, sources, distance, scratch):
+    """
+    Breadth first search from the given source ids, one whole level at a time. distance must hold -1 for every vertex not yet reached
+    Fills in distance for every vertex reached, and returns the ids reached (in the order they were reached)
+    """
+    sources = numpy.asarray(sources, dtype=numpy.int64)
+    distance[sources] = 0
+    reached = [sources]
+    frontier = sources
+    level = 0
+    while(len(frontier) > 0):
+        level = level + 1
+        positions, cols = csr.edges_from(frontier)
+        cols = firstOccurrences(cols[distance[cols] < 0], scratch)
+        distance[cols] = level
+        reached.append(cols)
+        frontier = cols
+    return numpy.concatenate(reached)
+
+def connectedComponents(graph):
+    """
+    Returns the connected component of every vertex, as an array of component numbers (0 is the component of vertex 0, and so on in
+    order of each component's first vertex)
+    Takes time linear in the number of vertices and edges
+    """
+    csr = csrOf(graph)
+    component = -numpy.ones(csr.size, dtype=numpy.int64)
+    distance = -numpy.ones(csr.size, dtype=numpy.int64)
+    scratch = numpy.zeros(csr.size, dtype=numpy.int64)
+    numComponents = 0
+    for start in range(csr.size):
+        if(component[start] >= 0):
+            continue
+        if(csr.degree[start] == 0):
+            component[start] = numComponents
+        else:
+            component[bfsLevels(csr, [start], distance, scratch)] = numComponents
+        numComponents = numComponents + 1
+    return component
+
+def componentSizes(graph):
+    "Returns the size of every connected component, largest first"
+    return numpy.sort(numpy.bincount(connectedComponents(graph)))[::-1]
+
+def isConnected(graph):
+    "Returns whether or not every vertex can be reached from every other one"
+    csr = csrOf(graph)
+    if(csr.size == 0):
+        return True
+    distance = -numpy.ones(csr.size, dtype=numpy.int64)
+    return len(bfsLevels(csr, [0], distance, numpy.zeros(csr.size, dtype=numpy.int64))) == csr.size
+
+def degreeHistogram(graph):
+    "Returns the number of vertices with each degree (histogram[d] vertices have degree d)"
+    return numpy.bincount(csrOf(graph).degree)
+
+def largestDegree(graph):
+    "Returns the largest number of connections any vertex has"
+    csr = csrOf(graph)
+    return int(csr.degree.max()) if csr.size > 0 else 0
+
+def averageDegree(graph):
+    "Returns the average number of connections of a vertex"
+    csr = csrOf(graph)
+    return float(csr.degree.sum()) / csr.size if csr.size > 0 else 0.0
+
+def sampleVertices(csr, samples, rng):
+    "Returns the ids of every vertex if there are at most samples of them, or else a random sample of that many"
+    if(samples is None or csr.size <= samples):
+        return range(csr.size)
+    return rng.sample(range(csr.size), samples)
+
+def clusteringCoefficient(graph, samples=1000, rng=random):
+    """
+    Returns the average clustering coefficient (the fraction of pairs of a vertex's neighbours that are connected to each other)
+    Averaged over every vertex if there are at most samples of them, or over a random sample of that many otherwise. Vertices with
+    fewer than 2 neighbours count as 0
+    """
+    csr = csrOf(graph)
+    if(csr.size == 0):
+        return 0.0
+    isNeighbour = numpy.zeros(csr.size, dtype=bool)
+    total = 0.0
+    vertices = sampleVertices(csr, samples, rng)
+    for v in vertices:
+        degree = int(csr.degree[v])
+        if(degree < 2):
+            continue
+        neighbours = csr.neighbours(v)
+        isNeighbour[neighbours] = True
+        positions, cols = csr.edges_from(neighbours)
+        links = int(numpy.count_nonzero(isNeighbour[cols])) // 2
+        isNeighbour[neighbours] = False
+        total = total + 2.0 * links / (degree * (degree - 1))
+    return total / len(vertices)
+
+def averagePathLength(graph, samples=10, rng=random):
+    """
+    Returns the average number of steps on the shortest path between two vertices (over pairs that are connected)
+    Uses a breadth first search from every vertex if there are at most samples of them, or from a random sample of that many otherwise
+    (each search reaches every vertex in its component, so even a few searches give a good estimate on a big network)
+    """
+    csr = csrOf(graph)
+    distance = -numpy.ones(csr.size, dtype=numpy.int64)
+    scratch = numpy.zeros(csr.size, dtype=numpy.int64)
+    totalDistance = 0
+    numPairs = 0
+    for source in sampleVertices(csr, samples, rng):
+        reached = bfsLevels(csr, [source], distance, scratch)
+        totalDistance = totalDistance + int(distance[reached].sum())
+        numPairs = numPairs + len(reached) - 1
+        distance[reached] = -1
+    return float(totalDistance) / numPairs if numPairs > 0 else 0.0
+
+def summary(graph, samples=1000, pathSamples=10, rng=random):
+    "Returns a dictionary of statistics about a network (see the functions above)"
+    csr = csrOf(graph)
+    sizes = componentSizes(csr)
+    return {
+        'vertices': csr.size,
+        'edges': csr.num_edges(),
+        'components': len(sizes),
+        'largest_component': int(sizes[0]) if len(sizes) > 0 else 0,
+        'connected': len(sizes) <= 1,
+        'min_degree': int(csr.degree.min()) if csr.size > 0 else 0,
+        'max_degree': largestDegree(csr),
+        'mean_degree': averageDegree(csr),
+        'degree_histogram': degreeHistogram(csr).tolist(),
+        'clustering': clusteringCoefficient(csr, samples, rng),
+        'path_length': averagePathLength(csr, pathSamples, rng),
+    }
+
+def main(argv):
+    import Runner
+    import RandomStreams
+    params = Runner.readConfig(argv[1] if len(argv) > 1 else 'config.txt')
+    start = timeit.default_timer()
+    sphere = Runner.buildSphere(params, RandomStreams.RandomStreams(params.get('seed')).graph)
+    built = timeit.default_timer() - start
+    stats = summary(sphere)
+    print('Social sphere built in ' + ('%.2f' % built) + 's, checked in ' + ('%.2f' % (timeit.default_timer() - start - built)) + 's')
+    for name in ['vertices', 'edges', 'components', 'largest_component', 'connected', 'min_degree', 'max_degree', 'mean_degree', 'clustering', 'path_length']:
+        print(name + ': ' + str(stats[name]))
+    histogram = stats['degree_histogram']
+    print('degree_histogram: ' + ', '.join([str(d) + ':' + str(histogram[d]) for d in range(len(histogram)) if histogram[d] > 0]))
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,153 @@
+"""
+Benchmark suite for the simulation
+Times social sphere construction, investor setup, market setup and ticks over a ladder of market sizes, for each network model, with herd
+behaviour on and off, and for each tick engine. Reports ticks/sec, investor updates/sec and peak memory, and saves everything as JSON so
+results from different versions can be compared
+
+To run from the terminal: python Benchmark.py [--sizes 1000 10000 100000] [--ticks 20] [--output benchmark.json] [--compare old.json]
+"""
+
+import Runner
+import RandomStreams
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+import timeit
+import traceback
+
+def timed(function, *args):
+    "Calls function with the given arguments, and returns (result, seconds taken)"
+    start = timeit.default_timer()
+    result = function(*args)
+    return result, timeit.default_timer() - start
+
+def runCase(case):
+    """
+    Runs one benchmark case (a dictionary with model, size, herd, engine, ticks and seed), and returns the case with its timings added
+    Meant to be run in a fresh process, so that peak memory belongs to this case alone
+    """
+    sys.stdout = open(os.devnull, 'w')
+    params = {'model': case['model'], 'size': case['size'], 'k': 4, 'rewire': 0.15}
+    streams = RandomStreams.RandomStreams(case['seed'])
+
+    sphere, graphTime = timed(Runner.buildSphere, params, streams.graph)
+    investors, investorTime = timed(Runner.setUpInvestors, sphere, None, streams.setup)
+    market, marketTime = timed(Runner.setUpMarket, investors, 0.35, streams.setup)
+    largestNumConnections = Runner.getLargestNumConnections(sphere)
+    averageNumConnections = Runner.getAverageNumConnections(sphere)
+
+    marketValues = [market.totalShares]
+    engine, engineTime = timed(Runner.makeEngine, case['engine'], sphere, investors)
+    start = timeit.default_timer()
+    for i in range(1, case['ticks'] + 1):
+        if(engine is not None):
+            engine.tick(market, marketValues, i, largestNumConnections, averageNumConnections, case['herd'], streams.tick(i))
+        else:
+            Runner.tick(market, investors, sphere, marketValues, i, largestNumConnections, averageNumConnections, case['herd'], streams.tick(i))
+        marketValues.append(market.totalShares)
+    tickTime = timeit.default_timer() - start
+    if(engine is not None):
+        engine.close()
+
+    result = dict(case)
+    result.update({
+        'graph_seconds': graphTime,
+        'investor_setup_seconds': investorTime,
+        'market_setup_seconds': marketTime,
+        'engine_setup_seconds': engineTime,
+        'tick_seconds': tickTime,
+        'ticks_per_second': case['ticks'] / tickTime,
+        'investor_updates_per_second': case['ticks'] * case['size'] / tickTime,
+        'peak_memory_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0,
+    })
+    return result
+
+def runChild(connection, case):
+    "Runs one case in a child process, and sends back (result, None), or (None, the error's traceback) if it failed"
+    try:
+        connection.send((runCase(case), None))
+    except Exception:
+        connection.send((None, traceback.format_exc()))
+    connection.close()
+
+def runBenchmarks(cases):
+    """
+    Runs each case in its own process, and yields the results one at a time
+    The processes are plain (not daemonic) ones rather than pool workers, so that the sharded engine can start its own pool of workers
+    """
+    for case in cases:
+        receiver, sender = multiprocessing.Pipe(False)
+        process = multiprocessing.Process(target=runChild, args=(sender, case))
+        process.start()
+        sender.close()
+        try:
+            result, error = receiver.recv()
+        except EOFError:
+            result, error = None, 'process exited with code ' + str(process.exitcode)
+        finally:
+            process.join()
+        if(error is not None):
+            raise RuntimeError('benchmark case ' + describe(case) + ' failed: ' + error)
+        yield result
+
+def makeCases(sizes, models, herds, engines, ticks, seed):
+    "Returns every combination of the given sizes, models, herd settings and engines as a list of cases"
+    return [{'model': model, 'size': size, 'herd': herd, 'engine': engine, 'ticks': ticks, 'seed': seed}
+            for size in sizes for model in models for herd in herds for engine in engines]
+
+def version():
+    "Returns the git commit of the code being benchmarked (or 'unknown')"
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__))).strip().decode('ascii')
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+def caseKey(result):
+    return (result['model'], result['size'], result['herd'], result['engine'])
+
+def describe(result):
+    return '%s size=%d herd=%s engine=%s' % (result['model'], result['size'], 'on' if result['herd'] else 'off', result['engine'])
+
+def compare(results, filename):
+    "Prints how the tick throughput of each case compares with the same case in an earlier benchmark file"
+    with open(filename) as fin:
+        old = dict((caseKey(result), result) for result in json.load(fin)['results'])
+    for result in results:
+        if(caseKey(result) in old):
+            ratio = result['ticks_per_second'] / old[caseKey(result)]['ticks_per_second']
+            print('%-50s %6.2fx ticks/sec' % (describe(result), ratio))
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Benchmark the stock market simulation')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--models', nargs='+', default=['ba', 'ws'])
+    parser.add_argument('--engines', nargs='+', default=['legacy', 'vectorized', 'incremental', 'sharded'])
+    parser.add_argument('--herd', nargs='+', default=['on', 'off'])
+    parser.add_argument('--ticks', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='benchmark.json')
+    parser.add_argument('--compare', default=None, help='earlier benchmark JSON file to compare against')
+    args = parser.parse_args(argv[1:])
+
+    cases = makeCases(args.sizes, args.models, [herd == 'on' for herd in args.herd], args.engines, args.ticks, args.seed)
+    results = []
+    for result in runBenchmarks(cases):
+        results.append(result)
+        print('%-50s graph %7.2fs  setup %7.2fs  %9.2f ticks/sec  %12.0f updates/sec  peak %8.1f MB' % (
+            describe(result), result['graph_seconds'], result['investor_setup_seconds'] + result['market_setup_seconds'] + result['engine_setup_seconds'],
+            result['ticks_per_second'], result['investor_updates_per_second'], result['peak_memory_mb']))
+
+    with open(args.output, 'w') as fout:
+        json.dump({'version': version(), 'python': platform.python_version(), 'machine': platform.machine(), 'time': time.time(), 'results': results}, fout, indent=2)
+
+    if(args.compare):
+        compare(results, args.compare)
+
+if __name__ == '__main__':
+    main(sys.argv)
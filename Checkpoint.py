@@ -0,0 +1,88 @@
+"""
+Checkpointing for long simulations
+A checkpoint holds the full state of a run after some timestep, in one compact binary file (numpy .npz): the social sphere in CSR form,
+investor state arrays, the market's totals, the random seed, the market values so far and the market history
+Since every timestep's random stream only depends on the seed and the timestep (see RandomStreams), a run resumed from a checkpoint
+carries on exactly as if it had never stopped
+"""
+
+import Graph
+import History
+import Market
+import SocialSphere
+import numpy
+import os
+
+def investorState(investors):
+    "Given a population of investors (see Market.Population), returns their state as flat arrays (in the order of the social sphere's CSR ids)"
+    return investors.arrays()
+
+def engineState(engine):
+    "Given a VectorEngine, returns its investor state arrays"
+    return {'numShares': engine.numShares, 'inMarket': engine.inMarket, 'lastChange': engine.lastChange, 'numTimesLeft': engine.numTimesLeft}
+
+def save(filename, sphere, state, market, marketValues, seed, curTime, history=None):
+    """
+    Writes a checkpoint of the run after timestep curTime
+    state is a dictionary of investor state arrays (see investorState/engineState)
+    The file is written to a temporary name first and then renamed, so a crash while saving never leaves a broken checkpoint behind
+    """
+    csr = sphere.get_csr().compact()
+    arrays = {
+        'labels': csr.labels(),
+        'degree': csr.degree,
+        'indices': csr.indices,
+        'totalShares': numpy.float64(market.totalShares),
+        'limit': numpy.float64(market.limit),
+        'marketValues': numpy.array(marketValues, dtype=numpy.float64),
+        'seed': numpy.int64(seed),
+        'curTime': numpy.int64(curTime),
+    }
+    for name in state:
+        arrays['investor_' + name] = state[name]
+    if(history is not None):
+        arrays['history_rows'] = history.rows
+        arrays['history_numRecorded'] = numpy.int64(history.numRecorded)
+        arrays['history_window'] = numpy.int64(history.window or 0)
+
+    temporary = filename + '.tmp'
+    with open(temporary, 'wb') as fout:
+        numpy.savez(fout, **arrays)
+    os.rename(temporary, filename)
+
+def load(filename):
+    """
+    Reads a checkpoint, and returns a dictionary holding the restored run:
+    sphere, investors (Market.Population), market, marketValues, seed, curTime (last timestep completed), history
+    """
+    data = numpy.load(filename)
+
+    "Rebuild the social sphere from its CSR form"
+    vertices = [Graph.Vertex(str(label)) for label in data['labels']]
+    sphere = SocialSphere.SocialSphere.from_csr(Graph.CSRGraph(vertices, data['degree'], data['indices']))
+
+    "Restore the market history"
+    history = None
+    if('history_rows' in data.files):
+        rows = data['history_rows']
+        history = History.MarketHistory(len(vertices), int(data['history_window']))
+        history.rows = rows.copy()
+        history.numRecorded = int(data['history_numRecorded'])
+
+    "Restore investors"
+    state = dict((name, data['investor_' + name]) for name in ('numShares', 'inMarket', 'lastChange', 'numTimesLeft'))
+    investors = Market.Population.fromArrays(state, vertices, history)
+
+    "Restore the market"
+    market = Market.Market(float(data['limit']))
+    market.totalShares = float(data['totalShares'])
+
+    return {
+        'sphere': sphere,
+        'investors': investors,
+        'market': market,
+        'marketValues': data['marketValues'].tolist(),
+        'seed': int(data['seed']),
+        'curTime': int(data['curTime']),
+        'history': history,
+    }
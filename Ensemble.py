@@ -0,0 +1,125 @@
+"""
+Monte Carlo ensemble runner
+Runs a grid of simulation configurations, each repeated a number of times, over a pool of worker processes, and streams the
+swing statistics of each run back as it finishes
+
+To run from the terminal: python Ensemble.py [replicates] [processes] [config file]
+Any parameter in the config file can be given as a comma separated list of values (e.g. "model = ba, ws"), and every combination is run
+"""
+
+import Runner
+import RandomStreams
+import itertools
+import multiprocessing
+import os
+import sys
+import numpy
+
+def jobSeed(baseSeed, configIndex, replicate):
+    "Returns a deterministic seed for one run, so that results don't depend on which worker picks up the run, or when"
+    return RandomStreams.deriveSeed(baseSeed, 'ensemble', configIndex, replicate)
+
+def runJob(job):
+    """
+    Runs one simulation in a worker process, and returns a dictionary of its swing statistics
+    job is a tuple (configIndex, replicate, params, seed)
+    """
+    configIndex, replicate, params, seed = job
+    market, marketValues = Runner.runSimulation(dict(params, seed=seed))
+    stats = market.stats
+    return {
+        'config': configIndex,
+        'replicate': replicate,
+        'seed': seed,
+        'swing': stats.swing(),
+        'min': stats.low,
+        'max': stats.high,
+        'volatility': stats.volatility(),
+        'max_drawdown': stats.maxDrawdown(),
+        'final': marketValues[-1],
+        'limit': market.limit,
+    }
+
+def runEnsemble(configs, replicates, processes=None, baseSeed=0):
+    """
+    Runs every configuration (a list of parameter dictionaries, see Runner.readConfig) replicates times, over a pool of processes
+    (one per core by default). Each run is seeded from baseSeed, its configuration and its replicate number
+    Configurations with a graph_file all run on the network saved in that file (built from baseSeed if it doesn't exist yet)
+    Generator: yields the result of each run (see runJob) as soon as it finishes, so results arrive in completion order
+    """
+    jobs = [(c, r, configs[c], jobSeed(baseSeed, c, r)) for c in range(len(configs)) for r in range(replicates)]
+
+    "Build any shared social sphere files up front, so that every worker just opens the same one (see Runner.buildSphere)"
+    for config in configs:
+        if(config.get('graph_file') and not os.path.exists(config['graph_file'])):
+            Runner.buildSphere(config, RandomStreams.RandomStreams(baseSeed).graph)
+
+    pool = multiprocessing.Pool(processes)
+    try:
+        for result in pool.imap_unordered(runJob, jobs):
+            yield result
+    finally:
+        pool.terminate()
+        pool.join()
+
+def makeGrid(base, axes):
+    """
+    Given base parameters and a dictionary mapping parameter names to lists of values, returns one parameter dictionary for every
+    combination of values
+    """
+    names = sorted(axes.keys())
+    configs = []
+    for values in itertools.product(*[axes[name] for name in names]):
+        config = dict(base)
+        config.update(zip(names, values))
+        configs.append(config)
+    return configs
+
+def readGrid(filename):
+    "Reads a config file (see Runner.readConfig) in which any value can be a comma separated list, and returns the grid of configurations"
+    base = {}
+    axes = {}
+    for line in open(filename):
+        line = line.strip()
+        if (not line or line[0] == '#'):
+            continue
+        tokens = line.split('=')
+        name = tokens[0].strip()
+        values = []
+        for value in tokens[1].split(','):
+            parsed = {}
+            Runner.setParameter(parsed, name, value.strip())
+            values.extend(parsed.values())
+        if(len(values) == 1):
+            base[name] = values[0]
+        elif(len(values) > 1):
+            axes[name] = values
+    return makeGrid(base, axes)
+
+def summarise(configs, results):
+    "Given the configurations and all run results, returns (config, number of runs, mean swing, standard deviation of swing) for each configuration"
+    summary = []
+    for c in range(len(configs)):
+        swings = [result['swing'] for result in results if result['config'] == c]
+        if(len(swings) > 0):
+            summary.append((configs[c], len(swings), float(numpy.mean(swings)), float(numpy.std(swings))))
+    return summary
+
+def main(argv):
+    replicates = int(argv[1]) if len(argv) > 1 else 10
+    processes = int(argv[2]) if len(argv) > 2 else None
+    configs = readGrid(argv[3] if len(argv) > 3 else 'config.txt')
+    baseSeed = configs[0].get('seed') or 0
+
+    "Stream results as they come in"
+    results = []
+    for result in runEnsemble(configs, replicates, processes, baseSeed):
+        results.append(result)
+        print('config ' + str(result['config']) + ' run ' + str(result['replicate']) + ': swing ' + str(result['swing']) + ' (' + str(len(results)) + '/' + str(len(configs) * replicates) + ')')
+
+    "Print the average swing for each configuration"
+    for config, numRuns, meanSwing, stdSwing in summarise(configs, results):
+        print(str(config) + ': mean swing ' + str(meanSwing) + ', std ' + str(stdSwing) + ' over ' + str(numRuns) + ' runs')
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,217 @@
+"""
+Fast builders for the social sphere's network models
+Builders work directly on integer node ids (0..n-1) and return the edges as two sequences (src, dst), where src[j]-dst[j] is an edge,
+without creating any Graph.Vertex or Graph.Edge objects. See SocialSphere.set_edges for turning them into a social sphere
+readEdgeList does the same for a network read from an edge list file
+"""
+
+import random
+import numpy
+import timeit
+import RandomStreams
+
+def barabasiAlbertEdges(n, rng=random):
+    """
+    Returns the edges of a Barabasi-Albert (scale-free) network with n nodes
+    Starts from the same seed graph as SocialSphere.add_preferential (nodes 0 and 1 both connected to node 2), then adds every other node
+    with 2 edges to distinct existing nodes, chosen by preferential attachment
+    Targets are sampled from a list holding both endpoints of every edge (so each node appears once per connection), which makes each
+    draw O(1) and the whole construction O(n)
+    rng: source of randomness (see RandomStreams)
+    """
+    if(n < 3):
+        raise ValueError('Barabasi-Albert network needs at least 3 nodes')
+
+    "Seed graph with 3 nodes"
+    src = [0, 1]
+    dst = [2, 2]
+    endpoints = [0, 2, 1, 2]
+
+    "Add nodes using preferential attachment until n nodes are achieved"
+    for v in range(3, n):
+        numEndpoints = len(endpoints)
+        first = endpoints[int(rng.random() * numEndpoints)]
+        second = first
+        while(second == first):
+            second = endpoints[int(rng.random() * numEndpoints)]
+        src.append(v)
+        dst.append(first)
+        src.append(v)
+        dst.append(second)
+        endpoints.extend((first, v, second, v))
+
+    return src, dst
+
+
+def wattsStrogatzEdges(n, k, p, rng=random):
+    """
+    Returns the edges of a Watts-Strogatz (small-world) network with n nodes
+    Starts from a k-regular ring lattice (each node connected to its k/2 nearest neighbours on either side, plus the node directly
+    opposite if k is odd, as in Graph.add_regular_edges), then rewires each clockwise lattice edge with probability p to a random node,
+    disallowing loops and duplicate edges (as in SocialSphere.rewire)
+
+    Edges are checked for duplicates by hashing node pairs: whether a pair is a lattice edge is worked out arithmetically, and only the
+    pairs removed or added by rewiring are kept in sets, so memory is O(n*k) for the edge arrays plus O(rewired edges)
+    rng: source of randomness (see RandomStreams)
+    """
+    if(n < k + 1):
+        raise ValueError('too high of a degree')
+    if((n * k) % 2 != 0):
+        raise ValueError('n * degree must be even')
+    half = k // 2
+
+    "Ring lattice: edge i*n + index connects index to its (i+1)th nearest neighbour in the clockwise direction"
+    src = numpy.tile(numpy.arange(n, dtype=numpy.int64), half)
+    dst = (src + numpy.repeat(numpy.arange(1, half + 1, dtype=numpy.int64), n)) % n
+    if(k % 2 != 0):
+        "Connect every node to the node directly opposite it"
+        opposite = numpy.arange(n // 2, dtype=numpy.int64)
+        src = numpy.concatenate((src, opposite))
+        dst = numpy.concatenate((dst, opposite + n // 2))
+
+    def pairKey(a, b):
+        return a * n + b if a < b else b * n + a
+
+    def isLatticeEdge(a, b):
+        distance = (b - a) % n
+        distance = min(distance, n - distance)
+        return (0 < distance <= half) or (k % 2 != 0 and 2 * distance == n)
+
+    removed = set()
+    added = set()
+
+    def hasEdge(a, b):
+        key = pairKey(a, b)
+        if(key in added):
+            return True
+        if(key in removed):
+            return False
+        return isLatticeEdge(a, b)
+
+    "Decide which clockwise lattice edges get rewired (in the same order SocialSphere.rewire visits them)"
+    rewired = numpy.flatnonzero(RandomStreams.bulk(rng).random_sample(half * n) <= p)
+    for position in rewired.tolist():
+        index = int(src[position])
+        neighbourIndex = int(dst[position])
+        if(not hasEdge(index, neighbourIndex)):
+            continue
+
+        "Pick a node to move the edge to by rejection sampling, falling back on a full scan if the node is connected to almost everyone"
+        targetIndex = -1
+        for attempt in range(32):
+            candidate = rng.randint(0, n-1)
+            if(candidate != index and candidate != neighbourIndex and not hasEdge(index, candidate)):
+                targetIndex = candidate
+                break
+        if(targetIndex == -1):
+            candidates = [c for c in range(n) if c != index and c != neighbourIndex and not hasEdge(index, c)]
+            if(len(candidates) == 0):
+                continue
+            targetIndex = rng.choice(candidates)
+
+        "Rewire the edge"
+        oldKey = pairKey(index, neighbourIndex)
+        if(oldKey in added):
+            added.discard(oldKey)
+        else:
+            removed.add(oldKey)
+        newKey = pairKey(index, targetIndex)
+        if(newKey in removed):
+            removed.discard(newKey)
+        else:
+            added.add(newKey)
+        dst[position] = targetIndex
+
+    return src, dst
+
+def edgeChunks(filename, chunkBytes=64*1024*1024):
+    """
+    Reads an edge list file a chunk at a time, and yields each chunk as an array with one row per edge (the ids of its two nodes)
+    Binary files (.npy) hold a 2 column integer array, and are memory mapped. Text files have one edge per line: two integer node ids
+    separated by whitespace or a comma, optionally followed by more columns (e.g. weights or timestamps, which needn't be integers), which
+    are ignored. Lines starting with '#' or '%' are comments
+    """
+    if(filename.endswith('.npy')):
+        edges = numpy.load(filename, mmap_mode='r')
+        if(edges.ndim != 2 or edges.shape[1] < 2):
+            raise ValueError('binary edge list must be an array with 2 columns')
+        rowsPerChunk = max(1, chunkBytes // (edges.shape[1] * edges.itemsize))
+        for start in range(0, len(edges), rowsPerChunk):
+            yield numpy.array(edges[start:start+rowsPerChunk, :2], dtype=numpy.int64)
+        return
+
+    numColumns = None
+    with open(filename) as fin:
+        while(True):
+            lines = fin.readlines(chunkBytes)
+            if(not lines):
+                break
+            lines = [line for line in lines if line.strip() and line.lstrip()[0] not in '#%']
+            if(not lines):
+                continue
+            if(numColumns is None):
+                numColumns = len(lines[0].replace(',', ' ').split())
+                if(numColumns < 2):
+                    raise ValueError('edge list lines need two node ids')
+            text = ''.join(lines).replace(',', ' ')
+            if(numColumns > 2):
+                "Only the node ids are parsed, so drop the other columns from each line first"
+                text = ' '.join([' '.join(line.split(None, 2)[:2]) for line in text.splitlines()])
+            values = numpy.fromstring(text, dtype=numpy.int64, sep=' ')
+            if(len(values) != len(lines) * 2):
+                raise ValueError('every line of an edge list needs the same number of columns' if numColumns == 2 else 'edge list lines need two node ids')
+            yield values.reshape(-1, 2)
+
+def renumber(low, high):
+    """
+    Given the two node ids of every edge (as arrays of any integers), renumbers the nodes 0..n-1 in increasing order of id
+    Returns (labels, low, high), where labels[i] is the original id of node i, and low and high are the renumbered edges
+    If the ids are fairly dense (as in most edge list files), a lookup table is used instead of sorting
+    """
+    if(len(low) == 0):
+        return numpy.zeros(0, dtype=numpy.int64), low, high
+    smallest = int(min(low.min(), high.min()))
+    span = int(max(low.max(), high.max())) - smallest + 1
+    if(span <= 4 * (len(low) + len(high))):
+        present = numpy.zeros(span, dtype=bool)
+        present[low - smallest] = True
+        present[high - smallest] = True
+        newIds = numpy.cumsum(present) - 1
+        return numpy.flatnonzero(present) + smallest, newIds[low - smallest], newIds[high - smallest]
+    labels, inverse = numpy.unique(numpy.concatenate((low, high)), return_inverse=True)
+    return labels, inverse[:len(low)], inverse[len(low):]
+
+def readEdgeList(filename, chunkBytes=64*1024*1024):
+    """
+    Reads a network from an edge list file (see edgeChunks), streaming it a chunk at a time
+    Node ids in the file can be any integers. They're renumbered 0..n-1 (in increasing order of file id), self loops are dropped, and
+    each edge is kept only once (whichever direction, and however many times, it appears in the file)
+    Returns (labels, src, dst, stats): labels[i] is the file id of node i, src[j]-dst[j] are the edges, and stats is a dictionary with
+    the number of edges read and kept, the number of nodes, the time taken and the edges read per second
+    """
+    start = timeit.default_timer()
+    lows = []
+    highs = []
+    numRead = 0
+    for chunk in edgeChunks(filename, chunkBytes):
+        numRead = numRead + len(chunk)
+        "Drop self loops, and store each edge with its smaller id first, so that duplicates line up"
+        chunk = chunk[chunk[:, 0] != chunk[:, 1]]
+        lows.append(chunk.min(axis=1))
+        highs.append(chunk.max(axis=1))
+    low = numpy.concatenate(lows) if lows else numpy.zeros(0, dtype=numpy.int64)
+    high = numpy.concatenate(highs) if highs else numpy.zeros(0, dtype=numpy.int64)
+    lows = highs = None
+
+    "Renumber nodes 0..n-1 (renumbering keeps the order, so each edge still has its smaller id first)"
+    labels, low, high = renumber(low, high)
+    n = len(labels)
+
+    "Remove duplicate edges"
+    keys = numpy.unique(low * n + high)
+    src = keys // n
+    dst = keys % n
+
+    seconds = timeit.default_timer() - start
+    stats = {'edges_read': numRead, 'edges': len(keys), 'nodes': n, 'seconds': seconds, 'edges_per_second': numRead / seconds if seconds > 0 else 0.0}
+    return labels, src, dst, stats
@@ -7,6 +7,12 @@ Copyright 2011 Allen B. Downey.
 Distributed under the GNU General Public License at gnu.org/licenses/gpl.html.
 """
 
+import collections
+import json
+import numpy
+import os
+import struct
+
 class Vertex(object):
     """A Vertex is a node in a graph."""
 
@@ -45,13 +51,46 @@ class Edge(tuple):
     """The str and repr forms of this object are the same."""
 
 
+class VertexList(object):
+    """A VertexList is a read-only list of vertices, made from an
+    array of labels. Each Vertex is only created the first time it
+    is looked up (and then kept, so it is always the same object),
+    which lets big graphs be opened without making millions of
+    Vertex objects up front."""
+
+    def __init__(self, labels):
+        self.labels = labels
+        self.made = {}
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __getitem__(self, i):
+        v = self.made.get(i)
+        if v is None:
+            v = Vertex(str(self.labels[i].decode('utf-8')))
+            self.made[i] = v
+        return v
+
+    def __iter__(self):
+        for i in range(len(self.labels)):
+            yield self[i]
+
+
 class Graph(dict):
     """A Graph is a dictionary of dictionaries.  The outer
     dictionary maps from a vertex to an inner dictionary.
     The inner dictionary maps from other vertices to edges.
 
     For vertices a and b, graph[a][b] maps
-    to the edge that connects a->b, if it exists."""
+    to the edge that connects a->b, if it exists.
+
+    version is bumped every time the graph is changed, so that
+    derived structures (see freeze) know when they are out of date."""
+
+    version = 0
+    _edges = None
+    _edgesVersion = -1
 
     def __init__(self, vs=[], es=[]):
         """Creates a new graph.
@@ -67,6 +106,7 @@ class Graph(dict):
     def add_vertex(self, v):
         """Add a vertex to the graph."""
         self[v] = {}
+        self.version = self.version + 1
 
     def add_edge(self, e):
         """Adds and edge to the graph by adding an entry in both directions.
@@ -77,6 +117,7 @@ class Graph(dict):
         v, w = e
         self[v][w] = e
         self[w][v] = e
+        self.version = self.version + 1
 
     def get_edge(self, v1, v2):
         """Take two vertices and return the edge between them if it exists, and None otherwise"""
@@ -94,21 +135,19 @@ class Graph(dict):
             del self[w][v]
         except:
             pass
+        self.version = self.version + 1
 
     def vertices(self):
         """Return a list of the vertices in the graph"""
-        nodes = []
-        for i in self.keys():
-            nodes.append(i)
-        return nodes
+        return list(self)
 
     def edges(self):
-        """Return a list of the edges in the graph"""
-        edge_set = set()
-        for i in self.keys():
-            for j in self[i].keys():
-                edge_set.add(self[i][j])
-        return edge_set
+        """Return a set of the edges in the graph. The set is cached,
+        and only rebuilt if the graph has changed since it was made."""
+        if self._edges is None or self._edgesVersion != self.version:
+            self._edges = set(e for i in self for e in self[i].values())
+            self._edgesVersion = self.version
+        return set(self._edges)
 
     def out_vertices(self, v):
         """"Method takes a vertex and returns a list of its adjacent vertices"""
@@ -130,6 +169,17 @@ class Graph(dict):
             pass
         return adjacentEdges
 
+    def freeze(self):
+        """Returns an immutable compressed sparse row (CSR) copy of the graph.
+        Vertices are given integer ids in the order of vertices()."""
+        vs = self.vertices()
+        ids = {}
+        for i in range(len(vs)):
+            ids[vs[i]] = i
+        degree = numpy.array([len(self[v]) for v in vs], dtype=numpy.int64)
+        indices = numpy.fromiter((ids[w] for v in vs for w in self[v]), dtype=numpy.int64, count=int(degree.sum()))
+        return CSRGraph(vs, degree, indices)
+
     def add_all_edges(self):
         """Method takes a graph with no edges, and makes it complete"""
         vertices = self.vertices() #Get all vertices
@@ -142,6 +192,7 @@ class Graph(dict):
                 else:
                     #Add edge between pair of vertices
                     self[vertices[i]][vertices[j]] = Edge(vertices[i], vertices[j])
+        self.version = self.version + 1
 
     # via https://gist.github.com/yosemitebandit/625ae47565ae828cc417
     # Though I did fix a mistake in the originally retrieved code
@@ -173,49 +224,510 @@ class Graph(dict):
 
     def is_regular(self):
         """Checks if the graph is regular. Returns true if it is; false otherwise"""
-        lastDeg = 0
-        curDeg = 0
-        firstIteration = True
-
-        #Loop over all vertices in graph
-        for curNode in self.keys():
-            #Ensure degrees of current node and last node are the same
-            if(lastDeg != curDeg):
-                return False
-            #Update current and last node's degrees
-            lastDeg = curDeg
-            curDeg = len(self[curNode])
-            #Special code for first iteration
-            if(firstIteration):
-                firstIteration = False
-                lastDeg = curDeg
-
-        #Check very last node in graph (won't be checked in loop)
-        if(lastDeg != curDeg):
-                return False
-        #If method hasn't returned yet, graph is regular
-        return True
+        degrees = set(len(self[v]) for v in self)
+        return len(degrees) <= 1
 
     def is_connected(self):
         """Checks if the graph is connected. Returns true if it is, false otherwise"""
-        visited = [] #List of visited nodes
-        q = [] #Queue for BFS
-        vs = self.keys() #Nodes in graph
-        q.append(vs[0]) #Starting node
-        visited.append(vs[0]) #Visit first node
+        if len(self) == 0:
+            return True
+        start = next(iter(self)) #Starting node
+        visited = set([start]) #Set of visited nodes
+        q = collections.deque([start]) #Queue for BFS
 
         #Perform BFS
-        while(len(q) > 0):
-            #Pop node off top of queue
-            curNode = q.pop(0)
+        while q:
+            #Pop node off front of queue
+            curNode = q.popleft()
             #Visit any unvisited adjacent nodes, and add them to end of queue
-            for i in self[curNode].keys():
+            for i in self[curNode]:
                 if i not in visited:
+                    visited.add(i)
                     q.append(i)
-                    visited.append(i)
 
         #Check if graph is connected
-        if(len(visited) == len(vs)):
-            return True
-        else:
-            return False
+        return len(visited) == len(self)
+
+
+class CSRGraph(object):
+    """A CSRGraph is an immutable, array based copy of an undirected
+    graph in compressed sparse row form.
+
+    Vertices are numbered 0..n-1. The neighbours of vertex i are
+    indices[indptr[i]:indptr[i+1]], and degree[i] is how many there are.
+    vertices[i] is the original Vertex (if there is one), and ids maps
+    it back to i."""
+
+    def __init__(self, vertices, degree, indices):
+        """Creates a new CSR graph.
+        vertices: list of vertices (or labels), one per id;
+        degree: array of vertex degrees;
+        indices: concatenated neighbour ids of every vertex (any
+        integer type, so that they can be stored compactly).
+        """
+        self.vertices = vertices
+        self.size = len(vertices)
+        self.degree = numpy.asarray(degree, dtype=numpy.int64)
+        self.indptr = numpy.zeros(self.size + 1, dtype=numpy.int64)
+        numpy.cumsum(self.degree, out=self.indptr[1:])
+        self.indices = numpy.asarray(indices)
+        if not numpy.issubdtype(self.indices.dtype, numpy.integer):
+            self.indices = self.indices.astype(numpy.int64)
+        for a in (self.degree, self.indptr, self.indices):
+            if a.flags.writeable:
+                a.setflags(write=False)
+
+        self._rows = None
+        self._degree_list = None
+        self._ids = None
+
+    @property
+    def ids(self):
+        """Dictionary mapping each vertex to its id. Built on first use."""
+        if self._ids is None:
+            self._ids = dict(zip(self.vertices, range(self.size)))
+        return self._ids
+
+    @classmethod
+    def from_edges(cls, vertices, src, dst):
+        """Builds a CSR graph from two arrays of vertex ids, where
+        src[j]-dst[j] is an undirected edge. Each edge should appear once."""
+        src = numpy.asarray(src, dtype=numpy.int64)
+        dst = numpy.asarray(dst, dtype=numpy.int64)
+        rows = numpy.concatenate((src, dst))
+        cols = numpy.concatenate((dst, src))
+        order = numpy.argsort(rows)
+        degree = numpy.bincount(rows, minlength=len(vertices))
+        return cls(vertices, degree, cols[order])
+
+    def __len__(self):
+        return self.size
+
+    def neighbours(self, i):
+        """Returns the ids of the vertices adjacent to vertex i"""
+        return self.indices[self.indptr[i]:self.indptr[i+1]]
+
+    def thaw(self):
+        """Returns a new (mutable) Graph with the same vertices and edges.
+        vertices must be Vertex objects."""
+        g = Graph(self.vertices)
+        for i in range(self.size):
+            v = self.vertices[i]
+            for j in self.neighbours(i).tolist():
+                if i < j:
+                    g.add_edge(Edge(v, self.vertices[j]))
+        return g
+
+    def edges_from(self, ids):
+        """Returns the edges out of the given vertices, as two arrays
+        (positions, cols): positions[j] is the position in ids of the
+        vertex that edge j comes from, and cols[j] is where it goes."""
+        ids = numpy.asarray(ids, dtype=numpy.int64)
+        lengths = self.degree[ids]
+        ends = numpy.cumsum(lengths)
+        positions = numpy.repeat(numpy.arange(len(ids)), lengths)
+        offsets = numpy.arange(ends[-1] if len(ends) else 0) + numpy.repeat(self.indptr[ids] - ends + lengths, lengths)
+        return positions, self.indices[offsets]
+
+    MAGIC = b'CSRGRAPH'
+    """First bytes of a file written by save."""
+
+    ALIGN = 64
+    """Arrays in a saved file start on multiples of this many bytes."""
+
+    def labels(self):
+        """Returns the label of every vertex as an array of byte strings."""
+        if isinstance(self.vertices, VertexList):
+            return self.vertices.labels
+        return numpy.array([v.getLabel().encode('utf-8') for v in self.vertices])
+
+    def save(self, filename):
+        """Writes the graph to a compact binary file, which load can
+        memory map. The file holds MAGIC, the length of a JSON header,
+        the header (which gives the dtype, shape and offset of each
+        array), and then the arrays themselves. Neighbour ids are
+        stored as 32 bit integers if they fit. The file is written
+        under a temporary name and then renamed, so a half written
+        file is never left behind."""
+        index_type = numpy.int32 if self.size < 2**31 else numpy.int64
+        arrays = [('degree', self.degree.astype('<i8')),
+                  ('indices', self.indices.astype(numpy.dtype(index_type).newbyteorder('<'))),
+                  ('labels', self.labels())]
+
+        "Work out where each array goes, leaving room for the header"
+        header = {'version': 1, 'size': self.size, 'arrays': {}}
+        offset = self.ALIGN * 1024
+        for name, a in arrays:
+            header['arrays'][name] = {'dtype': a.dtype.str, 'shape': list(a.shape), 'offset': offset}
+            offset = offset + (a.nbytes + self.ALIGN - 1) // self.ALIGN * self.ALIGN
+        text = json.dumps(header).encode('ascii')
+        if len(self.MAGIC) + 8 + len(text) > self.ALIGN * 1024:
+            raise ValueError('graph header too big')
+
+        temporary = filename + '.tmp'
+        with open(temporary, 'wb') as fout:
+            fout.write(self.MAGIC)
+            fout.write(struct.pack('<Q', len(text)))
+            fout.write(text)
+            for name, a in arrays:
+                fout.seek(header['arrays'][name]['offset'])
+                fout.write(a.tostring())
+        os.rename(temporary, filename)
+
+    @classmethod
+    def load(cls, filename, mmap=True):
+        """Opens a graph written by save. With mmap, the arrays are
+        memory mapped rather than read in, so opening is near instant,
+        and processes that open the same file share one copy of it.
+        Vertices are only made when they are looked up (see
+        VertexList)."""
+        with open(filename, 'rb') as fin:
+            if fin.read(len(cls.MAGIC)) != cls.MAGIC:
+                raise ValueError('%s is not a saved CSR graph' % filename)
+            length = struct.unpack('<Q', fin.read(8))[0]
+            header = json.loads(fin.read(length).decode('ascii'))
+            arrays = {}
+            for name, info in header['arrays'].items():
+                dtype = numpy.dtype(str(info['dtype']))
+                shape = tuple(info['shape'])
+                if mmap and numpy.prod(shape) > 0:
+                    arrays[name] = numpy.memmap(filename, dtype=dtype, mode='r', offset=info['offset'], shape=shape)
+                else:
+                    fin.seek(info['offset'])
+                    arrays[name] = numpy.fromfile(fin, dtype=dtype, count=int(numpy.prod(shape))).reshape(shape)
+        return cls(VertexList(arrays['labels']), arrays['degree'], arrays['indices'])
+
+    def num_edges(self):
+        """Returns the number of (undirected) edges in the graph"""
+        return len(self.indices) // 2
+
+    def compact(self):
+        """Returns a packed CSRGraph of the graph (itself, since a
+        CSRGraph is always packed; see DynamicCSRGraph)."""
+        return self
+
+    def degree_list(self):
+        """Returns degree as a plain list, which is faster than the array
+        for element-at-a-time access from Python loops. Cached."""
+        if self._degree_list is None:
+            self._degree_list = self.degree.tolist()
+        return self._degree_list
+
+    def rows(self):
+        """Returns, for every entry of indices, the id of the vertex it
+        belongs to (i.e. the COO row array). Computed once and cached."""
+        if self._rows is None:
+            self._rows = numpy.repeat(numpy.arange(self.size), self.degree)
+            self._rows.setflags(write=False)
+        return self._rows
+
+    def neighbour_sum(self, values):
+        """Returns the sparse adjacency matrix-vector product A.values,
+        i.e. for each vertex, the sum of values over its neighbours"""
+        return numpy.bincount(self.rows(), weights=values[self.indices], minlength=self.size)
+
+
+class DynamicCSRGraph(CSRGraph):
+    """A DynamicCSRGraph is a copy of a CSRGraph that edges can be
+    added to and removed from, without rebuilding anything.
+
+    Rows are no longer packed: row i starts at indptr[i] and has room
+    for capacity[i] neighbours, of which the first degree[i] are used.
+    Unused slots hold the id size (one past the last vertex), and
+    slot_row[s] is the row slot s belongs to. twin[s] is the slot
+    holding the other direction of the edge in slot s, so an edge can be
+    removed in constant time. A row that runs out of room is moved to
+    the end of indices with twice the room (the old slots are left
+    unused, and everything is packed again once over half the slots are
+    unused), so adding an edge takes constant time on average.
+
+    Degrees are also kept in a Fenwick tree, so that a vertex can be
+    picked with probability proportional to its degree (or an edge
+    picked uniformly) in O(log n), and in buckets of vertices by degree,
+    so that the largest degree, and the vertices with any given degree,
+    are always known. Removing an edge keeps the order of the rest of
+    its row, apart from moving the row's last neighbour into the gap,
+    so the same changes always give the same graph however it is laid
+    out."""
+
+    def __init__(self, csr, slack=0.25):
+        """Creates a dynamic copy of a CSR graph, giving every row room
+        for slack times its degree more neighbours (and at least 2)."""
+        self.vertices = csr.vertices
+        self.size = csr.size
+        self.degree = numpy.array(csr.degree, dtype=numpy.int64)
+        self.capacity = self.degree + numpy.maximum(2, (self.degree * slack).astype(numpy.int64))
+        self.indptr = numpy.zeros(self.size + 1, dtype=numpy.int64)
+        numpy.cumsum(self.capacity, out=self.indptr[1:])
+        self.end = int(self.indptr[-1])
+        self.unused = 0
+
+        "Copy every row to the start of its slots"
+        rows = csr.rows()
+        slots = self.indptr[rows] + (numpy.arange(len(csr.indices)) - csr.indptr[rows])
+        self.indices = numpy.empty(self.end, dtype=numpy.int64)
+        self.indices.fill(self.size)
+        self.indices[slots] = csr.indices
+        self.slot_row = numpy.repeat(numpy.arange(self.size), self.capacity)
+
+        "The twin of the entry for edge i-j is the entry for j-i"
+        cols = numpy.asarray(csr.indices, dtype=numpy.int64)
+        keys = rows * self.size + cols
+        order = numpy.argsort(keys)
+        self.twin = numpy.empty(self.end, dtype=numpy.int64)
+        self.twin.fill(-1)
+        self.twin[slots] = slots[order][numpy.searchsorted(keys[order], cols * self.size + rows)]
+
+        self._rows = None
+        self._ids = None
+        self._degree_list = self.degree.tolist()
+        self.total = int(self.degree.sum())
+
+        "Fenwick tree over the degrees: tree[i] is the sum of the degrees of vertices i-(i&-i) to i-1"
+        self.tree = [0] + self._degree_list
+        for i in range(1, self.size + 1):
+            parent = i + (i & -i)
+            if parent <= self.size:
+                self.tree[parent] += self.tree[i]
+        self.top_bit = 1
+        while self.top_bit * 2 <= self.size:
+            self.top_bit *= 2
+
+        self.buckets = {}
+        for i in range(self.size):
+            self.buckets.setdefault(self._degree_list[i], set()).add(i)
+        self.largest = max(self.buckets) if self.size > 0 else 0
+
+    def neighbours(self, i):
+        """Returns the ids of the vertices adjacent to vertex i"""
+        start = self.indptr[i]
+        return self.indices[start:start + self.degree[i]]
+
+    def num_edges(self):
+        """Returns the number of (undirected) edges in the graph"""
+        return self.total // 2
+
+    def degree_list(self):
+        """Returns degree as a plain list, kept up to date as edges
+        change."""
+        return self._degree_list
+
+    def rows(self):
+        """Returns the row of every slot in use so far (unused slots,
+        whose indices are size, included)."""
+        return self.slot_row[:self.end]
+
+    def neighbour_sum(self, values):
+        """Returns the sparse adjacency matrix-vector product A.values,
+        i.e. for each vertex, the sum of values over its neighbours"""
+        values = numpy.append(values, 0.0)
+        return numpy.bincount(self.slot_row[:self.end], weights=values[self.indices[:self.end]], minlength=self.size)
+
+    def compact(self):
+        """Returns a packed (immutable) CSRGraph of the graph as it is
+        now, with every row in the same order."""
+        positions, cols = self.edges_from(numpy.arange(self.size))
+        return CSRGraph(self.vertices, self.degree.copy(), cols)
+
+    def save(self, filename):
+        """Writes the graph as it is now to a file (see CSRGraph.save)"""
+        self.compact().save(filename)
+
+    def largest_degree(self):
+        """Returns the largest degree of any vertex"""
+        return self.largest
+
+    def average_degree(self):
+        """Returns the average degree of a vertex"""
+        return float(self.total) / self.size if self.size > 0 else 0.0
+
+    def vertices_with_degree(self, d):
+        """Returns the set of ids of the vertices with degree d"""
+        return self.buckets.get(d, set())
+
+    def has_edge(self, i, j):
+        """Returns whether or not vertices i and j are adjacent, looking
+        through the neighbours of whichever has fewer."""
+        if self._degree_list[i] > self._degree_list[j]:
+            i, j = j, i
+        return bool((self.neighbours(i) == j).any())
+
+    def find(self, r):
+        """Returns (i, rank): the vertex whose share of the degree total
+        holds r (0 <= r < total), and r's position within it. Picking r
+        uniformly picks an edge end uniformly: vertex i, and the slot
+        indptr[i] + rank."""
+        i = 0
+        step = self.top_bit
+        while step > 0:
+            if i + step <= self.size and self.tree[i + step] <= r:
+                i += step
+                r -= self.tree[i]
+            step //= 2
+        return i, r
+
+    def pick_slot(self, rng):
+        """Returns the slot of an edge end picked uniformly at random
+        (so the edge is uniform too, and its row's vertex is picked
+        with probability proportional to its degree)."""
+        i, rank = self.find(rng.randrange(self.total))
+        return int(self.indptr[i]) + rank
+
+    def pick_vertex(self, rng):
+        """Returns a vertex picked with probability proportional to its
+        degree (preferential attachment)."""
+        return self.find(rng.randrange(self.total))[0]
+
+    def change_degree(self, i, delta):
+        """Updates the degree of vertex i (and the degree total, Fenwick
+        tree, buckets and largest degree) by delta."""
+        old = self._degree_list[i]
+        new = old + delta
+        self.degree[i] = new
+        self._degree_list[i] = new
+        self.total += delta
+        j = i + 1
+        while j <= self.size:
+            self.tree[j] += delta
+            j += j & -j
+        bucket = self.buckets[old]
+        bucket.discard(i)
+        if not bucket:
+            del self.buckets[old]
+        self.buckets.setdefault(new, set()).add(i)
+        if new > self.largest:
+            self.largest = new
+        while self.largest > 0 and self.largest not in self.buckets:
+            self.largest -= 1
+
+    def grow(self, needed):
+        """Makes room for at least needed more slots at the end of
+        indices (doubling the arrays, so this is rare)."""
+        length = len(self.indices)
+        if self.end + needed <= length:
+            return
+        length = max(2 * length, self.end + needed)
+        indices = numpy.empty(length, dtype=numpy.int64)
+        indices.fill(self.size)
+        indices[:self.end] = self.indices[:self.end]
+        twin = numpy.empty(length, dtype=numpy.int64)
+        twin.fill(-1)
+        twin[:self.end] = self.twin[:self.end]
+        slot_row = numpy.zeros(length, dtype=numpy.int64)
+        slot_row[:self.end] = self.slot_row[:self.end]
+        self.indices, self.twin, self.slot_row = indices, twin, slot_row
+
+    def move_row(self, i, capacity):
+        """Moves row i to the end of indices, with room for capacity
+        neighbours."""
+        self.grow(capacity)
+        start = int(self.indptr[i])
+        d = self._degree_list[i]
+        old = numpy.arange(start, start + d)
+        new = numpy.arange(self.end, self.end + d)
+        self.indices[new] = self.indices[old]
+        self.twin[new] = self.twin[old]
+        self.twin[self.twin[new]] = new
+        self.slot_row[self.end:self.end + capacity] = i
+        self.indices[start:start + self.capacity[i]] = self.size
+        self.twin[start:start + self.capacity[i]] = -1
+        self.unused += int(self.capacity[i])
+        self.indptr[i] = self.end
+        self.capacity[i] = capacity
+        self.end += capacity
+        self.indptr[-1] = self.end
+
+    def pack(self):
+        """Moves every row back next to each other (in the same order,
+        each with the same amount of room), dropping unused slots."""
+        order = numpy.arange(self.size)
+        starts = numpy.zeros(self.size + 1, dtype=numpy.int64)
+        numpy.cumsum(self.capacity, out=starts[1:])
+        rows, cols = self.edges_from(order)
+        "Position of every entry within its row"
+        within = numpy.arange(len(cols)) - numpy.repeat(numpy.cumsum(self.degree) - self.degree, self.degree)
+        old = self.indptr[rows] + within
+        new = starts[rows] + within
+        moved = numpy.empty(len(self.indices), dtype=numpy.int64)
+        moved[old] = new
+        self.end = int(starts[-1])
+        indices = numpy.empty(self.end, dtype=numpy.int64)
+        indices.fill(self.size)
+        indices[new] = cols
+        twin = numpy.empty(self.end, dtype=numpy.int64)
+        twin.fill(-1)
+        twin[new] = moved[self.twin[old]]
+        self.indices, self.twin = indices, twin
+        self.slot_row = numpy.repeat(order, self.capacity)
+        self.indptr = starts
+        self.unused = 0
+
+    def append(self, i, j):
+        """Adds j to the end of row i (making room if needed), and
+        returns its slot."""
+        d = self._degree_list[i]
+        if d == self.capacity[i]:
+            self.move_row(i, 2 * d + 2)
+            if self.unused > self.end // 2:
+                self.pack()
+        slot = int(self.indptr[i]) + d
+        self.indices[slot] = j
+        return slot
+
+    def add_edge(self, i, j):
+        """Adds an edge between vertices i and j, which must be different
+        and not already adjacent."""
+        self.append(i, j)
+        self.change_degree(i, 1)
+        sj = self.append(j, i)
+        self.change_degree(j, 1)
+        "Making room in row j may have packed everything, moving row i"
+        si = int(self.indptr[i]) + self._degree_list[i] - 1
+        self.twin[si] = sj
+        self.twin[sj] = si
+
+    def remove_entry(self, slot):
+        """Removes the entry in slot from its row, moving the row's last
+        entry into its place."""
+        i = int(self.slot_row[slot])
+        last = int(self.indptr[i]) + self._degree_list[i] - 1
+        if slot != last:
+            self.indices[slot] = self.indices[last]
+            self.twin[slot] = self.twin[last]
+            self.twin[self.twin[slot]] = slot
+        self.indices[last] = self.size
+        self.twin[last] = -1
+        self.change_degree(i, -1)
+
+    def remove_slot(self, slot):
+        """Removes the edge in slot (both directions of it). Returns the
+        two vertices it joined."""
+        i = int(self.slot_row[slot])
+        j = int(self.indices[slot])
+        other = int(self.twin[slot])
+        self.remove_entry(slot)
+        self.remove_entry(other)
+        return i, j
+
+    def move_end(self, slot, k):
+        """Moves the far end of the edge in slot to vertex k (which must
+        not be the slot's own vertex, or already adjacent to it), keeping
+        the edge in the same place in its row. Returns the vertex the
+        edge used to go to."""
+        i = int(self.slot_row[slot])
+        j = int(self.indices[slot])
+        rank = slot - int(self.indptr[i])
+        self.remove_entry(int(self.twin[slot]))
+        sk = self.append(k, i)
+        self.change_degree(k, 1)
+        "Making room in row k may have packed everything, moving row i"
+        slot = int(self.indptr[i]) + rank
+        self.indices[slot] = k
+        self.twin[slot] = sk
+        self.twin[sk] = slot
+        return j
+
+    def remove_edge(self, i, j):
+        """Removes the edge between vertices i and j, which must be
+        adjacent."""
+        self.remove_slot(int(self.indptr[i]) + int(numpy.flatnonzero(self.neighbours(i) == j)[0]))
@@ -0,0 +1,63 @@
+import numpy
+
+class MarketHistory(object):
+    """
+    Record of every investor's stance (inside/outside the market) at every timestep, owned by the simulation
+    Each timestep is stored as one bit-packed row (one bit per investor, indexed by the investor's id in the social sphere's CSR form)
+    If a window is given, only the most recent window timesteps are kept (in a ring buffer). If maxBytes is given, the window is capped
+    so that the stored rows never take more than maxBytes
+    """
+
+    def __init__(self, numInvestors, window=None, maxBytes=None):
+        self.numInvestors = numInvestors
+        self.rowBytes = (numInvestors + 7) // 8
+        if(maxBytes):
+            maxRows = max(1, maxBytes // self.rowBytes)
+            window = min(window, maxRows) if window else maxRows
+        self.window = window
+
+        "Number of timesteps recorded so far (including any that have since been dropped from the window)"
+        self.numRecorded = 0
+        self.rows = numpy.zeros((window if window else 16, self.rowBytes), dtype=numpy.uint8)
+
+    def __len__(self):
+        "Returns the number of timesteps currently held"
+        return min(self.numRecorded, len(self.rows)) if self.window else self.numRecorded
+
+    def firstTime(self):
+        "Returns the earliest timestep still held"
+        return self.numRecorded - len(self)
+
+    def record(self, inMarket):
+        "Records the stances of all investors (a sequence of booleans, one per investor) as the next timestep"
+        if(not self.window and self.numRecorded == len(self.rows)):
+            "Unbounded history: grow the storage"
+            self.rows = numpy.concatenate((self.rows, numpy.zeros_like(self.rows)))
+        self.rows[self.numRecorded % len(self.rows)] = numpy.packbits(numpy.asarray(inMarket, dtype=bool))
+        self.numRecorded = self.numRecorded + 1
+
+    def slot(self, t):
+        "Returns the row of storage holding timestep t"
+        if(t < self.firstTime() or t >= self.numRecorded):
+            raise IndexError('timestep ' + str(t) + ' is not held in the market history')
+        return t % len(self.rows)
+
+    def atTime(self, t):
+        "Returns the stances of all investors at timestep t, as an array of booleans"
+        return numpy.unpackbits(self.rows[self.slot(t)])[:self.numInvestors].astype(bool)
+
+    def ofInvestor(self, i):
+        "Returns the stance of investor i at every timestep held (oldest first), as an array of booleans"
+        if(len(self) == 0):
+            return numpy.zeros(0, dtype=bool)
+        slots = numpy.arange(self.firstTime(), self.numRecorded) % len(self.rows)
+        column = self.rows[slots, i // 8]
+        return ((column >> (7 - i % 8)) & 1).astype(bool)
+
+    def numInMarket(self, t):
+        "Returns the number of investors inside the market at timestep t"
+        return int(numpy.unpackbits(self.rows[self.slot(t)])[:self.numInvestors].sum())
+
+    def nbytes(self):
+        "Returns the memory used to store the history"
+        return self.rows.nbytes
@@ -0,0 +1,247 @@
+"""
+Incremental tick engine
+Works like VectorEngine, except that herd influence isn't recomputed from every edge of the social sphere at every timestep. Each investor
+keeps running counts of how many of their connections are in the market, recently joined it, or recently left it, split by the
+connections' degree class. When investors change stance (or stop counting as having changed recently), only the counts of their own
+connections are updated, so the cost of a timestep grows with the number of investors that changed, rather than the number of edges
+
+Only connections that can actually push (hubs, and investors whose strength isn't 0) are counted, and each degree class pushes with the
+same range of sizes as in VectorEngine/Market.Investor. Since connections are only known by count, the total push from a class is drawn
+from a normal distribution with the same mean and variance as the sum of the individual pushes (and kept within the range that sum can
+take), instead of drawing one push per connection
+"""
+
+import numpy
+import VectorEngine
+
+class IncrementalEngine(VectorEngine.VectorEngine):
+
+    "An investor counts as having recently changed stance while their lastChange is at most this (see Market.Investor.recentlyJoinedMarket)"
+    RECENT = 20
+    "Most degree classes kept before strengths are grouped into geometric buckets"
+    MAX_CLASSES = 16
+
+    def __init__(self, sphere, investors):
+        VectorEngine.VectorEngine.__init__(self, sphere, investors)
+        "Aggregates are built on the first timestep that needs them (they depend on the largest and average number of connections)"
+        self.classKey = None
+        self.counts = None
+        self.ticksRun = 0
+
+    def buildClasses(self, largestNumConnections, averageNumConnections):
+        """
+        Splits investors into degree classes: class 0 holds hubs, and the rest hold investors of each strength (grouped into geometric
+        buckets if there are too many different strengths). Investors that can't push their connections are in class -1
+        Sets classOf (class of every investor), and classStrength (strength of every class; unused for hubs), along with what's needed
+        to move investors between classes later (see edgesChanged)
+        """
+        "Same strength and hub rules as in Market.Investor (see SocialSphere.NodeStats)"
+        stats = self.sphere.get_node_stats(largestNumConnections, averageNumConnections)
+        hubs = stats.hub
+        strengths = stats.strength
+        pushing = (~hubs) & (strengths > 0)
+        values = numpy.unique(strengths[pushing])
+        if(len(values) < self.MAX_CLASSES):
+            buckets = numpy.searchsorted(values, strengths)
+            self.classValues = values
+        else:
+            "Too many different strengths: group them by powers of 2"
+            buckets = numpy.minimum(numpy.floor(-numpy.log2(numpy.where(pushing, strengths, 1.0))), self.MAX_CLASSES - 2).astype(numpy.int64)
+            self.classValues = None
+        numClasses = int(buckets[pushing].max()) + 2 if pushing.any() else 1
+        self.classOf = numpy.where(hubs, 0, numpy.where(pushing, buckets + 1, -1))
+        "The strength of each class is the mean strength of its members, so keep their number and total"
+        self.strengthOf = strengths.copy()
+        members = self.classOf >= 1
+        self.classSize = numpy.bincount(self.classOf[members], minlength=numClasses).astype(numpy.float64)
+        self.classTotal = numpy.bincount(self.classOf[members], weights=strengths[members], minlength=numClasses)
+        self.numClasses = numClasses
+        self.updateClassStrength()
+
+    def updateClassStrength(self):
+        "Works out the strength of every class (other than hubs) from the number and total strength of its members"
+        self.classStrength = numpy.where(self.classSize > 0, self.classTotal / numpy.maximum(self.classSize, 1.0), 0.0)
+        self.classStrength[0] = 0.0
+
+    def flags(self, ids):
+        "Returns whether each of the given investors is in the market, recently joined it, and recently left it, as a 3 x len(ids) array"
+        inMarket = self.inMarket[ids]
+        recent = self.lastChange[ids] <= self.RECENT
+        return numpy.array([inMarket, recent & inMarket, recent & ~inMarket], dtype=numpy.float64)
+
+    def build(self, largestNumConnections, averageNumConnections):
+        """
+        Builds every investor's counts from scratch
+        counts[0], counts[1] and counts[2] hold, for each investor and degree class, the number of connections that are in the market,
+        that recently joined, and that recently left. classDegree holds the number of connections in each class
+        """
+        self.buildClasses(largestNumConnections, averageNumConnections)
+        self.classKey = (largestNumConnections, averageNumConnections)
+        pushing = numpy.flatnonzero(self.classOf >= 0)
+        positions, cols = self.csr.edges_from(pushing)
+        self.neighbourVisits = self.neighbourVisits + len(cols)
+        bins = cols * self.numClasses + self.classOf[pushing][positions]
+        flags = self.flags(pushing)
+        shape = (self.size, self.numClasses)
+        self.classDegree = numpy.bincount(bins, minlength=self.size * self.numClasses).astype(numpy.float64).reshape(shape)
+        self.counts = numpy.array([numpy.bincount(bins, weights=flags[k][positions], minlength=self.size * self.numClasses).reshape(shape) for k in range(3)])
+        "Only investors with at least one connection that can push them are influenced at all"
+        self.influenced = numpy.flatnonzero(self.classDegree.any(axis=1))
+
+        "Schedule every investor that currently counts as having changed recently to stop counting once they no longer do (including"
+        "investors that can't push yet, in case the social sphere changes so that they can)"
+        self.expiries = {}
+        lastChange = self.lastChange
+        for ticks in numpy.unique(self.RECENT + 1 - lastChange[lastChange <= self.RECENT]):
+            self.expiries[self.ticksRun + int(ticks)] = numpy.flatnonzero(self.RECENT + 1 - lastChange == ticks)
+
+    def propagate(self, ids, delta):
+        "Given investors and the change in their flags (see flags), updates the counts of all of their connections"
+        pushing = (self.classOf[ids] >= 0) & (delta != 0).any(axis=0)
+        ids = ids[pushing]
+        delta = delta[:, pushing]
+        positions, cols = self.csr.edges_from(ids)
+        self.neighbourVisits = self.neighbourVisits + len(cols)
+        classes = self.classOf[ids][positions]
+        for k in range(3):
+            numpy.add.at(self.counts[k], (cols, classes), delta[k][positions])
+
+    def updateState(self, joiners, leavers):
+        """
+        Updates investor state at the end of a timestep (see VectorEngine.updateState), and then updates the counts of the connections
+        of everyone whose flags changed: the investors that joined or left, and the ones that have stopped counting as recent
+        """
+        self.ticksRun = self.ticksRun + 1
+        if(self.counts is None):
+            VectorEngine.VectorEngine.updateState(self, joiners, leavers)
+            return
+        expiring = self.expiries.pop(self.ticksRun, numpy.zeros(0, dtype=numpy.int64))
+        changed = numpy.unique(numpy.concatenate((joiners, leavers, expiring)).astype(numpy.int64))
+        before = self.flags(changed)
+        VectorEngine.VectorEngine.updateState(self, joiners, leavers)
+        self.propagate(changed, self.flags(changed) - before)
+
+        "Investors that moved will stop counting as recent after RECENT+1 more timesteps (unless they move again first)"
+        movers = numpy.concatenate((joiners, leavers)).astype(numpy.int64)
+        if(len(movers) > 0):
+            self.expiries[self.ticksRun + self.RECENT + 1] = movers
+
+    def classesOf(self, ids, largestNumConnections, averageNumConnections):
+        """
+        Returns the class each of the given investors belongs in now (see buildClasses), or None if any of them needs a class that
+        doesn't exist yet
+        """
+        stats = self.sphere.get_node_stats(largestNumConnections, averageNumConnections)
+        hubs = stats.hub[ids]
+        strengths = stats.strength[ids]
+        pushing = (~hubs) & (strengths > 0)
+        if(self.classValues is not None):
+            buckets = numpy.minimum(numpy.searchsorted(self.classValues, strengths), max(len(self.classValues) - 1, 0))
+            if(((self.classValues[buckets] != strengths) & pushing).any() if len(self.classValues) > 0 else pushing.any()):
+                return None
+        else:
+            buckets = numpy.minimum(numpy.floor(-numpy.log2(numpy.where(pushing, strengths, 1.0))), self.MAX_CLASSES - 2).astype(numpy.int64)
+        classes = numpy.where(hubs, 0, numpy.where(pushing, buckets + 1, -1))
+        if((classes >= self.numClasses).any()):
+            return None
+        return classes
+
+    def link(self, receivers, senders, sign):
+        "Adds (sign 1) or takes away (sign -1) the pushes that senders give receivers (one pair per edge) to the receivers' counts"
+        classes = self.classOf[senders]
+        counted = classes >= 0
+        receivers = receivers[counted]
+        senders = senders[counted]
+        classes = classes[counted]
+        self.neighbourVisits = self.neighbourVisits + len(senders)
+        numpy.add.at(self.classDegree, (receivers, classes), sign)
+        flags = self.flags(senders)
+        for k in range(3):
+            numpy.add.at(self.counts[k], (receivers, classes), sign * flags[k])
+
+    def edgesChanged(self, changes):
+        """
+        Updates the counts after the social sphere's edges have changed (see SocialSphere.churn): each edge removed or added changes the
+        counts of the investors at its two ends, and investors whose class changed (because their number of connections, or the largest
+        or average number, did) have their pushes moved to their new class in the counts of all of their connections
+        This costs O(changes), plus the connections of the investors that changed class. If an investor needs a class that doesn't exist
+        yet, everything is built again on the next timestep instead
+        """
+        VectorEngine.VectorEngine.edgesChanged(self, changes)
+        if(self.counts is None):
+            return
+        for (src, dst), sign in ((changes.removed, -1.0), (changes.added, 1.0)):
+            self.link(numpy.concatenate((src, dst)), numpy.concatenate((dst, src)), sign)
+
+        ids = changes.restatted
+        if(len(ids) > 0):
+            classes = self.classesOf(ids, changes.largest, changes.average)
+            if(classes is None):
+                self.classKey = None
+                return
+            positions, cols = self.csr.edges_from(ids)
+            self.link(cols, ids[positions], -1.0)
+            old = self.classOf[ids]
+            stats = self.sphere.get_node_stats(changes.largest, changes.average)
+            numpy.add.at(self.classSize, old[old >= 1], -1.0)
+            numpy.add.at(self.classTotal, old[old >= 1], -self.strengthOf[ids][old >= 1])
+            self.classOf[ids] = classes
+            self.strengthOf[ids] = stats.strength[ids]
+            numpy.add.at(self.classSize, classes[classes >= 1], 1.0)
+            numpy.add.at(self.classTotal, classes[classes >= 1], self.strengthOf[ids][classes >= 1])
+            self.updateClassStrength()
+            self.link(cols, ids[positions], 1.0)
+        self.influenced = numpy.flatnonzero(self.classDegree.any(axis=1))
+        self.classKey = (changes.largest, changes.average)
+
+    def pushMoments(self, low, high):
+        """
+        Returns, for each degree class, the mean, variance, smallest and largest value of log(1-a), where a is the size of a push from
+        that class when everyone else pushes with their strength scaled by a draw in [low, high] (hubs always push with a in [0.7, 0.9])
+        """
+        a = numpy.where(numpy.arange(self.numClasses) == 0, 0.7, self.classStrength * low)
+        b = numpy.where(numpy.arange(self.numClasses) == 0, 0.9, self.classStrength * high)
+        "log(1-a) for a uniform in [a, b]: integrate log(x) and log(x)^2 for x = 1-a over [1-b, 1-a]"
+        x0 = 1.0 - b
+        x1 = 1.0 - a
+        width = numpy.where(b > a, b - a, 1.0)
+        mean = ((x1 * numpy.log(x1) - x1) - (x0 * numpy.log(x0) - x0)) / width
+        square = (x1 * (numpy.log(x1)**2 - 2 * numpy.log(x1) + 2) - x0 * (numpy.log(x0)**2 - 2 * numpy.log(x0) + 2)) / width
+        mean = numpy.where(b > a, mean, numpy.log(x1))
+        variance = numpy.where(b > a, numpy.maximum(square - mean**2, 0.0), 0.0)
+        return mean, variance, numpy.log(x0), numpy.log(x1)
+
+    def sampleInfluence(self, draws, terms):
+        """
+        Returns the log of the product of (1-a) over a set of pushes for every investor, where terms is a list of (counts, low, high):
+        counts[j, c] connections of the j'th influenced investor in class c each push with a draw in [low, high]
+        The sum is drawn from a normal distribution with the right mean and variance, and kept within the range the exact sum could take
+        """
+        "Each term adds counts x (mean, variance, smallest, largest) of a single push"
+        totals = numpy.zeros((len(self.influenced), 4))
+        for counts, low, high in terms:
+            totals = totals + counts.dot(numpy.array(self.pushMoments(low, high)).T)
+        mean, variance, smallest, largest = totals.T
+        "Standard normal draws (Box-Muller)"
+        first = draws.random()[self.influenced]
+        second = draws.random()[self.influenced]
+        normal = numpy.sqrt(-2.0 * numpy.log1p(-first)) * numpy.cos(2.0 * numpy.pi * second)
+        influence = numpy.zeros(self.size)
+        influence[self.influenced] = numpy.clip(mean + numpy.sqrt(variance) * normal, smallest, largest)
+        return influence
+
+    def herdInfluence(self, draws, largestNumConnections, averageNumConnections):
+        """
+        Returns the aggregated influence of every investor's connections, as four arrays (joinDown, joinUp, leaveDown, leaveUp), from
+        the running counts (see VectorEngine.herdInfluence for the meaning of each)
+        """
+        if(self.classKey != (largestNumConnections, averageNumConnections)):
+            self.build(largestNumConnections, averageNumConnections)
+        inCount, joinedCount, leftCount = self.counts[:, self.influenced]
+        outCount = self.classDegree[self.influenced] - inCount
+
+        joinDown = self.sampleInfluence(draws, [(outCount, 0.35, 0.7), (leftCount, 0.4, 0.8)])
+        joinUp = self.sampleInfluence(draws, [(inCount, 0.3, 0.6), (joinedCount, 0.4, 0.83)])
+        leaveDown = self.sampleInfluence(draws, [(inCount, 0.3, 0.65), (joinedCount, 0.35, 0.8)])
+        leaveUp = self.sampleInfluence(draws, [(outCount, 0.45, 0.9), (leftCount, 0.55, 0.99)])
+        return joinDown, joinUp, leaveDown, leaveUp
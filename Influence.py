@@ -0,0 +1,263 @@
+"""
+Approximate herd influence for the legacy engine
+In the exact path (Market.Investor.probToJoin/probToLeave), an investor looks at every one of their connections, and each connection
+pushes their probability towards 0 or 1 with a fresh random draw. Hubs in a Barabasi-Albert social sphere have hundreds or thousands of
+connections, and after a few dozen strong pushes their probability is already pinned near 0 or 1
+
+ApproximateInfluence gives (nearly) the same result for much less work:
+-Pushes that can't move the probability at all (connections with a strength of 0 that aren't hubs) are skipped without a draw. Which
+of each investor's connections can push is worked out once per network (see startTick), so the rest are never even looked at
+-Investors with no more connections that can push than the degree threshold (most of them) get those pushes exactly, in order
+-For investors with more, pushes are composed from the last connection back to the first. Every push is a map p -> p(1-a) (towards
+0) or p -> 1-(1-p)(1-a) (towards 1), so the pushes composed so far form a map c + s*p, and whatever the earlier connections do, the
+result lies in [c, c+s].
+Once s is within the tolerance, the remaining connections (and the starting probability) are skipped, and the middle of that range is
+used, so the result is never more than tolerance/2 away from what the exact path would give with the same draws
+-Investors with more of them than the sample size as well look at their last few connections exactly (these matter most, since
+later pushes get the last word), and only at a stratified sample of the earlier ones (split by whether the connection is a hub, in the
+market, and recently changed stance). Each sampled push stands for all of the connections it represents. Whatever the earlier
+connections do can only move the result by the s of the exact ones, so the error is about that times the sample's estimated error
+(about 2 standard errors, from the spread within each stratum). Unlike the cut-off's, this is an estimate rather than a bound
+
+Lower degree thresholds and higher tolerances are faster but less accurate, and smaller samples are too, for investors whose last
+few connections don't pin the result down already (the earlier ones are only sampled if they don't). These only save time where
+investors have a lot of connections that can push them: in a Barabasi-Albert social sphere most have none or one or two, so skipping
+the rest is where nearly all the saving comes from, and a degree threshold below a handful costs more than the early cut-off saves.
+report() gives how much work was skipped, and the errors
+"""
+
+import math
+import random
+import numpy
+
+"Directions a push can move a probability in"
+UP = 1
+DOWN = -1
+
+"""
+Pushes an investor gets from each kind of connection: one in the market ('in') or not ('out'), plus one that recently left ('left')
+or recently joined ('joined'). Each is (direction, low, high): connections that aren't hubs push with their strength scaled by a draw
+in [low, high], and hubs push with a draw in [0.7, 0.9]. Same as in Market.Investor.probToJoin and probToLeave
+"""
+JOIN_SIGNALS = {'in': (UP, 0.3, 0.6), 'out': (DOWN, 0.35, 0.7), 'left': (DOWN, 0.4, 0.8), 'joined': (UP, 0.4, 0.83)}
+LEAVE_SIGNALS = {'in': (DOWN, 0.3, 0.65), 'out': (UP, 0.45, 0.9), 'left': (UP, 0.55, 0.99), 'joined': (DOWN, 0.35, 0.8)}
+
+
+class ApproximateInfluence(object):
+    """
+    Works out the herd influence on an investor's probability to join or leave, approximately (see above)
+    tolerance: largest error allowed from cutting off early; sampleSize: connections sampled for investors with more than
+    degreeThreshold connections
+    startTick must be called at the start of every timestep, before join or leave, and edgesChanged whenever the network changes
+    """
+
+    def __init__(self, tolerance=0.001, sampleSize=64, degreeThreshold=50):
+        self.tolerance = tolerance
+        self.sampleSize = sampleSize
+        self.degreeThreshold = degreeThreshold
+        """
+        Per network: the connections of each investor that can push (lists of ids, plus arrays of them for the investors that get
+        sampled), and the node stats they were picked with
+        """
+        self.pushers = None
+        self.sampledPushers = None
+        self.stats = None
+        "Per timestep: the stratum of every investor (see sample), if anyone gets sampled"
+        self.strata = None
+        "Totals for the report"
+        self.numInvestors = 0
+        self.numConnections = 0
+        self.numUsed = 0
+        self.numCutOff = 0
+        self.numSampled = 0
+        self.totalError = 0.0
+        self.maxError = 0.0
+
+    def startTick(self, sphere, investors, stats):
+        """
+        Gets ready for a timestep, given the social sphere, the population investors read, and the sphere's node stats (see
+        SocialSphere.NodeStats): works out which connections can push each investor (if the network or node stats have changed since
+        last time), and the stratum of every investor from their state at the start of the timestep
+        """
+        if(self.pushers is None or self.stats is not stats):
+            csr = sphere.get_csr().compact()
+            mask = stats.hub[csr.indices] | (stats.strength[csr.indices] > 0)
+            canPush = csr.indices[mask]
+            "Where each investor's connections that can push start and end in canPush"
+            bounds = numpy.append(0, numpy.cumsum(mask))[csr.indptr]
+            self.sampledPushers = {}
+            for i in numpy.flatnonzero(numpy.diff(bounds) > max(self.degreeThreshold, self.sampleSize)).tolist():
+                self.sampledPushers[i] = canPush[bounds[i]:bounds[i+1]]
+            canPush = canPush.tolist()
+            bounds = bounds.tolist()
+            self.pushers = [canPush[bounds[i]:bounds[i+1]] for i in range(csr.size)]
+            self.stats = stats
+        self.strata = None
+        if(len(self.sampledPushers) > 0):
+            state = investors.arrays()
+            self.strata = stats.hub * 4 + state['inMarket'] * 2 + (state['lastChange'] <= 20)
+
+    def edgesChanged(self):
+        "Forgets which connections can push, after edges have been added or removed (see SocialSphere.churn)"
+        self.pushers = None
+
+    def join(self, index, prob, investors, rng=random):
+        "Returns the probability to join of investor index after their connections' pushes, starting from prob"
+        return self.herd(index, prob, JOIN_SIGNALS, investors, rng)
+
+    def leave(self, index, prob, investors, rng=random):
+        "Returns the probability to leave of investor index after their connections' pushes, starting from prob"
+        return self.herd(index, prob, LEAVE_SIGNALS, investors, rng)
+
+    def sample(self, index, rng):
+        """
+        Returns a stratified sample of the connections of investor index (who has a lot of them) that come before their last sampleSize,
+        in their original order. Also returns how many connections each one stands for, the stratum of each, and the size of each stratum
+        Strata split connections by whether they're a hub, in the market, and recently changed stance (as of the start of the
+        timestep, see startTick). Each stratum gets its share of sampleSize (at least 1)
+        """
+        neighbours = self.sampledPushers[index]
+        neighbours = neighbours[:len(neighbours)-self.sampleSize]
+        strata = self.strata[neighbours]
+        sizes = numpy.bincount(strata, minlength=8)
+        positions = []
+        weights = []
+        for stratum in numpy.flatnonzero(sizes):
+            members = numpy.flatnonzero(strata == stratum)
+            numChosen = min(len(members), max(1, int(round(self.sampleSize * len(members) / float(len(neighbours))))))
+            positions.extend(members[sorted(rng.sample(range(len(members)), numChosen))].tolist())
+            weights.extend([len(members) / float(numChosen)] * numChosen)
+        order = numpy.argsort(positions, kind='mergesort')
+        positions = numpy.array(positions, dtype=numpy.int64)[order]
+        return neighbours[positions].tolist(), numpy.array(weights)[order].tolist(), strata[positions].tolist(), sizes.tolist()
+
+    def herd(self, index, prob, signals, investors, rng=random):
+        """
+        Returns the probability of investor index after their connections' pushes (given by signals, see JOIN_SIGNALS), starting from prob
+        Only the connections that can push are looked at: all of them in order if there are no more than degreeThreshold, and
+        otherwise composed from the last one back, cutting off early and (if there are more than sampleSize) sampling (see above)
+        """
+        connections = self.pushers[index]
+        hubs = self.stats.hubList
+        strengths = self.stats.strengthList
+        inMarket = investors.inMarket
+        lastChange = investors.lastChange
+        self.numInvestors = self.numInvestors + 1
+        self.numConnections = self.numConnections + self.stats.degreeList[index]
+
+        if(len(connections) <= self.degreeThreshold):
+            "The push from each connection's stance, then (if they changed stance recently) the push from that"
+            pushIn = signals['in']
+            pushOut = signals['out']
+            pushJoined = signals['joined']
+            pushLeft = signals['left']
+            for connection in connections:
+                isHub = hubs[connection]
+                stance, recent = (pushIn, pushJoined) if inMarket[connection] else (pushOut, pushLeft)
+                direction, low, high = stance
+                a = (rng.uniform(0.7, 0.9)) if isHub else (strengths[connection] * rng.uniform(low, high))
+                prob = prob + a * (1.0 - prob) if direction == UP else prob - a * prob
+                if(lastChange[connection] <= 20):
+                    direction, low, high = recent
+                    a = (rng.uniform(0.7, 0.9)) if isHub else (strengths[connection] * rng.uniform(low, high))
+                    prob = prob + a * (1.0 - prob) if direction == UP else prob - a * prob
+            self.numUsed = self.numUsed + len(connections)
+            return prob
+
+        "Compose pushes from the last connection back (the last sampleSize exactly, if the rest are sampled)"
+        sampled = index in self.sampledPushers
+        exact = connections[len(connections)-self.sampleSize:] if sampled else connections
+        c, s, numUsed = self.compose(exact, [1.0] * len(exact), None, 0.0, 1.0, signals, investors, rng)
+        cutOff = numUsed < len(exact)
+        error = 0.0
+        if(sampled and not cutOff):
+            "Only sample the earlier connections if the exact ones haven't already pinned the result down. Their s scales any error"
+            exactSlope = s
+            earlier, weights, strata, sizes = self.sample(index, rng)
+            "Number of connections looked at, and the sum and sum of squares of their log pushes, in each stratum"
+            moments = [[0, 0.0, 0.0] for size in sizes]
+            c, s, numSampledUsed = self.compose(earlier, weights, (strata, moments), c, s, signals, investors, rng)
+            numUsed = numUsed + numSampledUsed
+            cutOff = numSampledUsed < len(earlier)
+            error = exactSlope * min(1.0, self.samplingErrorEstimate(moments, sizes))
+            self.numSampled = self.numSampled + 1
+
+        "If cut off, everything skipped could only move the result within [c, c+s]"
+        if(cutOff):
+            prob = c + 0.5 * s
+            error = error + 0.5 * s
+            self.numCutOff = self.numCutOff + 1
+        else:
+            prob = c + s * prob
+
+        self.numUsed = self.numUsed + numUsed
+        self.totalError = self.totalError + error
+        self.maxError = max(self.maxError, error)
+        return prob
+
+    def compose(self, connections, weights, moments, c, s, signals, investors, rng):
+        """
+        Composes the pushes of connections, from the last one back, onto the map c + s*p, stopping once s is within the tolerance
+        Each push stands for weights[j] of them. If moments is given, it's (strata, moments): the stratum of each connection, and the
+        number, sum and sum of squares of the log pushes seen in each stratum so far, which are added to
+        Returns (c, s, the number of connections looked at)
+        """
+        hubs = self.stats.hubList
+        strengths = self.stats.strengthList
+        inMarket = investors.inMarket
+        lastChange = investors.lastChange
+        pushIn = signals['in']
+        pushOut = signals['out']
+        pushJoined = signals['joined']
+        pushLeft = signals['left']
+        tolerance = self.tolerance
+        numUsed = 0
+        for j in range(len(connections)-1, -1, -1):
+            connection = connections[j]
+            numUsed = numUsed + 1
+            isHub = hubs[connection]
+            stance, recent = (pushIn, pushJoined) if inMarket[connection] else (pushOut, pushLeft)
+            "A connection that recently changed stance pushes again after its stance push, so that push comes first here"
+            kinds = (recent, stance) if lastChange[connection] <= 20 else (stance,)
+            logPush = 0.0
+            for direction, low, high in kinds:
+                a = (rng.uniform(0.7, 0.9)) if isHub else (strengths[connection] * rng.uniform(low, high))
+                if(moments is not None):
+                    logPush = logPush + math.log1p(-a)
+                    a = 1.0 - (1.0 - a)**weights[j]
+                if(direction == UP):
+                    c = c + s * a
+                s = s * (1.0 - a)
+            if(moments is not None):
+                moment = moments[1][moments[0][j]]
+                moment[0] = moment[0] + 1
+                moment[1] = moment[1] + logPush
+                moment[2] = moment[2] + logPush * logPush
+            if(s <= tolerance):
+                break
+        return c, s, numUsed
+
+    def samplingErrorEstimate(self, moments, sizes):
+        """
+        Returns an estimate (about 2 standard errors) of the error in a probability from sampling connections, given the number, sum and
+        sum of squares of the log pushes looked at in each stratum, and the size of each stratum
+        Each push moves a probability by at most the change in its log push, so the standard error of the total log push bounds the
+        error's spread. The spread itself is only estimated from the sample, so this isn't a bound
+        """
+        variance = 0.0
+        for (count, total, squares), size in zip(moments, sizes):
+            if(count == 0 or count >= size):
+                continue
+            mean = total / count
+            "With only one connection looked at, its own size stands in for the spread"
+            spread = (squares - count * mean * mean) / (count - 1) if count > 1 else mean * mean
+            variance = variance + size * size * (1.0 - float(count) / size) * max(spread, 0.0) / count
+        return 2.0 * math.sqrt(variance)
+
+    def report(self):
+        "Returns a text summary of the work skipped and the errors so far"
+        used = 100.0 * self.numUsed / self.numConnections if self.numConnections > 0 else 100.0
+        meanError = self.totalError / self.numInvestors if self.numInvestors > 0 else 0.0
+        return ('Approximate influence: looked at ' + str(self.numUsed) + ' of ' + str(self.numConnections) + ' connections (' + ('%.1f' % used) + '%), ' +
+                'cut off early for ' + str(self.numCutOff) + ' and sampled for ' + str(self.numSampled) + ' of ' + str(self.numInvestors) + ' probabilities. ' +
+                'Error against the exact path (bound from cutting off, plus estimate from sampling): mean ' + ('%.2g' % meanError) + ', max ' + ('%.2g' % self.maxError))
@@ -0,0 +1,189 @@
+"""
+Live plots, drawn in a separate process while a simulation (or a batch of them) runs
+The simulation sends its results (see LivePlot.send) through a queue to a rendering process, which redraws the chart at most once per
+interval and saves it as an image (e.g. "result.jpg"), and optionally a local HTML status page that shows the image and refreshes itself
+Sending never waits: if the queue is full, results are held back and sent with the next ones, so plotting can't slow the simulation down
+Each image (and page) is written to a temporary file first and then renamed, so it can be opened at any time without seeing half of it
+
+Charts say how to add results and draw them (add, draw and status): MarketChart plots a run's market values over time, and SwingChart
+the average swing of each kind of run in a batch (see Runner.plotSwingVals)
+"""
+
+import multiprocessing
+import os
+import Queue
+import time
+import RollingStats
+
+class MarketChart(object):
+    "Market values over time, sent as (timestep, value) pairs. size, timesteps and limit are the run's number of investors, length and market limit"
+
+    def __init__(self, size, timesteps, limit):
+        self.size = size
+        self.timesteps = timesteps
+        self.times = []
+        self.values = []
+        self.stats = RollingStats.MarketStats(limit)
+
+    def add(self, item):
+        curTime, value = item
+        self.times.append(curTime)
+        self.values.append(value)
+        self.stats.record(value)
+
+    def draw(self, plt):
+        fig = plt.figure()
+        plt.plot(self.times, self.values)
+        fig.suptitle('Market Values, ' + str(self.size) + ' investors')
+        plt.ylabel('Shares Purchased')
+        plt.xlabel('Time Steps')
+        plt.axis([0, self.timesteps, 0, self.stats.high])
+        return fig
+
+    def status(self):
+        "Returns (name, value) pairs describing the run so far, for the status page"
+        if(len(self.values) == 0):
+            return [('Time step', 'not started')]
+        stats = self.stats.summary()
+        return [('Time step', str(self.times[-1]) + ' of ' + str(self.timesteps)), ('Market value', '%.1f' % self.values[-1]),
+                ('Swing', '%.4f' % stats['swing']), ('Trend', '%.4f' % stats['trend']), ('Volatility', '%.4f' % stats['volatility']),
+                ('Drawdown', '%.4f' % stats['drawdown'])]
+
+
+class SwingChart(object):
+    "Average swing of each kind of run, as a bar chart. Results are sent as (kind, swing) pairs, with kind an index into names"
+
+    def __init__(self, names):
+        self.names = names
+        self.swings = [[] for name in names]
+
+    def add(self, item):
+        kind, swing = item
+        self.swings[kind].append(swing)
+
+    def averages(self):
+        return [float(sum(swings) / len(swings)) if len(swings) > 0 else 0.0 for swings in self.swings]
+
+    def draw(self, plt):
+        fig = plt.figure()
+        positions = range(len(self.names))
+        plt.bar(positions, self.averages(), align='center')
+        plt.xticks(positions, self.names)
+        plt.ylabel('Market Swing')
+        fig.suptitle('Swing Values for Different Social Networks')
+        return fig
+
+    def status(self):
+        averages = self.averages()
+        return [(self.names[k], '%.4f' % averages[k] + ' (' + str(len(self.swings[k])) + ' runs)') for k in range(len(self.names))]
+
+
+def writeAtomically(filename, write):
+    "Calls write with a temporary file name, and then renames that file to filename"
+    temporary = filename + '.tmp'
+    write(temporary)
+    os.rename(temporary, filename)
+
+def writePage(filename, image, title, status, interval, finished):
+    "Writes the HTML status page: the chart's image and status, refreshing itself every interval seconds until the run has finished"
+    refresh = '' if finished else '<meta http-equiv="refresh" content="' + str(max(1, int(round(interval)))) + '">\n'
+    rows = ''.join(['<tr><th>' + name + '</th><td>' + value + '</td></tr>\n' for name, value in status])
+    page = ('<!DOCTYPE html>\n<html>\n<head>\n' + refresh + '<title>' + title + '</title>\n</head>\n<body>\n' +
+            '<h1>' + title + (' (finished)' if finished else ' (running)') + '</h1>\n' +
+            '<img src="' + os.path.basename(image) + '?' + str(int(time.time())) + '">\n<table>\n' + rows + '</table>\n</body>\n</html>\n')
+    def write(name):
+        out = open(name, 'w')
+        out.write(page)
+        out.close()
+    writeAtomically(filename, write)
+
+def render(queue, chart, filename, page, title, interval):
+    """
+    Runs in the rendering process: takes lists of results off the queue and adds them to the chart, redrawing it (and the status page)
+    once at least interval seconds have passed since the last time, and once more when None arrives at the end
+    """
+    "Draw straight to image files, without a display (switching backend in case pyplot was already imported before this process started)"
+    import matplotlib
+    matplotlib.use('Agg', warn=False)
+    import matplotlib.pyplot as plt
+    plt.switch_backend('Agg')
+    extension = os.path.splitext(filename)[1][1:] or 'png'
+
+    lastDrawn = 0.0
+    changed = False
+    finished = False
+    while(not finished):
+        try:
+            items = queue.get(True, interval)
+        except Queue.Empty:
+            items = []
+        if(items is None):
+            finished = True
+            items = []
+        for item in items:
+            chart.add(item)
+        changed = changed or len(items) > 0
+        if((changed and time.time() - lastDrawn >= interval) or finished):
+            fig = chart.draw(plt)
+            writeAtomically(filename, lambda name: fig.savefig(name, format=extension))
+            plt.close(fig)
+            if(page is not None):
+                writePage(page, filename, title, chart.status(), interval, finished)
+            lastDrawn = time.time()
+            changed = False
+
+
+class LivePlot(object):
+
+    def __init__(self, chart, filename, page=None, title='Simulation', interval=2.0, queueSize=64):
+        """
+        Starts a rendering process for the given chart (see MarketChart), saving it as filename (and writing a status page to page, if
+        given) at most once every interval seconds
+        Inside a process that can't start its own (such as an Ensemble worker), nothing is drawn, and enabled is False
+        """
+        self.pending = []
+        self.queue = None
+        self.process = None
+        self.enabled = not multiprocessing.current_process().daemon
+        if(self.enabled):
+            self.queue = multiprocessing.Queue(queueSize)
+            self.process = multiprocessing.Process(target=render, args=(self.queue, chart, filename, page, title, interval))
+            self.process.daemon = True
+            self.process.start()
+
+    def send(self, item):
+        "Sends one result to the rendering process, without waiting. If the queue is full, it goes with the next result sent instead"
+        if(not self.enabled):
+            return
+        self.pending.append(item)
+        try:
+            self.queue.put_nowait(self.pending)
+            self.pending = []
+        except Queue.Full:
+            pass
+
+    def close(self, timeout=60.0):
+        "Sends any results held back, waits (up to timeout seconds) for the final image to be drawn, and stops the rendering process"
+        if(not self.enabled):
+            return
+        if(len(self.pending) > 0):
+            self.queue.put(self.pending)
+            self.pending = []
+        self.queue.put(None)
+        self.process.join(timeout)
+        if(self.process.is_alive()):
+            self.process.terminate()
+        self.enabled = False
+
+
+def openPlot(params, chart, filename, title='Simulation'):
+    """
+    Given the simulation parameters (see Runner.readConfig), returns a LivePlot of the chart saved as filename (with the status page
+    headed by title), or None if plotting is off
+    params['plot']: 'image' (just the image), 'html' (the image and a status page) or 'off'
+    """
+    mode = params.get('plot', 'image')
+    if(mode == 'off'):
+        return None
+    page = params.get('plot_page', 'status.html') if mode == 'html' else None
+    return LivePlot(chart, filename, page, title, params.get('plot_interval', 2.0))
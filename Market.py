@@ -1,56 +1,196 @@
-import Graph
-import SocialSphere
+import array
+import numpy
 import random
+import RandomStreams
+
+class Population(object):
+    """
+    The state of every investor, stored as one compact array per attribute (struct of arrays), and indexed by integer id
+    Investor ids are the ids of the social sphere's nodes in its CSR form (see SocialSphere.get_csr)
+    numShares: number of shares each investor can invest; inMarket: whether they're in the market (0/1); lastChange: timesteps since
+    they last changed stance; numTimesLeft: how many times they've left the market
+    The arrays are plain Python arrays (fast to access one element at a time), and arrays() gives numpy views of the same memory
+    Iterating over a population gives the investor ids, and population[i] gives a lightweight Investor view of investor i
+    """
+
+    def __init__(self, size, nodes=None, history=None):
+        """
+        Creates a population of size investors, none of them in the market and none of them with any shares yet
+        nodes: social sphere node of each investor (optional); history: market history (see History.MarketHistory, optional)
+        """
+        self.size = size
+        self.nodes = nodes
+        self.history = history
+        self.back = None
+        self.numShares = array.array('d', [0.0]) * size
+        self.inMarket = array.array('b', [0]) * size
+        self.lastChange = array.array('l', [10000]) * size
+        self.numTimesLeft = array.array('l', [0]) * size
+
+    @classmethod
+    def fromArrays(cls, state, nodes=None, history=None):
+        "Creates a population from a dictionary of state arrays (see arrays)"
+        population = cls(len(state['numShares']), nodes, history)
+        views = population.arrays()
+        for name in views:
+            views[name][:] = state[name]
+        return population
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        return iter(range(self.size))
+
+    def __getitem__(self, i):
+        return Investor(self, i)
+
+    def arrays(self):
+        """
+        Returns numpy views of the population's state (numShares, inMarket, lastChange, numTimesLeft) as a dictionary
+        The views share memory with the population, so changing them changes the population
+        """
+        return {
+            'numShares': numpy.frombuffer(self.numShares, dtype=numpy.float64),
+            'inMarket': numpy.frombuffer(self.inMarket, dtype=bool),
+            'lastChange': numpy.frombuffer(self.lastChange, dtype='i%d' % self.lastChange.itemsize),
+            'numTimesLeft': numpy.frombuffer(self.numTimesLeft, dtype='i%d' % self.numTimesLeft.itemsize),
+        }
+
+    def backBuffer(self):
+        """
+        Returns the population's back buffer, for synchronous updates (see Runner.tick): a second population sharing this one's
+        shares, nodes and history, with its own stance arrays (inMarket, lastChange, numTimesLeft). Each investor's new state is worked
+        out from their state in this population and written straight to the back buffer (see Investor.enterMarket etc.), while every
+        decision reads this population, and then the two are swapped (see swapBuffers), so the state is never copied from one to the other
+        The back buffer is made the first time it's needed, and its contents are only meaningful for investors written since the last swap
+        """
+        if(self.back is None):
+            self.back = Population(self.size, self.nodes, self.history)
+            self.back.numShares = self.numShares
+        return self.back
+
+    def swapBuffers(self):
+        "Swaps the stance arrays of the population and its back buffer, making the newly written state the current one"
+        back = self.backBuffer()
+        self.inMarket, back.inMarket = back.inMarket, self.inMarket
+        self.lastChange, back.lastChange = back.lastChange, self.lastChange
+        self.numTimesLeft, back.numTimesLeft = back.numTimesLeft, self.numTimesLeft
+
+    def isInMarket(self, i):
+        return self.inMarket[i] == 1
+
+    def changedStanceRecently(self, i):
+        return self.lastChange[i] < 15
+
+    def recentlyLeftMarket(self, i):
+        return ((self.lastChange[i] <=20) and (self.inMarket[i] == 0))
+
+    def recentlyJoinedMarket(self, i):
+        return ((self.lastChange[i] <=20) and (self.inMarket[i] == 1))
+
 
 class Investor(object):
+    """
+    A view of one investor in a Population (investor number index). Holds no state of its own, so views can be made and thrown away
+    freely; reading or setting numShares, inMarket, lastChange or numTimesLeft reads or sets the population's arrays
+    """
+
+    __slots__ = ('population', 'index')
+
+    def __init__(self, population, index):
+        self.population = population
+        self.index = index
+
+    def getNumSharesAttribute(self):
+        return self.population.numShares[self.index]
 
-    numShares = 0
-    inMarket = False
-    node = Graph.Vertex('')
-    marketHistory = []
-    lastChange = 10000
-    numTimesLeft = 0
+    def setNumSharesAttribute(self, numShares):
+        self.population.numShares[self.index] = numShares
 
-    def __init__(self, numShares, node):
-        self.numShares = numShares
-        self.node = node
+    def getInMarketAttribute(self):
+        return self.population.inMarket[self.index] == 1
 
-    def enterMarket(self):
-        self.inMarket = True
-        self.marketHistory.append(True)
-        self.lastChange = 0
+    def setInMarketAttribute(self, inMarket):
+        self.population.inMarket[self.index] = 1 if inMarket else 0
 
-    def leaveMarket(self):
-        self.inMarket = False
-        self.marketHistory.append(False)
-        self.lastChange = 0
-        self.numTimesLeft = self.numTimesLeft + 1
+    def getLastChangeAttribute(self):
+        return self.population.lastChange[self.index]
 
-    def stayInMarket(self):
-        self.marketHistory.append(True)
-        self.lastChange = self.lastChange + 1
+    def setLastChangeAttribute(self, lastChange):
+        self.population.lastChange[self.index] = lastChange
 
-    def stayOutsideMarket(self):
-        self.marketHistory.append(False)
-        self.lastChange = self.lastChange + 1
+    def getNumTimesLeftAttribute(self):
+        return self.population.numTimesLeft[self.index]
+
+    def setNumTimesLeftAttribute(self, numTimesLeft):
+        self.population.numTimesLeft[self.index] = numTimesLeft
+
+    numShares = property(getNumSharesAttribute, setNumSharesAttribute)
+    inMarket = property(getInMarketAttribute, setInMarketAttribute)
+    lastChange = property(getLastChangeAttribute, setLastChangeAttribute)
+    numTimesLeft = property(getNumTimesLeftAttribute, setNumTimesLeftAttribute)
+
+    @property
+    def node(self):
+        "This investor's node in the social sphere"
+        return self.population.nodes[self.index]
+
+    """
+    Moves the investor on by one timestep (entering, leaving, or staying in or out of the market)
+    If source is given, it's the population holding the investor's current state (e.g. the front buffer, when this view is of the back
+    buffer, see Population.backBuffer): the new state is worked out from the state there, and all of it is written here
+    """
+    def enterMarket(self, source=None):
+        population = self.population
+        population.inMarket[self.index] = 1
+        population.lastChange[self.index] = 0
+        if(source is not None):
+            population.numTimesLeft[self.index] = source.numTimesLeft[self.index]
+
+    def leaveMarket(self, source=None):
+        population = self.population
+        if(source is None):
+            source = population
+        population.inMarket[self.index] = 0
+        population.lastChange[self.index] = 0
+        population.numTimesLeft[self.index] = source.numTimesLeft[self.index] + 1
+
+    def stayInMarket(self, source=None):
+        self.stay(source)
+
+    def stayOutsideMarket(self, source=None):
+        self.stay(source)
+
+    def stay(self, source=None):
+        population = self.population
+        if(source is None):
+            population.lastChange[self.index] = population.lastChange[self.index] + 1
+        else:
+            population.inMarket[self.index] = source.inMarket[self.index]
+            population.lastChange[self.index] = source.lastChange[self.index] + 1
+            population.numTimesLeft[self.index] = source.numTimesLeft[self.index]
 
     def getNumShares(self):
-        return self.numShares
+        return self.population.numShares[self.index]
 
     def isInMarket(self):
-        return self.inMarket
+        return self.population.isInMarket(self.index)
 
     def getMarketHistory(self):
-        return self.marketHistory
+        "Returns this investor's stance at every timestep held in the simulation's market history (see History.MarketHistory)"
+        if(self.population.history is None):
+            return []
+        return self.population.history.ofInvestor(self.index).tolist()
 
     def changedStanceRecently(self):
-        return self.lastChange < 15
+        return self.population.changedStanceRecently(self.index)
 
     def recentlyLeftMarket(self):
-        return ((self.lastChange <=20) and (not self.inMarket))
+        return self.population.recentlyLeftMarket(self.index)
 
     def recentlyJoinedMarket(self):
-        return ((self.lastChange <=20) and (self.inMarket))
+        return self.population.recentlyJoinedMarket(self.index)
 
     """
     This method calculates a probability for the investor (not currently in the market) to enter the market
@@ -60,78 +200,74 @@ class Investor(object):
     -How the market has changed from the first timestep to the current timestep
     -Whether the number of shares purchased is approaching the limit of the market
     -Whether the investor has previously left the market
+    investors is the Population this investor belongs to, and rng is the source of randomness (see RandomStreams)
+    If influence is given (see Influence.ApproximateInfluence), the connections' pushes are worked out approximately by it
+    signals are the timestep's market-level signals (see MarketSignals), worked out here if not given
     """
-    def probToJoin(self, sphere, investors, marketValues, curTime, market, largestNumConnections, averageNumConnections, herdBehaviour):
+    def probToJoin(self, sphere, investors, marketValues, curTime, market, largestNumConnections, averageNumConnections, herdBehaviour, rng=random, influence=None, signals=None):
 
         #Start off with a random probability
-        prob = random.uniform(0.0, 0.2)
-
-        #First look at all of the investor's connections in the social sphere
-        connections = sphere.g[self.node]
-        if(herdBehaviour == False):
-            connections = []
+        prob = rng.uniform(0.0, 0.2)
+
+        #First look at all of the investor's connections in the social sphere (as integer ids into the sphere's CSR arrays)
+        connections = []
+        if(herdBehaviour and influence is not None):
+            #Work out the connections' pushes approximately instead (see Influence.ApproximateInfluence, set up once per timestep by Runner.tick)
+            prob = influence.join(self.index, prob, investors, rng)
+        elif(herdBehaviour):
+            csr = sphere.get_csr()
+            stats = sphere.get_node_stats(largestNumConnections, averageNumConnections)
+            hubs = stats.hubList
+            strengths = stats.strengthList
+            connections = csr.neighbours(self.index).tolist()
 
         for connection in connections:
 
-            #For each connection, look at the number of their connections as a 'strength'
-            connectionStrength = len(sphere.g[connection])
+            #For each connection, look at whether they're a hub, and at the number of their connections as a 'strength' (both worked out once by the social sphere)
+            connectionIsHub = hubs[connection]
+            connectionStrength = strengths[connection]
 
             #Look at whether or not the connection is currently in the market
-            currentlyInMarket = investors[connection.getLabel()].isInMarket()
+            currentlyInMarket = investors.isInMarket(connection)
 
             #Change probability depending on connection's current stance
             if(currentlyInMarket):
                 #Move probability to join towards 1, taking into account connection strength
                 #a = float(float(connectionStrength/largestNumConnections) * random.uniform(0.3,0.6))
-                a = (random.uniform(0.7,0.9)) if (connectionStrength >= (averageNumConnections + 15)) else (float(float(connectionStrength/largestNumConnections) * random.uniform(0.3,0.6)))
+                a = (rng.uniform(0.7,0.9)) if connectionIsHub else (connectionStrength * rng.uniform(0.3,0.6))
                 prob = prob + float(a * float(1.0-prob))
             else:
                 #Move probability to join towards 0, taking into account connection strength
                 #a = float(float(connectionStrength/largestNumConnections) * random.uniform(0.35,0.7))
-                a = (random.uniform(0.7,0.9)) if (connectionStrength >= (averageNumConnections + 15)) else (float(float(connectionStrength/largestNumConnections) * random.uniform(0.35,0.7)))
+                a = (rng.uniform(0.7,0.9)) if connectionIsHub else (connectionStrength * rng.uniform(0.35,0.7))
                 prob = prob - float(a * prob)
                 pass
 
             #Determine whether or not the connection has left the market in the past (unless we're only in the first timestep)
-            recentlyLeftMarket = investors[connection.getLabel()].recentlyLeftMarket()
-            recentlyJoinedMarket = investors[connection.getLabel()].recentlyJoinedMarket()
+            recentlyLeftMarket = investors.recentlyLeftMarket(connection)
+            recentlyJoinedMarket = investors.recentlyJoinedMarket(connection)
             if(recentlyLeftMarket):
                 #Move probability to join towards 0, taking into account connection strength
                 #a = float(float(connectionStrength/largestNumConnections) * random.uniform(0.4,0.8))
-                a = (random.uniform(0.7,0.9)) if (connectionStrength >= (averageNumConnections + 15)) else (float(float(connectionStrength/largestNumConnections) * random.uniform(0.4,0.8)))
+                a = (rng.uniform(0.7,0.9)) if connectionIsHub else (connectionStrength * rng.uniform(0.4,0.8))
                 prob = prob - float(a * prob)
             elif(recentlyJoinedMarket):
                 #Move probability to join towards 1, taking into account connection strength
                 #a = float(float(connectionStrength/largestNumConnections) * random.uniform(0.4,0.83))
-                a = (random.uniform(0.7,0.9)) if (connectionStrength >= (averageNumConnections + 15)) else (float(float(connectionStrength/largestNumConnections) * random.uniform(0.4,0.83)))
+                a = (rng.uniform(0.7,0.9)) if connectionIsHub else (connectionStrength * rng.uniform(0.4,0.83))
                 prob = prob + float(a * float(1.0 - prob))
 
 
-        #Now, after looking at all connections, look at whether or not the number of shares purchased is approaching the market's limit
-        if(float(marketValues[curTime-1]) >= float(market.limit * random.uniform(0.75,0.95))):
-            #Move probability to join towards 0, taking into account how close to the limit market is
-            a = float(float(market.totalShares / market.limit) * random.uniform(0.3,0.7))
-            prob = prob - float(a * prob)
-
-        #Now, after looking at all connections and the limit, look at how the market has changed since the start
-        recentChange = marketValues[curTime-1] - marketValues[0]
-
-        #Now change probability depending on recentChange (if it's large and negative, probability should move towards 0, if it's large and positive, it should move towards 1)
-        if(recentChange > 0):
-            #Move probability to join towards 1, taking into account extent of change
-            a = float(float(abs(recentChange) / market.limit) * random.uniform(0.25,0.65))
-            prob = prob - float(a * float(1.0 - prob))
-
-        elif(recentChange < 0):
-            #Move proability to join towards 0, taking into account extent of change
-            a = float(float(abs(recentChange) / market.limit) * random.uniform(0.25,0.65))
-            prob = prob - float(a * prob)
+        #Now, after looking at all connections, look at the market itself: whether or not the number of shares purchased is approaching the market's limit, and how the market has changed since the start (see MarketSignals)
+        if(signals is None):
+            signals = MarketSignals(market, marketValues, curTime)
+        prob = signals.join(self.index, prob, rng)
 
         #Finally, look at whether or not the investor has left in the past. If they have, it should drastically reduce the probability of joining again
         a = 0.0
         if(self.numTimesLeft > 0):
             #a = float(0.85 + float(0.15 * float(self.numTimesLeft/3)))
-            a = random.uniform(0.4,0.75)
+            a = rng.uniform(0.4,0.75)
         prob = prob - float(a * prob)
 
         #return prob
@@ -145,71 +281,67 @@ class Investor(object):
     -How this investor's connections have changed their stance in recent timesteps
     -How the market has changed from the first timestep to the current timestep
     -Whether the number of shares purchased is approaching the limit of the market
+    investors is the Population this investor belongs to, and rng is the source of randomness (see RandomStreams)
+    If influence is given (see Influence.ApproximateInfluence), the connections' pushes are worked out approximately by it
+    signals are the timestep's market-level signals (see MarketSignals), worked out here if not given
     """
-    def probToLeave(self, sphere, investors, marketValues, curTime, market, largestNumConnections, averageNumConnections, herdBehaviour):
+    def probToLeave(self, sphere, investors, marketValues, curTime, market, largestNumConnections, averageNumConnections, herdBehaviour, rng=random, influence=None, signals=None):
 
         #Start off with a random probability
-        prob = random.uniform(0.0, 0.3)
-
-        #First look at all of the investor's connections in the social sphere
-        connections = sphere.g[self.node]
-        if(herdBehaviour == False):
-            connections = []
+        prob = rng.uniform(0.0, 0.3)
+
+        #First look at all of the investor's connections in the social sphere (as integer ids into the sphere's CSR arrays)
+        connections = []
+        if(herdBehaviour and influence is not None):
+            #Work out the connections' pushes approximately instead (see Influence.ApproximateInfluence, set up once per timestep by Runner.tick)
+            prob = influence.leave(self.index, prob, investors, rng)
+        elif(herdBehaviour):
+            csr = sphere.get_csr()
+            stats = sphere.get_node_stats(largestNumConnections, averageNumConnections)
+            hubs = stats.hubList
+            strengths = stats.strengthList
+            connections = csr.neighbours(self.index).tolist()
 
         for connection in connections:
 
-            #For each connection, look at the number of their connections as a 'strength'
-            connectionStrength = len(sphere.g[connection])
+            #For each connection, look at whether they're a hub, and at the number of their connections as a 'strength' (both worked out once by the social sphere)
+            connectionIsHub = hubs[connection]
+            connectionStrength = strengths[connection]
 
             #Look at whether or not the connection is currently in the market
-            currentlyInMarket = investors[connection.getLabel()].isInMarket()
+            currentlyInMarket = investors.isInMarket(connection)
 
             #Change probability depending on connection's current stance
             if(currentlyInMarket):
                 #Move probability to leave towards 0, taking into account connection strength
                 #a = float(float(connectionStrength/largestNumConnections) * random.uniform(0.3,0.65))
-                a = (random.uniform(0.7,0.9)) if (connectionStrength >= (averageNumConnections + 15)) else (float(float(connectionStrength/largestNumConnections) * random.uniform(0.3,0.65)))
+                a = (rng.uniform(0.7,0.9)) if connectionIsHub else (connectionStrength * rng.uniform(0.3,0.65))
                 prob = prob - float(a * prob)
             else:
                 #Move probability to leave towards 1, taking into account connection strength
                 #a = float(float(connectionStrength/largestNumConnections) * random.uniform(0.45,0.9))
-                a = (random.uniform(0.7,0.9)) if (connectionStrength >= (averageNumConnections + 15)) else (float(float(connectionStrength/largestNumConnections) * random.uniform(0.45,0.9)))
+                a = (rng.uniform(0.7,0.9)) if connectionIsHub else (connectionStrength * rng.uniform(0.45,0.9))
                 prob = prob + float(a *float(1.0 - prob))
 
             #Look at whether or not the connection has recently left the market
-            recentlyLeftMarket = investors[connection.getLabel()].recentlyLeftMarket()
-            recentlyJoinedMarket = investors[connection.getLabel()].recentlyJoinedMarket()
+            recentlyLeftMarket = investors.recentlyLeftMarket(connection)
+            recentlyJoinedMarket = investors.recentlyJoinedMarket(connection)
             if(recentlyLeftMarket):
                 #Move probability to leave towards 1, taking into account connection strength
                 #a = float(float(connectionStrength/largestNumConnections) * random.uniform(0.55,0.99))
-                a = (random.uniform(0.7,0.9)) if (connectionStrength >= (averageNumConnections + 15)) else (float(float(connectionStrength/largestNumConnections) * random.uniform(0.55,0.99)))
+                a = (rng.uniform(0.7,0.9)) if connectionIsHub else (connectionStrength * rng.uniform(0.55,0.99))
                 prob = prob + float(a * float(1.0-prob))
             elif(recentlyJoinedMarket):
                 #Move probability to leave towards 0, taking into account connection strength
                 #a = float(float(connectionStrength/largestNumConnections) * random.uniform(0.35,0.8))
-                a = (random.uniform(0.7,0.9)) if (connectionStrength >= (averageNumConnections + 15)) else (float(float(connectionStrength/largestNumConnections) * random.uniform(0.35,0.8)))
+                a = (rng.uniform(0.7,0.9)) if connectionIsHub else (connectionStrength * rng.uniform(0.35,0.8))
                 prob = prob - float(a * prob)
 
 
-        #Now, after looking at all connections, look at whether or not the number of shares purchased is approaching the market's limit
-        if(float(marketValues[curTime-1]) >= float(market.limit * random.uniform(0.75,0.95))):
-            #Move probability to leave towards 1, taking into account how close to the limit market is
-            a = float(float(market.totalShares / market.limit) * random.uniform(0.3,0.8))
-            prob = prob + float(a * float(1.0-prob))
-
-        #Now, after looking at all connections and the limit, look at how the market has changed since the first timestep
-        recentChange = marketValues[curTime-1] - marketValues[0]
-
-        #Now change probability depending on recentChange (if it's large and negative, probability should move towards 1, if it's large and positive, it should move towards 0)
-        if(recentChange > 0):
-            #Move probability to leave towards 0, taking into account extent of change
-            a = float(float(abs(recentChange) / market.limit) * random.uniform(0.3,0.7))
-            prob = prob - float(a * prob)
-
-        elif(recentChange < 0):
-            #Move proability to leave towards 1, taking into account extent of change
-            a = float(float(abs(recentChange) / market.limit)) * random.uniform(0.3,0.7)
-            prob = prob + float(a * float(1.0-prob))
+        #Now, after looking at all connections, look at the market itself: whether or not the number of shares purchased is approaching the market's limit, and how the market has changed since the start (see MarketSignals)
+        if(signals is None):
+            signals = MarketSignals(market, marketValues, curTime)
+        prob = signals.leave(self.index, prob, rng)
 
         #return prob
         return prob
@@ -219,11 +351,44 @@ class Market(object):
 
     totalShares = 0
     limit = 0
+    "Number of timesteps investors look back over when judging how the market has changed (0 means since the first timestep)"
+    lookBack = 0
+    "Rolling statistics of the market's value (see RollingStats.MarketStats), kept up to date by Runner.runSimulation"
+    stats = None
+    "How strongly investors follow the trend over the statistics window, and how strongly volatility and drawdown put them off (0 ignores them)"
+    trendWeight = 0.0
+    riskWeight = 0.0
+    "The trend and risk pushes, fixed when the market was copied by snapshot (or None to work them out from stats)"
+    pushes = None
 
     def __init__(self, newLim):
         self.totalShares = 0
         self.limit = newLim
 
+    def snapshot(self):
+        """
+        Returns a copy of the market (its totals and settings), which doesn't change as investors join and leave this one
+        The copy leaves the rolling statistics behind, and keeps just the trend and risk pushes they give now (see statsPushes), so it
+        stays small enough to send to other processes every timestep (see ShardedEngine.propose)
+        """
+        copy = Market(self.limit)
+        copy.totalShares = self.totalShares
+        copy.lookBack = self.lookBack
+        copy.pushes = self.statsPushes()
+        return copy
+
+    def statsPushes(self):
+        """
+        Returns the size of the trend push (negative when the market is falling) and of the risk push investors get from the rolling
+        statistics (see MarketSignals), or the ones fixed when this copy of the market was made
+        """
+        if(self.pushes is not None):
+            return self.pushes
+        if(self.stats is None):
+            return 0.0, 0.0
+        return (max(-1.0, min(1.0, self.trendWeight * self.stats.trend())),
+                min(1.0, self.riskWeight * (self.stats.volatility() + self.stats.drawdown())))
+
     def addInvestor(self, i):
         "Adds an investor to the stock market (when they decide to purchase shares)"
         self.totalShares = self.totalShares + (i.getNumShares())
@@ -240,3 +405,225 @@ class Market(object):
             return True
         else:
             return False
+
+    def admissionOrder(self, shares, policy='arrival', rng=random):
+        """
+        Returns the order candidate joiners are considered in, as positions into shares (the shares of each candidate, in arrival order)
+        policy: 'arrival' (the order they arrived in), 'largest' (most shares first, ties in arrival order) or 'random' (a random order
+        drawn from rng, see RandomStreams)
+        """
+        if(policy == 'largest'):
+            return numpy.argsort(-shares, kind='mergesort')
+        elif(policy == 'random'):
+            return RandomStreams.bulk(rng).permutation(len(shares))
+        return numpy.arange(len(shares))
+
+    @staticmethod
+    def minimumTree(values):
+        """
+        Returns a tree (as a list) of the smallest of the values under each node, for firstFit: the values (padded with infinity to a
+        power of 2 long) are the leaves, in the second half of the list, and node i is the smallest of nodes 2i and 2i+1
+        """
+        size = 1
+        while(size < len(values)):
+            size = 2 * size
+        level = numpy.full(size, numpy.inf)
+        level[:len(values)] = values
+        levels = [level]
+        while(len(level) > 1):
+            level = numpy.minimum(level[0::2], level[1::2])
+            levels.insert(0, level)
+        return [numpy.inf] + numpy.concatenate(levels).tolist()
+
+    @staticmethod
+    def firstFit(tree, start, limit):
+        "Returns the first position from start on whose value is at most limit (or -1 if there isn't one), given a minimumTree of the values"
+        size = len(tree) // 2
+        if(start >= size):
+            return -1
+        node = start + size
+        "Go up and right past subtrees where everything is too big, then down into the leftmost that fits"
+        while(tree[node] > limit):
+            while(node & 1):
+                node = node >> 1
+            if(node == 0):
+                return -1
+            node = node + 1
+        while(node < size):
+            node = 2 * node if tree[2 * node] <= limit else 2 * node + 1
+        return node - size
+
+    def admitBatch(self, candidates, shares, leavingShares=0.0, maxJoins=None, policy='arrival', rng=random):
+        """
+        Applies a whole timestep's moves at once. The leavers' shares (leavingShares, their total) are taken out of the market, and then
+        candidate joiners (candidates, with shares[j] the number of shares of candidates[j]) are admitted while there's room, in the order
+        given by policy (see admissionOrder). With 'arrival', this is the same as calling canJoin and addInvestor on each candidate in turn
+        A candidate that doesn't fit is turned away, but later (smaller) candidates can still get in. At most maxJoins are admitted
+        Takes O(k log k) time for k candidates, rather than a check per investor: each pass admits the run of candidates that fit (found
+        with cumulative sums over a window that doubles until the run ends), and then finds the next candidate small enough to fit by
+        searching a tree of the smallest shares (see firstFit), so a pass costs O(run length + log k) however the shares are arranged
+        Returns (admitted, numCapped): the admitted candidates in the order they got in, and how many candidates were turned away because
+        maxJoins had already been reached
+        """
+        self.totalShares = self.totalShares - leavingShares
+        shares = numpy.asarray(shares, dtype=numpy.float64)
+        order = self.admissionOrder(shares, policy, rng)
+        numCandidates = len(order)
+        if(maxJoins is None):
+            maxJoins = numCandidates
+        ordered = shares[order]
+        tree = self.minimumTree(ordered)
+        remainingShares = self.limit - self.totalShares
+        admitted = []
+        numAdmitted = 0
+        start = self.firstFit(tree, 0, remainingShares)
+        while(start >= 0 and numAdmitted < maxJoins):
+            "Everyone in the longest run (from start) that fits gets in"
+            window = 16
+            while(True):
+                fits = numpy.cumsum(ordered[start:start+window]) <= remainingShares
+                if(not fits.all() or start + window >= numCandidates or window >= maxJoins - numAdmitted):
+                    break
+                window = 2 * window
+            numFit = len(fits) if fits.all() else int(numpy.argmin(fits))
+            numTaken = min(numFit, maxJoins - numAdmitted)
+            admitted.append(order[start:start+numTaken])
+            numAdmitted = numAdmitted + numTaken
+            remainingShares = remainingShares - ordered[start:start+numTaken].sum()
+            if(numTaken < numFit):
+                break
+            "The next candidate doesn't fit, so skip to the next one who needs no more shares than are left"
+            start = self.firstFit(tree, start + numFit + 1, remainingShares)
+        admitted = numpy.concatenate(admitted) if len(admitted) > 0 else numpy.zeros(0, dtype=numpy.int64)
+        self.totalShares = self.totalShares + shares[admitted].sum()
+
+        "Candidates after the last one admitted were turned away by the cap once it was reached"
+        numCapped = 0
+        if(numAdmitted == maxJoins and numAdmitted > 0):
+            rank = numpy.zeros(numCandidates, dtype=numpy.int64)
+            rank[order] = numpy.arange(numCandidates)
+            numCapped = numCandidates - int(rank[admitted[-1]]) - 1
+        return numpy.asarray(candidates)[admitted], numCapped
+
+
+class MarketSignals(object):
+    """
+    The market-level signals investors look at in one timestep (see Investor.probToJoin/probToLeave): the market's value at the end
+    of the previous timestep, and how much it has changed over the look-back window (since the first timestep, unless the market's
+    lookBack is set)
+    These are the same for every investor, so they're worked out once per timestep. Each investor's random factors can also be drawn
+    for everyone at once (see drawFactors); otherwise they're drawn one at a time, as each investor needs them
+    How much of the limit is bought is read from the market whenever it's needed, since it changes as investors join and leave
+    If the market has rolling statistics and a trend or risk weight (see Market.stats), investors also follow the trend over the
+    statistics window, and are put off by volatility and drawdown (see statsPush). These pushes take no random draws
+    """
+
+    "Range of each random factor: the fraction of the limit that counts as near it, and the size of each push"
+    FACTORS = {
+        'joinLimit': (0.75, 0.95), 'joinLimitPush': (0.3, 0.7), 'joinChange': (0.25, 0.65),
+        'leaveLimit': (0.75, 0.95), 'leaveLimitPush': (0.3, 0.8), 'leaveChange': (0.3, 0.7),
+    }
+
+    def __init__(self, market, marketValues, curTime):
+        self.market = market
+        self.previousValue = float(marketValues[curTime-1])
+        self.recentChange = marketValues[curTime-1] - marketValues[self.windowStart(market, curTime)]
+        self.changeRatio = float(abs(self.recentChange) / market.limit)
+        self.factors = None
+        "Size of the trend push (negative when the market is falling) and of the risk push"
+        self.trendPush, self.riskPush = market.statsPushes()
+
+    @staticmethod
+    def windowStart(market, curTime):
+        "Returns the timestep the market's change is measured from (the first one, or lookBack timesteps before the last one)"
+        if(market.lookBack <= 0):
+            return 0
+        return max(0, curTime - 1 - market.lookBack)
+
+    def drawFactors(self, size, rng=random):
+        "Draws the random factors of size investors (ids 0 to size-1) in one go, from rng's bulk generator (see RandomStreams). Returns self"
+        draws = RandomStreams.UniformBlock(rng, size, len(self.FACTORS))
+        self.factors = {}
+        for name in sorted(self.FACTORS):
+            low, high = self.FACTORS[name]
+            self.factors[name] = draws.uniform(low, high).tolist()
+        return self
+
+    def factor(self, name, i, rng):
+        "Returns investor i's random factor called name (see FACTORS)"
+        if(self.factors is None):
+            low, high = self.FACTORS[name]
+            return rng.uniform(low, high)
+        return self.factors[name][i]
+
+    def limitRatio(self):
+        "Returns the fraction of the market's limit that is currently bought"
+        return float(self.market.totalShares / self.market.limit)
+
+    def statsPush(self, prob, joining):
+        """
+        Returns a probability to join (or to leave, if joining is False) after the trend and risk pushes, starting from prob
+        A rising market moves the probability to join towards 1 (and to leave towards 0), and a falling one the other way. Volatility
+        and drawdown move the probability to join towards 0 (and to leave towards 1). Works on arrays of probabilities too
+        """
+        trend = self.trendPush if joining else -self.trendPush
+        if(trend > 0):
+            prob = prob + trend * (1.0 - prob)
+        elif(trend < 0):
+            prob = prob + trend * prob
+        if(self.riskPush > 0):
+            if(joining):
+                prob = prob - self.riskPush * prob
+            else:
+                prob = prob + self.riskPush * (1.0 - prob)
+        return prob
+
+    def join(self, i, prob, rng=random):
+        "Returns investor i's probability to join after the market-level pushes, starting from prob"
+
+        #Look at whether or not the number of shares purchased is approaching the market's limit
+        if(self.previousValue >= float(self.market.limit * self.factor('joinLimit', i, rng))):
+            #Move probability to join towards 0, taking into account how close to the limit market is
+            a = self.limitRatio() * self.factor('joinLimitPush', i, rng)
+            prob = prob - float(a * prob)
+
+        #Now change probability depending on recentChange (if it's large and negative, probability should move towards 0, if it's large and positive, it should move towards 1)
+        if(self.recentChange > 0):
+            #Move probability to join towards 1, taking into account extent of change
+            a = self.changeRatio * self.factor('joinChange', i, rng)
+            prob = prob - float(a * float(1.0 - prob))
+
+        elif(self.recentChange < 0):
+            #Move proability to join towards 0, taking into account extent of change
+            a = self.changeRatio * self.factor('joinChange', i, rng)
+            prob = prob - float(a * prob)
+
+        #Follow the trend, and shy away from volatility and drawdown, if switched on
+        prob = self.statsPush(prob, True)
+
+        return prob
+
+    def leave(self, i, prob, rng=random):
+        "Returns investor i's probability to leave after the market-level pushes, starting from prob"
+
+        #Look at whether or not the number of shares purchased is approaching the market's limit
+        if(self.previousValue >= float(self.market.limit * self.factor('leaveLimit', i, rng))):
+            #Move probability to leave towards 1, taking into account how close to the limit market is
+            a = self.limitRatio() * self.factor('leaveLimitPush', i, rng)
+            prob = prob + float(a * float(1.0-prob))
+
+        #Now change probability depending on recentChange (if it's large and negative, probability should move towards 1, if it's large and positive, it should move towards 0)
+        if(self.recentChange > 0):
+            #Move probability to leave towards 0, taking into account extent of change
+            a = self.changeRatio * self.factor('leaveChange', i, rng)
+            prob = prob - float(a * prob)
+
+        elif(self.recentChange < 0):
+            #Move proability to leave towards 1, taking into account extent of change
+            a = self.changeRatio * self.factor('leaveChange', i, rng)
+            prob = prob + float(a * float(1.0-prob))
+
+        #Follow the trend, and shy away from volatility and drawdown, if switched on
+        prob = self.statsPush(prob, False)
+
+        return prob
@@ -0,0 +1,129 @@
+"""
+Opt-in profiling of simulation runs
+A Profiler keeps timers for each phase of a run (building the social sphere, setting up investors, and each part of a tick: working
+out probabilities, deciding who moves, and updating the market), and counters for what happened (neighbour visits, joins, leaves, and
+joins/leaves that were blocked, along with why). At the end of a run it gives a text report, and can save a JSON trace with the
+totals and a record for every timestep
+
+When profiling is switched off, NULL (a NullProfiler) is used instead. Its methods do nothing, and code that would need extra work to
+measure something checks profiler.enabled first, so a run that isn't being profiled costs next to nothing extra
+"""
+
+import json
+import timeit
+
+"Clock used for all timings"
+clock = timeit.default_timer
+
+
+class Phase(object):
+    "Times one phase of a run (see Profiler.time)"
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = clock()
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.profiler.add(self.name, clock() - self.start)
+        return False
+
+
+class Profiler(object):
+    """
+    Timers and counters for one run
+    phases: dictionary mapping each phase name to [total seconds, number of times timed]
+    counters: dictionary mapping each counter name to its total
+    ticks: one record per timestep, holding that timestep's phase times and counters
+    """
+
+    enabled = True
+
+    def __init__(self):
+        self.phases = {}
+        self.counters = {}
+        self.ticks = []
+        self.tickPhases = {}
+        self.tickCounters = {}
+
+    def time(self, name):
+        "Returns a context manager that times the code run inside it as the given phase"
+        return Phase(self, name)
+
+    def add(self, name, seconds, calls=1):
+        "Adds time spent in a phase"
+        phase = self.phases.setdefault(name, [0.0, 0])
+        phase[0] = phase[0] + seconds
+        phase[1] = phase[1] + calls
+        self.tickPhases[name] = self.tickPhases.get(name, 0.0) + seconds
+
+    def count(self, name, n=1):
+        "Adds n to a counter"
+        self.counters[name] = self.counters.get(name, 0) + n
+        self.tickCounters[name] = self.tickCounters.get(name, 0) + n
+
+    def endTick(self, curTime):
+        "Records everything timed and counted since the last timestep as timestep curTime"
+        self.ticks.append({'tick': curTime, 'phases': self.tickPhases, 'counters': self.tickCounters})
+        self.tickPhases = {}
+        self.tickCounters = {}
+
+    def report(self):
+        "Returns a text report of where the run's time went, and what happened"
+        lines = []
+        lines.append('%-28s %12s %10s %12s %7s' % ('phase', 'seconds', 'calls', 'ms/call', '%'))
+        "Sub-phases (e.g. tick.probability) are part of their parent phase, so only top level phases add up to the total"
+        total = sum(self.phases[name][0] for name in self.phases if '.' not in name)
+        for name in sorted(self.phases):
+            seconds, calls = self.phases[name]
+            lines.append('%-28s %12.4f %10d %12.4f %7.1f' % (name, seconds, calls, 1000.0 * seconds / max(calls, 1), 100.0 * seconds / total if total > 0 else 0.0))
+        lines.append('%-28s %12.4f' % ('total', total))
+        lines.append('')
+        lines.append('%-28s %12s %12s' % ('counter', 'total', 'per tick'))
+        for name in sorted(self.counters):
+            lines.append('%-28s %12d %12.1f' % (name, self.counters[name], float(self.counters[name]) / max(len(self.ticks), 1)))
+        return '\n'.join(lines)
+
+    def trace(self):
+        "Returns everything recorded as a dictionary (phase totals, counter totals, and a record for every timestep)"
+        return {
+            'phases': dict((name, {'seconds': self.phases[name][0], 'calls': self.phases[name][1]}) for name in self.phases),
+            'counters': self.counters,
+            'ticks': self.ticks,
+        }
+
+    def save(self, filename):
+        "Writes the trace (see trace) to a JSON file"
+        with open(filename, 'w') as fout:
+            json.dump(self.trace(), fout)
+
+
+class NullProfiler(object):
+    "Stands in for a Profiler when profiling is switched off. Does nothing"
+
+    enabled = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        return False
+
+    def time(self, name):
+        return self
+
+    def add(self, name, seconds, calls=1):
+        pass
+
+    def count(self, name, n=1):
+        pass
+
+    def endTick(self, curTime):
+        pass
+
+
+"Shared profiler to use when profiling is switched off"
+NULL = NullProfiler()
@@ -0,0 +1,91 @@
+"""
+Seeded sources of randomness owned by the simulation
+A run is seeded once (from config.txt), and separate, independent streams are derived from that seed for graph construction,
+investor setup and each tick. Since every stream depends only on the seed and its name, a run is repeatable bit for bit, and a tick's
+draws don't depend on how much randomness earlier parts of the run used (so ticks can be split across processes)
+
+Anything that takes an rng argument accepts either a Stream or the random module itself (the default, which keeps the old behaviour of
+using the global generators). Use bulk(rng) to get the numpy generator that goes with it
+"""
+
+import hashlib
+import random
+import numpy
+
+def deriveSeed(seed, *key):
+    "Returns a 32 bit seed derived from a base seed and a key (e.g. a stream name and a tick number)"
+    text = ':'.join([str(seed)] + [str(part) for part in key])
+    return int(hashlib.sha1(text.encode('ascii')).hexdigest()[:8], 16)
+
+def bulk(rng):
+    "Returns the numpy generator to use for bulk draws alongside rng (numpy.random itself if rng is the random module)"
+    return getattr(rng, 'bulk', numpy.random)
+
+
+class Stream(random.Random):
+    """
+    One stream of random numbers. Works like the random module (random(), uniform(), randint(), ...) for single draws, and has a
+    numpy RandomState (bulk) seeded from the same seed for drawing whole arrays at once
+    """
+
+    def __init__(self, seed):
+        random.Random.__init__(self, seed)
+        self.bulk = numpy.random.RandomState(seed)
+
+
+class UniformBlock(object):
+    """
+    Pre-generated arrays of uniform draws for a batch computation (such as a vectorized tick), handed out one array at a time
+    Draws are generated in as few calls to the bulk generator as possible (as many arrays at once as fit in maxBytes), and the
+    numbers handed out are the same however they are chunked
+    """
+
+    def __init__(self, rng, size, numArrays, maxBytes=32*1024*1024):
+        self.bulk = bulk(rng)
+        self.size = size
+        self.remaining = numArrays
+        self.arraysPerFill = max(1, min(numArrays, maxBytes // (8 * max(1, size))))
+        self.draws = []
+
+    def random(self):
+        "Returns the next array of draws in [0, 1)"
+        if(len(self.draws) == 0):
+            if(self.remaining <= 0):
+                raise IndexError('uniform block has run out of pre-generated draws')
+            numArrays = min(self.arraysPerFill, self.remaining)
+            self.remaining = self.remaining - numArrays
+            self.draws = list(self.bulk.random_sample((numArrays, self.size)))[::-1]
+        return self.draws.pop()
+
+    def uniform(self, low, high):
+        "Returns the next array of draws, scaled to [low, high)"
+        return low + (high - low) * self.random()
+
+
+class RandomStreams(object):
+    """
+    All of the random streams for one run, derived from a single seed (a random seed is picked if none is given)
+    graph: stream for building the social sphere
+    setup: stream for setting up investors and the market
+    tick(t): stream for timestep t
+    churn(t): stream for changing the social sphere's edges at timestep t
+    """
+
+    def __init__(self, seed=None):
+        if(seed is None):
+            seed = random.SystemRandom().randint(0, 2**32 - 1)
+        self.seed = seed
+        self.graph = self.stream('graph')
+        self.setup = self.stream('setup')
+
+    def stream(self, *key):
+        "Returns a new stream for the given key (always the same numbers for the same seed and key)"
+        return Stream(deriveSeed(self.seed, *key))
+
+    def tick(self, t):
+        "Returns the stream for timestep t"
+        return self.stream('tick', t)
+
+    def churn(self, t):
+        "Returns the stream for changing the social sphere's edges at timestep t (see SocialSphere.churn)"
+        return self.stream('churn', t)
@@ -0,0 +1,150 @@
+"""
+Streaming output of simulation results
+Each timestep's market value, and how many investors joined and left the market in it, are written out as the simulation runs
+(one row per timestep), instead of all at once at the end. Rows are buffered and flushed every few hundred timesteps, so memory use is
+constant however long the run is, and the output can be followed while the simulation is still going
+Runner.runSimulation also flushes the rows (all the way to disk) before every checkpoint, so a run resumed from that checkpoint finds
+every earlier row in the file. If any are missing, start refuses to carry on rather than leave a gap
+
+Two formats are supported:
+-csv: one row per timestep, with a header row
+-binary: columnar. One raw little-endian file per column (<name>.<column>.bin) plus a small header file (<name>.header) describing them.
+Each column file can be read straight into numpy (see readBinary), and appending a row just appends to each column file
+"""
+
+import csv
+import json
+import os
+import numpy
+
+COLUMNS = [('tick', '<i8'), ('market_value', '<f8'), ('joined', '<i8'), ('left', '<i8')]
+
+def openWriter(format, filename, bufferRows=256):
+    "Returns a results writer for the given format ('csv' or 'binary')"
+    if(format == 'binary'):
+        return BinaryResultsWriter(filename, bufferRows)
+    elif(format == 'csv'):
+        return CsvResultsWriter(filename, bufferRows)
+    raise ValueError('unknown output format ' + repr(format))
+
+
+class CsvResultsWriter(object):
+    "Writes one CSV row per timestep: tick, market_value, joined, left"
+
+    def __init__(self, filename, bufferRows=256):
+        self.filename = filename
+        self.bufferRows = bufferRows
+        self.rows = []
+        self.fout = None
+
+    def start(self, firstTick):
+        """
+        Gets ready to write rows from firstTick onwards. Rows already in the file for earlier timesteps are kept (e.g. when resuming from
+        a checkpoint); anything from firstTick on is dropped. Raises ValueError if any of the earlier rows are missing
+        """
+        self.fout = open(self.filename + '.tmp', 'wb')
+        self.writer = csv.writer(self.fout)
+        self.writer.writerow([name for name, dtype in COLUMNS])
+        numKept = 0
+        if(firstTick > 0 and os.path.exists(self.filename)):
+            "Copy over earlier rows one at a time"
+            with open(self.filename, 'rb') as fin:
+                reader = csv.reader(fin)
+                next(reader)
+                for row in reader:
+                    if(int(row[0]) < firstTick):
+                        self.writer.writerow(row)
+                        numKept = numKept + 1
+        if(numKept < firstTick):
+            self.fout.close()
+            self.fout = None
+            os.remove(self.filename + '.tmp')
+            raise ValueError(self.filename + ' only has ' + str(numKept) + ' of the ' + str(firstTick) + ' rows from before timestep ' + str(firstTick))
+        self.fout.flush()
+        os.rename(self.filename + '.tmp', self.filename)
+
+    def write(self, tick, marketValue, joined, left):
+        "Adds the results of one timestep"
+        self.rows.append((tick, repr(float(marketValue)), joined, left))
+        if(len(self.rows) >= self.bufferRows):
+            self.flush()
+
+    def flush(self, sync=False):
+        "Writes out any buffered rows. If sync is True, waits until they're on disk (see Runner.runSimulation, before checkpoints)"
+        self.writer.writerows(self.rows)
+        self.fout.flush()
+        if(sync):
+            os.fsync(self.fout.fileno())
+        self.rows = []
+
+    def close(self):
+        "Writes out any buffered rows and closes the file (if start got as far as opening it)"
+        if(self.fout is None):
+            return
+        self.flush()
+        self.fout.close()
+        self.fout = None
+
+
+class BinaryResultsWriter(object):
+    "Writes results in an appendable binary columnar format (one raw file per column)"
+
+    def __init__(self, filename, bufferRows=256):
+        self.filename = filename
+        self.bufferRows = bufferRows
+        self.columns = [[] for column in COLUMNS]
+        self.files = []
+
+    def start(self, firstTick):
+        """
+        Gets ready to write rows from firstTick onwards. Rows already written for earlier timesteps are kept (e.g. when resuming from a
+        checkpoint); anything from firstTick on is dropped. Raises ValueError if any of the earlier rows are missing
+        """
+        for name, dtype in COLUMNS:
+            path = columnFile(self.filename, name)
+            numKept = os.path.getsize(path) // numpy.dtype(dtype).itemsize if os.path.exists(path) else 0
+            if(numKept < firstTick):
+                raise ValueError(path + ' only has ' + str(numKept) + ' of the ' + str(firstTick) + ' rows from before timestep ' + str(firstTick))
+        with open(self.filename + '.header', 'w') as fout:
+            json.dump({'columns': [{'name': name, 'dtype': dtype, 'file': os.path.basename(columnFile(self.filename, name))} for name, dtype in COLUMNS]}, fout)
+        for name, dtype in COLUMNS:
+            path = columnFile(self.filename, name)
+            fout = open(path, 'ab' if os.path.exists(path) else 'wb')
+            fout.truncate(min(os.path.getsize(path), firstTick * numpy.dtype(dtype).itemsize))
+            fout.seek(0, os.SEEK_END)
+            self.files.append(fout)
+
+    def write(self, tick, marketValue, joined, left):
+        "Adds the results of one timestep"
+        for column, value in zip(self.columns, (tick, marketValue, joined, left)):
+            column.append(value)
+        if(len(self.columns[0]) >= self.bufferRows):
+            self.flush()
+
+    def flush(self, sync=False):
+        "Appends any buffered rows to the column files. If sync is True, waits until they're on disk"
+        for (name, dtype), column, fout in zip(COLUMNS, self.columns, self.files):
+            fout.write(numpy.array(column, dtype=dtype).tostring())
+            fout.flush()
+            if(sync):
+                os.fsync(fout.fileno())
+        self.columns = [[] for column in COLUMNS]
+
+    def close(self):
+        self.flush()
+        for fout in self.files:
+            fout.close()
+
+
+def columnFile(filename, name):
+    "Returns the name of the file holding one column of binary results"
+    return filename + '.' + name + '.bin'
+
+def readBinary(filename):
+    "Reads binary results (see BinaryResultsWriter), and returns a dictionary mapping each column name to a numpy array"
+    with open(filename + '.header') as fin:
+        header = json.load(fin)
+    columns = {}
+    for column in header['columns']:
+        columns[column['name']] = numpy.fromfile(os.path.join(os.path.dirname(filename), column['file']), dtype=column['dtype'])
+    return columns
@@ -0,0 +1,152 @@
+"""
+Rolling statistics of the market's value
+Fed one market value per timestep, and keeps everything up to date as it goes (instead of scanning the whole list of market values):
+-RollingWindow: mean, variance, smallest and largest of the last few values. The mean and variance come from running sums, and the
+smallest and largest from monotonic queues (each value goes in and comes out of each queue once), so every update takes O(1) time
+-MarketStats: the swing (largest minus smallest value so far), trend, volatility and drawdown of a market, all relative to its limit
+"""
+
+import collections
+import math
+
+class RollingWindow(object):
+    """
+    Statistics of the last size values added (or of every value added, if size is 0)
+    Sums are kept relative to a recent value (moved to the window's mean once every size values, which costs O(1) per value on average),
+    so the variance stays accurate even when the values are large and close together, or drift a long way
+    """
+
+    def __init__(self, size=0):
+        self.size = size
+        self.values = collections.deque()
+        self.count = 0
+        self.shift = None
+        self.total = 0.0
+        self.squares = 0.0
+        "(position, value) pairs: values only ever decrease along maxima, and increase along minima, so the front is the largest/smallest"
+        self.maxima = collections.deque()
+        self.minima = collections.deque()
+
+    def __len__(self):
+        return len(self.values)
+
+    def add(self, value):
+        "Adds the next value, dropping the oldest one if the window is full"
+        value = float(value)
+        if(self.shift is None):
+            self.shift = value
+        self.values.append(value)
+        self.total = self.total + (value - self.shift)
+        self.squares = self.squares + (value - self.shift)**2
+        while(len(self.maxima) > 0 and self.maxima[-1][1] <= value):
+            self.maxima.pop()
+        self.maxima.append((self.count, value))
+        while(len(self.minima) > 0 and self.minima[-1][1] >= value):
+            self.minima.pop()
+        self.minima.append((self.count, value))
+        self.count = self.count + 1
+
+        if(self.size > 0 and len(self.values) > self.size):
+            old = self.values.popleft()
+            self.total = self.total - (old - self.shift)
+            self.squares = self.squares - (old - self.shift)**2
+            oldest = self.count - self.size
+            if(self.maxima[0][0] < oldest):
+                self.maxima.popleft()
+            if(self.minima[0][0] < oldest):
+                self.minima.popleft()
+            if(self.count % self.size == 0):
+                self.recentre()
+
+    def recentre(self):
+        "Works the sums out again, relative to the window's mean"
+        self.shift = self.mean()
+        self.total = 0.0
+        self.squares = 0.0
+        for value in self.values:
+            self.total = self.total + (value - self.shift)
+            self.squares = self.squares + (value - self.shift)**2
+
+    def first(self):
+        "Returns the oldest value in the window"
+        return self.values[0]
+
+    def last(self):
+        "Returns the newest value in the window"
+        return self.values[-1]
+
+    def mean(self):
+        return self.shift + self.total / len(self.values) if len(self.values) > 0 else 0.0
+
+    def variance(self):
+        "Returns the (population) variance of the values in the window"
+        n = len(self.values)
+        if(n == 0):
+            return 0.0
+        return max(self.squares / n - (self.total / n)**2, 0.0)
+
+    def std(self):
+        return math.sqrt(self.variance())
+
+    def max(self):
+        return self.maxima[0][1]
+
+    def min(self):
+        return self.minima[0][1]
+
+
+class MarketStats(object):
+    """
+    Rolling statistics of a market's value, updated once per timestep (see record). Everything is relative to the market's limit
+    swing: largest minus smallest value so far (the measure plotSwingVals and Ensemble report)
+    trend: change in value over the window; volatility: standard deviation of the change per timestep over the window
+    drawdown: how far the value is below the highest value so far; maxDrawdown: the largest drawdown so far
+    """
+
+    def __init__(self, limit, window=20):
+        self.limit = float(limit)
+        self.window = window
+        self.values = RollingWindow(window)
+        self.changes = RollingWindow(window)
+        self.low = None
+        self.high = None
+        self.largestDrawdown = 0.0
+
+    def record(self, value):
+        "Adds the market's value at the end of the next timestep"
+        value = float(value)
+        if(self.high is not None):
+            self.changes.add(value - self.values.last())
+        self.values.add(value)
+        self.low = value if self.low is None else min(self.low, value)
+        self.high = value if self.high is None else max(self.high, value)
+        self.largestDrawdown = max(self.largestDrawdown, self.drawdown())
+
+    def swing(self):
+        return (self.high - self.low) / self.limit if self.high is not None else 0.0
+
+    def trend(self):
+        return (self.values.last() - self.values.first()) / self.limit if len(self.values) > 0 else 0.0
+
+    def volatility(self):
+        return self.changes.std() / self.limit
+
+    def drawdown(self):
+        return (self.high - self.values.last()) / self.limit if self.high is not None else 0.0
+
+    def maxDrawdown(self):
+        return self.largestDrawdown
+
+    def summary(self):
+        "Returns every statistic as a dictionary"
+        return {
+            'swing': self.swing(),
+            'min': self.low,
+            'max': self.high,
+            'trend': self.trend(),
+            'volatility': self.volatility(),
+            'window_min': self.values.min() / self.limit if len(self.values) > 0 else 0.0,
+            'window_max': self.values.max() / self.limit if len(self.values) > 0 else 0.0,
+            'drawdown': self.drawdown(),
+            'max_drawdown': self.maxDrawdown(),
+        }
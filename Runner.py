@@ -1,34 +1,48 @@
 import Market
 import SocialSphere
+import History
+import Checkpoint
+import ResultsWriter
+import RandomStreams
+import Ensemble
+import VectorEngine
+import IncrementalEngine
+import ShardedEngine
+import Profiler
+import Analytics
+import Influence
+import RollingStats
+import LivePlot
 import random
-import csv
-import matplotlib.pyplot as plt
-import numpy
+import os
 
-def setUpInvestors(sphere):
+def setUpInvestors(sphere, history=None, rng=random):
     """
-    Given a social sphere, this function sets up a dictionary of investors, and returns it
+    Given a social sphere, this function sets up the population of investors (see Market.Population), and returns it
     Each investor is given a number of shares (that they can invest), and a starting position (whether or not they start off in the stock market)
+    Investors are numbered by the ids of their nodes in the social sphere's CSR form (see SocialSphere.get_csr)
+    If a market history is given (see History.MarketHistory), each investor can look up their own stances in it
+    rng is the source of randomness (see RandomStreams)
     """
 
-    "Set up empty dictionary"
-    investors = {}
     "Start by getting all nodes from social sphere (each node represents one investor)"
-    nodes = sphere.g.vertices()
-    for node in nodes:
+    csr = sphere.get_csr()
+    degrees = csr.degree_list()
+    "Set up empty population"
+    investors = Market.Population(csr.size, csr.vertices, history)
+    for i in range(csr.size):
         "Probabilistically decide on number of shares for investor, depending on that investor's number of social links"
-        numShares = random.random() * 10 * (len(sphere.g[node])+1) #TODO: Can experiment with how I decide this parameter
-        "Set up investor"
-        investors[node.getLabel()] = Market.Investor(numShares, node)
+        investors.numShares[i] = rng.random() * 10 * (degrees[i]+1) #TODO: Can experiment with how I decide this parameter
 
-    "Return dictionary of investors"
+    "Return population of investors"
     return investors
 
 
-def setUpMarket(investors, probToStartInMarket):
+def setUpMarket(investors, probToStartInMarket, rng=random):
     """
-    Given a dictionary of investors, sets up the stock market model, and returns it
+    Given a population of investors, sets up the stock market model, and returns it
     The market is given a number of purchased shares (representing how many people are invested in it, and how many shares they've purchased)
+    rng is the source of randomness (see RandomStreams)
     """
 
     "Work out how many stocks all investors together can by"
@@ -37,13 +51,13 @@ def setUpMarket(investors, probToStartInMarket):
         totalSharesPurchasable = totalSharesPurchasable + investors[key].getNumShares()
 
     "Set up empty stock market, with stock limit at a fraction of total stocks purchasable by investors"
-    market = Market.Market(float(random.uniform(0.45, 0.85)) * totalSharesPurchasable)
+    market = Market.Market(float(rng.uniform(0.45, 0.85)) * totalSharesPurchasable)
 
     "Loop over all investors, and probabilistically determine their starting position"
     for key in investors:
         curInvestor = investors[key]
         "Randomly decide whether or not the investor is in the stock market"
-        startingPos = (random.random() <= probToStartInMarket)
+        startingPos = (rng.random() <= probToStartInMarket)
         if(startingPos == False):
             curInvestor.stayOutsideMarket()
         "If they're in the market, add them to the market model, if there are enough shares available"
@@ -61,62 +75,146 @@ def setUpMarket(investors, probToStartInMarket):
     return market
 
 
-def tick(market, investors, sphere, marketValues, curTime, largestNumConnections, averageNumConnections, herdBehaviour):
+def tick(market, investors, sphere, marketValues, curTime, largestNumConnections, averageNumConnections, herdBehaviour, rng=random, profiler=Profiler.NULL, updateMode='sequential', influence=None):
     """
     Performs a 'tick' operation on the simulation, moving it forward by one timestep
     For each investor, calculates a probability for them to join/leave the market based on certain factors, and then executes that probabily, and changes market accordingly
+    rng is the source of randomness for this timestep (see RandomStreams)
+    updateMode: 'sequential' changes each investor's stance as soon as it's decided, so investors later in the loop see the moves of
+    earlier ones. 'synchronous' has every investor decide from the state at the end of the previous timestep, and writes the new state to
+    the population's back buffer (see Market.Population.backBuffer), which becomes the current state at the end of the timestep.
+    Either way, the cap on moves and the market's limit are applied in investor order
+    If influence is given (see Influence.ApproximateInfluence), connections' pushes are worked out approximately by it
+    If a profiler is given (see Profiler), time spent working out probabilities, deciding and updating the market is recorded, along with
+    how many joins and leaves happened or were blocked
+    Returns the number of investors that joined, and the number that left, in this timestep
     """
 
     "Loop  over all investors"
-    marketSize = len(sphere.g)
+    marketSize = sphere.get_size()
+    csr = sphere.get_csr()
+    degrees = csr.degree_list()
     numJoined = 0
     numLeft = 0
+    "Only measure anything if profiling is switched on"
+    timing = profiler.enabled
+    probabilityTime = decisionTime = updateTime = messageTime = 0.0
+    blocked = {}
+    synchronous = (updateMode == 'synchronous')
+    if(synchronous):
+        "Decisions read the population and a frozen copy of the market; the new state, worked out from the population (source), goes to the back buffer"
+        nextState = investors.backBuffer()
+        source = investors
+        readMarket = market.snapshot()
+    else:
+        readMarket = market
+        source = None
+    "Market-level signals are the same for every investor, so work them out once, with every investor's random factors drawn in one go"
+    signals = Market.MarketSignals(readMarket, marketValues, curTime).drawFactors(len(investors), rng)
+    numVisited = 0
+    if(influence is not None and herdBehaviour):
+        "Likewise the network and population views the approximate influence reads"
+        influence.startTick(sphere, investors, sphere.get_node_stats(largestNumConnections, averageNumConnections))
+        numVisited = -influence.numUsed
     for key in investors:
         investor = investors[key]
+        if(synchronous):
+            target = nextState[key]
+        else:
+            target = investor
+        if(timing):
+            start = Profiler.clock()
         "For current investor, check whether they're inside/outside the market"
         if(investor.isInMarket()):
             "Calculate a probability for them to leave"
-            probToLeave = investor.probToLeave(sphere, investors, marketValues, curTime, market, largestNumConnections, averageNumConnections, herdBehaviour)
+            probToLeave = investor.probToLeave(sphere, investors, marketValues, curTime, readMarket, largestNumConnections, averageNumConnections, herdBehaviour, rng, influence, signals)
+            if(timing):
+                calculated = Profiler.clock()
             "Determine whether or not they leave (if the investor has joined recently, they can't leave yet)"
-            if(random.random() <= probToLeave and (not investor.changedStanceRecently()) and numLeft <= marketSize/50):
+            roll = rng.random()
+            leaving = (roll <= probToLeave and (not investor.changedStanceRecently()) and numLeft <= marketSize/50)
+            if(timing):
+                decided = Profiler.clock()
+                if(roll <= probToLeave and not leaving):
+                    reason = 'blocked_leaves.cooldown' if investor.changedStanceRecently() else 'blocked_leaves.cap'
+                    blocked[reason] = blocked.get(reason, 0) + 1
+            if(leaving):
                 numLeft = numLeft + 1
                 market.removeInvestor(investor)
-                investor.leaveMarket()
-                if(len(sphere.g[investor.node]) > averageNumConnections + 15):
-                    print('Investor with ' + str(len(sphere.g[investor.node]))) + ' connections left market at ' + str(curTime)
+                target.leaveMarket(source)
+                if(degrees[investor.index] > averageNumConnections + 15):
+                    if(timing):
+                        updated = Profiler.clock()
+                    print('Investor with ' + str(degrees[investor.index])) + ' connections left market at ' + str(curTime)
+                    if(timing):
+                        messageTime = messageTime + Profiler.clock() - updated
             else:
-                investor.stayInMarket()
+                target.stayInMarket(source)
         else:
             "Calculate a probability for them to join"
-            probToJoin = investor.probToJoin(sphere, investors, marketValues, curTime, market, largestNumConnections, averageNumConnections, herdBehaviour)
+            probToJoin = investor.probToJoin(sphere, investors, marketValues, curTime, readMarket, largestNumConnections, averageNumConnections, herdBehaviour, rng, influence, signals)
+            if(timing):
+                calculated = Profiler.clock()
             "Determine whether or not they join (if the investor has left recently, they can't join yet)"
-            if(random.random() <= probToJoin and market.canJoin(investor) and (not investor.changedStanceRecently()) and numJoined <= marketSize/50):
+            roll = rng.random()
+            joining = (roll <= probToJoin and market.canJoin(investor) and (not investor.changedStanceRecently()) and numJoined <= marketSize/50)
+            if(timing):
+                decided = Profiler.clock()
+                if(roll <= probToJoin and not joining):
+                    if(not market.canJoin(investor)):
+                        reason = 'blocked_joins.market_full'
+                    elif(investor.changedStanceRecently()):
+                        reason = 'blocked_joins.cooldown'
+                    else:
+                        reason = 'blocked_joins.cap'
+                    blocked[reason] = blocked.get(reason, 0) + 1
+            if(joining):
                 market.addInvestor(investor)
-                investor.enterMarket()
+                target.enterMarket(source)
                 numJoined = numJoined + 1
-                if(len(sphere.g[investor.node]) >= averageNumConnections + 15):
-                    print('Investor with ' + str(len(sphere.g[investor.node]))) + ' connections joined market at ' + str(curTime)
+                if(degrees[investor.index] >= averageNumConnections + 15):
+                    if(timing):
+                        updated = Profiler.clock()
+                    print('Investor with ' + str(degrees[investor.index])) + ' connections joined market at ' + str(curTime)
+                    if(timing):
+                        messageTime = messageTime + Profiler.clock() - updated
             else:
-                investor.stayOutsideMarket()
+                target.stayOutsideMarket(source)
+        if(timing):
+            probabilityTime = probabilityTime + calculated - start
+            decisionTime = decisionTime + decided - calculated
+            updateTime = updateTime + Profiler.clock() - decided
     #print(str(numJoined) + ' ' + str(numLeft))
+    if(synchronous):
+        investors.swapBuffers()
+
+    if(timing):
+        profiler.add('tick.probability', probabilityTime)
+        profiler.add('tick.decision', decisionTime)
+        profiler.add('tick.market_update', updateTime)
+        "Time spent printing messages about hubs is part of updating the market, but is also shown on its own"
+        profiler.add('tick.market_update.messages', messageTime)
+        "With herd behaviour on, every investor looks at every one of their connections, unless the approximate influence skips some"
+        if(herdBehaviour):
+            numVisited = numVisited + (influence.numUsed if influence is not None else 2 * csr.num_edges())
+        profiler.count('neighbour_visits', numVisited)
+        profiler.count('joins', numJoined)
+        profiler.count('leaves', numLeft)
+        for reason in blocked:
+            profiler.count(reason, blocked[reason])
+    return numJoined, numLeft
+
+def recordHistory(history, investors, sphere):
+    "Records the current stance of every investor (in the order of the social sphere's CSR ids) as the next timestep of the market history"
+    history.record(investors.arrays()['inMarket'])
 
 def getLargestNumConnections(sphere):
     "Given a social sphere object, return the largest number of connections any node in the graph has (i.e. largest degree)"
-    largest = 0
-    nodes = sphere.g.vertices()
-    for key in nodes:
-        numConnections = len(sphere.g[key])
-        largest = max(numConnections, largest)
-    return largest
+    return Analytics.largestDegree(sphere)
 
 def getAverageNumConnections(sphere):
-    "Given a social sphere object, return the average number of connections for a node in the social sphere's graph"
-    total = 0
-    nodes = sphere.g.vertices()
-    for key in nodes:
-        numConnections = len(sphere.g[key])
-        total = total + numConnections
-    return (total / len(nodes))
+    "Given a social sphere object, return the average number of connections for a node in the social sphere's graph (rounded down)"
+    return int(Analytics.averageDegree(sphere))
 
 def readConfig(filename):
     "Given the filename of a config file, read all of the parameters in the file, and return them"
@@ -135,131 +233,325 @@ def readConfig(filename):
         tokens[0] = tokens[0].strip()
         tokens[1] = tokens[1].strip()
         #First token is name of parameter (second token is value)
-        if(tokens[0] == 'model'):
-            parameters['model'] = tokens[1]
-        elif(tokens[0] == 'size'):
-            parameters['size'] = int(tokens[1])
-        elif(tokens[0] == 'timesteps'):
-            parameters['timesteps'] = int(tokens[1])
-        elif(tokens[0] == 'investor_start'):
-            parameters['investor_start'] = float(tokens[1])
-        elif(tokens[0] == 'herd'):
-            parameters['herd'] = (tokens[1] == 'on')
-        elif(tokens[0] == 'k'):
-            parameters['k'] = int(tokens[1])
-        elif(tokens[0] == 'rewire'):
-            parameters['rewire'] = float(tokens[1])
+        setParameter(parameters, tokens[0], tokens[1])
+    checkParameters(parameters)
     return parameters
 
-def plotSwingVals():
-    "Find all swing values for Barabasi-Albert model"
-    BAswings = []
-    for j in range(10):
-        s = SocialSphere.SocialSphere(3000, 'ba')
-        investors = setUpInvestors(s)
-        market = setUpMarket(investors, 0.35)
-        largestNumConnections = getLargestNumConnections(s)
-        averageNumConnections = getAverageNumConnections(s)
-        marketValues = []
-        marketValues.append(market.totalShares)
-        for i in range(1,301):
-            tick(market, investors, s, marketValues, i, largestNumConnections, averageNumConnections, True)
-            marketValues.append(market.totalShares)
-        swing = float((max(marketValues) - min(marketValues))/market.limit)
-        BAswings.append(swing)
-
-    "Find all swing values for Watts-Strogatz model"
-    WSswings = []
-    for j in range(10):
-        s = SocialSphere.SocialSphere(3000, 'ws', 3, 0.15)
-        investors = setUpInvestors(s)
-        market = setUpMarket(investors, 0.35)
-        largestNumConnections = getLargestNumConnections(s)
-        averageNumConnections = getAverageNumConnections(s)
-        marketValues = []
-        marketValues.append(market.totalShares)
-        for i in range(1,301):
-            tick(market, investors, s, marketValues, i, largestNumConnections, averageNumConnections, True)
-            marketValues.append(market.totalShares)
-        swing = float((max(marketValues) - min(marketValues))/market.limit)
-        WSswings.append(swing)
-
-    "Find all swing values for no herd behaviour"
-    NoHerdSwings = []
-    for j in range(10):
-        s = SocialSphere.SocialSphere(3000, 'ba', 3, 0.15)
-        investors = setUpInvestors(s)
-        market = setUpMarket(investors, 0.35)
-        largestNumConnections = getLargestNumConnections(s)
-        averageNumConnections = getAverageNumConnections(s)
-        marketValues = []
-        marketValues.append(market.totalShares)
-        for i in range(1,301):
-            tick(market, investors, s, marketValues, i, largestNumConnections, averageNumConnections, False)
-            marketValues.append(market.totalShares)
-        swing = float((max(marketValues) - min(marketValues))/market.limit)
-        NoHerdSwings.append(swing)
+def checkParameters(parameters):
+    "Raises ValueError if the parameters can't be used together, so that a run fails before it starts rather than part way through"
+    if(parameters.get('engine') == 'sharded' and parameters.get('churn_rate', 0.0) > 0):
+        raise ValueError('the sharded engine needs a fixed social sphere, so churn_rate must be 0 with engine = sharded')
 
-    "Find 3 averages"
-    avgBA = float(sum(BAswings)/len(BAswings))
-    avgWS = float(sum(WSswings)/len(WSswings))
-    avgNoHerd = float(sum(NoHerdSwings)/len(NoHerdSwings))
+def setParameter(parameters, name, value):
+    "Given the name of a parameter and its value (as written in the config file), convert the value to the right type and store it in parameters"
+    if(name == 'model'):
+        parameters['model'] = value
+    elif(name == 'size'):
+        parameters['size'] = int(value)
+    elif(name == 'timesteps'):
+        parameters['timesteps'] = int(value)
+    elif(name == 'investor_start'):
+        parameters['investor_start'] = float(value)
+    elif(name == 'herd'):
+        parameters['herd'] = (value == 'on')
+    elif(name == 'k'):
+        parameters['k'] = int(value)
+    elif(name == 'rewire'):
+        parameters['rewire'] = float(value)
+    elif(name == 'engine'):
+        parameters['engine'] = value
+    elif(name == 'influence'):
+        parameters['influence'] = value
+    elif(name == 'influence_tolerance'):
+        parameters['influence_tolerance'] = float(value)
+    elif(name == 'influence_sample'):
+        parameters['influence_sample'] = int(value)
+    elif(name == 'influence_degree'):
+        parameters['influence_degree'] = int(value)
+    elif(name == 'lookback'):
+        parameters['lookback'] = int(value)
+    elif(name == 'stats_window'):
+        parameters['stats_window'] = int(value)
+    elif(name == 'trend_weight'):
+        parameters['trend_weight'] = float(value)
+    elif(name == 'risk_weight'):
+        parameters['risk_weight'] = float(value)
+    elif(name == 'admission'):
+        parameters['admission'] = value
+    elif(name == 'churn_rate'):
+        parameters['churn_rate'] = float(value)
+    elif(name == 'churn_mode'):
+        parameters['churn_mode'] = value
+    elif(name == 'update_mode'):
+        parameters['update_mode'] = value
+    elif(name == 'shards'):
+        parameters['shards'] = int(value)
+    elif(name == 'processes'):
+        parameters['processes'] = None if int(value) == 0 else int(value)
+    elif(name == 'history_window'):
+        parameters['history_window'] = int(value)
+    elif(name == 'history_max_mb'):
+        parameters['history_max_mb'] = float(value)
+    elif(name == 'seed'):
+        parameters['seed'] = None if value == 'random' else int(value)
+    elif(name == 'checkpoint_interval'):
+        parameters['checkpoint_interval'] = int(value)
+    elif(name == 'checkpoint_file'):
+        parameters['checkpoint_file'] = value
+    elif(name == 'resume'):
+        parameters['resume'] = (value == 'on')
+    elif(name == 'output'):
+        parameters['output'] = value
+    elif(name == 'output_file'):
+        parameters['output_file'] = value
+    elif(name == 'edge_file'):
+        parameters['edge_file'] = value
+    elif(name == 'graph_file'):
+        parameters['graph_file'] = None if value == 'none' else value
+    elif(name == 'plot'):
+        parameters['plot'] = value
+    elif(name == 'plot_interval'):
+        parameters['plot_interval'] = float(value)
+    elif(name == 'plot_page'):
+        parameters['plot_page'] = value
+    elif(name == 'profile'):
+        parameters['profile'] = (value == 'on')
+    elif(name == 'profile_file'):
+        parameters['profile_file'] = value
 
-    "Plot data on bar chart"
-    swings = [avgBA, avgWS, avgNoHerd]
+def plotSwingVals(processes=None):
+    """
+    Runs 10 simulations each for the Barabasi-Albert model, the Watts-Strogatz model and no herd behaviour (3000 investors, 300 timesteps),
+    and plots the average market swing of each on a bar chart
+    Simulations are run in parallel over a pool of processes (see Ensemble.runEnsemble), and the chart ("Swings.jpg") is redrawn in
+    the background as their results come in (see LivePlot)
+    """
+    base = {'size': 3000, 'timesteps': 300, 'investor_start': 0.35, 'k': 3, 'rewire': 0.15}
+    configs = [dict(base, model='ba', herd=True), dict(base, model='ws', herd=True), dict(base, model='ba', herd=False)]
+
+    "Plot the average swing of each set of parameters on a bar chart, as the swing values come in"
     names = ['Barabasi-Albert', 'Watts-Strogatz', 'No Social Sphere']
-    y_pos = numpy.arange(len(names))
-    fig = plt.figure()
-    plt.bar(y_pos, swings, align='center')
-    plt.xticks(y_pos, names)
-    plt.ylabel('Market Swing')
-    fig.suptitle('Swing Values for Different Social Networks')
-    fig.savefig('Swings.jpg')
-    plt.show()
+    plot = LivePlot.LivePlot(LivePlot.SwingChart(names), 'Swings.jpg', title='Swings')
+    for result in Ensemble.runEnsemble(configs, 10, processes):
+        plot.send((result['config'], result['swing']))
+    plot.close()
 
-def main():
-    "Read all parameters from config file"
-    params = readConfig('config.txt')
+def makeEngine(name, sphere, investors, shards=16, processes=None):
+    """
+    Given the name of a tick engine ('vectorized', 'incremental' or 'sharded'), sets it up from the social sphere and investors, and returns it
+    shards and processes are only used by the 'sharded' engine (see ShardedEngine)
+    Returns None for the 'legacy' engine (which works on the investors directly, see tick)
+    """
+    if(name == 'vectorized'):
+        return VectorEngine.VectorEngine(sphere, investors)
+    elif(name == 'incremental'):
+        return IncrementalEngine.IncrementalEngine(sphere, investors)
+    elif(name == 'sharded'):
+        return ShardedEngine.ShardedEngine(sphere, investors, shards, processes)
+    return None
 
-    "Set up social sphere"
+def buildSphere(params, rng=random):
+    """
+    Given the simulation parameters, set up the social sphere
+    If params['graph_file'] names a saved social sphere, it's opened (memory mapped) instead of building a new one. If that file
+    doesn't exist yet, the new social sphere is saved to it, so that later runs can share the same network
+    """
+    graphFile = params.get('graph_file')
+    if(graphFile and os.path.exists(graphFile)):
+        return SocialSphere.SocialSphere.load(graphFile)
     if(params['model'] == 'ba'):
-        s = SocialSphere.SocialSphere(params['size'], params['model'])
+        sphere = SocialSphere.SocialSphere(params['size'], params['model'], rng=rng)
+    elif(params['model'] == 'edgelist'):
+        sphere = SocialSphere.SocialSphere(model='edgelist', edgeFile=params['edge_file'])
+        stats = sphere.loadStats
+        print('Read ' + str(stats['edges_read']) + ' edges (' + str(stats['edges']) + ' unique, ' + str(stats['nodes']) + ' investors) from ' + params['edge_file'] + ' in ' + ('%.2f' % stats['seconds']) + 's (' + ('%.0f' % stats['edges_per_second']) + ' edges/sec)')
     else:
-        s = SocialSphere.SocialSphere(params['size'], params['model'], params['k'], params['rewire'])
+        sphere = SocialSphere.SocialSphere(params['size'], params['model'], params['k'], params['rewire'], rng)
+    if(graphFile):
+        sphere.save(graphFile)
+    return sphere
 
-    "Set up dictionary of investors"
-    investors = setUpInvestors(s)
+def runSimulation(params, writer=None, profiler=Profiler.NULL, plot=False):
+    """
+    Runs one full simulation with the given parameters (see readConfig)
+    Returns the market model, and the list of market values at every timestep
+    The market's rolling statistics (swing, trend, volatility, drawdown) are kept up to date as the run goes (see RollingStats)
+    If a results writer is given (see ResultsWriter), each timestep's results are streamed to it as they are produced
+    All randomness comes from streams derived from params['seed'] (see RandomStreams), so runs with the same seed are identical
+    If checkpointing is switched on, the full state of the run is saved every params['checkpoint_interval'] timesteps, and if
+    params['resume'] is set the run carries on from the last checkpoint (see Checkpoint)
+    If a profiler is given (see Profiler), the time spent in each phase of the run is recorded in it
+    If plot is True, the market values are plotted in the background as the run goes, as set by params['plot'] (see LivePlot)
+    """
+    checkParameters(params)
+    checkpointFile = params.get('checkpoint_file', 'checkpoint.npz')
+    checkpointInterval = params.get('checkpoint_interval', 0)
 
-    "Set up stock market"
-    market = setUpMarket(investors, params['investor_start'])
+    if(params.get('resume', False) and os.path.exists(checkpointFile)):
+        "Pick up where the last checkpoint left off"
+        restored = Checkpoint.load(checkpointFile)
+        streams = RandomStreams.RandomStreams(restored['seed'])
+        s = restored['sphere']
+        history = restored['history']
+        investors = restored['investors']
+        market = restored['market']
+        marketValues = restored['marketValues']
+        startTime = restored['curTime'] + 1
+    else:
+        "Set up random streams"
+        streams = RandomStreams.RandomStreams(params.get('seed'))
+
+        "Set up social sphere"
+        with profiler.time('graph'):
+            s = buildSphere(params, streams.graph)
+
+        "Set up market history (stance of every investor at every timestep, optionally limited to a window and/or a memory cap)"
+        history = History.MarketHistory(s.get_size(), params.get('history_window', 0), int(params.get('history_max_mb', 0) * 1024 * 1024))
+
+        "Set up dictionary of investors"
+        with profiler.time('investor_setup'):
+            investors = setUpInvestors(s, history, streams.setup)
+
+        "Set up stock market"
+        with profiler.time('market_setup'):
+            market = setUpMarket(investors, params['investor_start'], streams.setup)
+        recordHistory(history, investors, s)
+
+        marketValues = []
+        marketValues.append(market.totalShares)
+        startTime = 1
+
+    "How far back investors look when judging how the market has changed (see Market.MarketSignals)"
+    market.lookBack = params.get('lookback', 0)
+
+    "Keep rolling statistics of the market's value (rebuilt from the values so far, if resuming), and let investors use them if asked to"
+    market.stats = RollingStats.MarketStats(market.limit, params.get('stats_window', 20))
+    for value in marketValues:
+        market.stats.record(value)
+    market.trendWeight = params.get('trend_weight', 0.0)
+    market.riskWeight = params.get('risk_weight', 0.0)
+
+    "Start plotting (with the values so far, if resuming)"
+    live = None
+    if(plot):
+        live = LivePlot.openPlot(params, LivePlot.MarketChart(s.get_size(), params['timesteps'], market.limit), 'result.jpg')
+    if(live is not None):
+        for t in range(len(marketValues)):
+            live.send((t, marketValues[t]))
+
+    "Get the results writer ready (keeping any results from before the checkpoint, if resuming)"
+    if(writer is not None):
+        writer.start(startTime if startTime > 1 else 0)
+        if(startTime == 1):
+            writer.write(0, marketValues[0], 0, 0)
+
+    "If investors form and drop ties as the run goes, let the social sphere's edges change (see SocialSphere.churn)"
+    churnRate = params.get('churn_rate', 0.0)
+    churnMode = params.get('churn_mode', 'rewire')
+    if(churnRate > 0):
+        s.make_dynamic()
 
     "Get largest number of connections any one investor has"
     largestNumConnections = getLargestNumConnections(s)
     "Get average number of connections within social sphere (B-A model)"
     averageNumConnections = getAverageNumConnections(s)
 
-    "Run simulation over multiple time steps, and plot results as they're generated"
-    marketValues = []
-    marketValues.append(market.totalShares)
-    for i in range(1,(params['timesteps']+1)):
-        tick(market, investors, s, marketValues, i, largestNumConnections, averageNumConnections, params['herd'])
-        marketValues.append(market.totalShares)
+    "Run simulation over multiple time steps"
+    "Move investor state into flat arrays, and compute each time step in batch (unless using the legacy engine)"
+    with profiler.time('engine_setup'):
+        engine = makeEngine(params.get('engine', 'legacy'), s, investors, params.get('shards', 16), params.get('processes'))
+        if(engine is not None):
+            engine.admission = params.get('admission', 'arrival')
+    if(engine is not None):
+        "Shut the engine down (e.g. its worker processes) even if the run fails part way"
+        try:
+            for i in range(startTime,(params['timesteps']+1)):
+                if(churnRate > 0):
+                    with profiler.time('churn'):
+                        changes = s.churn(churnRate, churnMode, streams.churn(i))
+                        engine.edgesChanged(changes)
+                    largestNumConnections = changes.largest
+                    averageNumConnections = changes.average
+                with profiler.time('tick'):
+                    numJoined, numLeft = engine.tick(market, marketValues, i, largestNumConnections, averageNumConnections, params['herd'], streams.tick(i), profiler)
+                marketValues.append(market.totalShares)
+                market.stats.record(market.totalShares)
+                with profiler.time('output'):
+                    if(writer is not None):
+                        writer.write(i, market.totalShares, numJoined, numLeft)
+                    if(live is not None):
+                        live.send((i, market.totalShares))
+                with profiler.time('history'):
+                    history.record(engine.inMarket)
+                if(checkpointInterval > 0 and i % checkpointInterval == 0):
+                    with profiler.time('checkpoint'):
+                        "Rows up to here must be on disk before the checkpoint is, or resuming from it would leave a gap in them"
+                        if(writer is not None):
+                            writer.flush(True)
+                        Checkpoint.save(checkpointFile, s, Checkpoint.engineState(engine), market, marketValues, streams.seed, i, history)
+                profiler.endTick(i)
+        finally:
+            engine.close()
+    else:
+        "Work out connections' pushes approximately, if asked to (see Influence)"
+        influence = None
+        if(params.get('influence', 'exact') == 'approximate'):
+            influence = Influence.ApproximateInfluence(params.get('influence_tolerance', 0.001), params.get('influence_sample', 64), params.get('influence_degree', 50))
+        for i in range(startTime,(params['timesteps']+1)):
+            if(churnRate > 0):
+                with profiler.time('churn'):
+                    changes = s.churn(churnRate, churnMode, streams.churn(i))
+                    if(influence is not None):
+                        influence.edgesChanged()
+                largestNumConnections = changes.largest
+                averageNumConnections = changes.average
+            with profiler.time('tick'):
+                numJoined, numLeft = tick(market, investors, s, marketValues, i, largestNumConnections, averageNumConnections, params['herd'], streams.tick(i), profiler, params.get('update_mode', 'sequential'), influence)
+            marketValues.append(market.totalShares)
+            market.stats.record(market.totalShares)
+            with profiler.time('output'):
+                if(writer is not None):
+                    writer.write(i, market.totalShares, numJoined, numLeft)
+                if(live is not None):
+                    live.send((i, market.totalShares))
+            with profiler.time('history'):
+                recordHistory(history, investors, s)
+            if(checkpointInterval > 0 and i % checkpointInterval == 0):
+                with profiler.time('checkpoint'):
+                    "Rows up to here must be on disk before the checkpoint is, or resuming from it would leave a gap in them"
+                    if(writer is not None):
+                        writer.flush(True)
+                    Checkpoint.save(checkpointFile, s, Checkpoint.investorState(investors), market, marketValues, streams.seed, i, history)
+            profiler.endTick(i)
+        if(influence is not None):
+            print(influence.report())
+    if(live is not None):
+        live.close()
+
+    return market, marketValues
+
+def main():
+    "Read all parameters from config file"
+    params = readConfig('config.txt')
+
+    "Run the simulation, streaming results to a file as they're produced"
+    writer = ResultsWriter.openWriter(params.get('output', 'csv'), params.get('output_file', 'results.csv'))
+    profiler = Profiler.Profiler() if params.get('profile', False) else Profiler.NULL
+    "Market values are plotted to result.jpg as the run goes"
+    try:
+        market, marketValues = runSimulation(params, writer, profiler, True)
+    finally:
+        writer.close()
+
+    "Report where the time went, if profiling"
+    if(profiler.enabled):
+        print(profiler.report())
+        profiler.save(params.get('profile_file', 'profile.json'))
+
+    "Report the market's swing, trend, volatility and drawdown"
+    stats = market.stats.summary()
+    print('Swing ' + ('%.4f' % stats['swing']) + ', trend ' + ('%.4f' % stats['trend']) + ', volatility ' + ('%.4f' % stats['volatility']) + ', drawdown ' + ('%.4f' % stats['drawdown']) + ' (max ' + ('%.4f' % stats['max_drawdown']) + ')')
 
-    "Print all results to a csv file"
-    with open('results.csv', 'wb') as myfile:
-        wr = csv.writer(myfile, quoting=csv.QUOTE_ALL)
-        wr.writerow(marketValues)
-
-    "Plot resutls"
-    largestNumShares = max(marketValues)
-    fig = plt.figure()
-    plt.plot(marketValues)
-    fig.suptitle('Market Values, ' + str(params['size']) + ' investors')
-    plt.ylabel('Shares Purchased')
-    plt.xlabel('Time Steps')
-    plt.axis([0, params['timesteps'], 0, largestNumShares])
-    fig.savefig('result.jpg')
-    plt.show()
-
-main()
-#plotSwingVals()
+if __name__ == '__main__':
+    main()
+    #plotSwingVals()
@@ -0,0 +1,198 @@
+"""
+Sharded tick engine
+Works like VectorEngine, but splits the investors into contiguous blocks (shards) of the social sphere, and works out each shard's
+proposed joins and leaves in a pool of worker processes
+
+Each timestep runs in two rounds over the shards. First every shard works out the pushes its investors give their connections, then
+every shard adds up the pushes its own investors receive and decides who wants to change stance. Both rounds only read the state left
+by the previous timestep, so shards can run in any order, on any process. The proposals are then merged in the main process, in
+investor id order, applying the cooldown, the cap on moves per timestep and Market.canJoin exactly as VectorEngine does
+
+Investor state, pushes and proposals all live in shared memory, and workers inherit the social sphere when they start, so only a few
+numbers are sent to the workers each timestep. Every shard draws from its own stream (seeded from the timestep's stream and the
+shard's number), so results depend on the number of shards, but not on the number of processes
+"""
+
+import ctypes
+import Market
+import multiprocessing
+import multiprocessing.sharedctypes
+import numpy
+import random
+import RandomStreams
+import VectorEngine
+
+def sharedArray(typecode, dtype, values):
+    """
+    Returns a numpy array holding a copy of values, backed by shared memory (so worker processes see every change made to it)
+    typecode is the C type of each element, as an array module typecode or a ctypes type, and must be the same size as dtype
+    """
+    values = numpy.asarray(values)
+    array = numpy.frombuffer(multiprocessing.sharedctypes.RawArray(typecode, max(1, values.size)), dtype=dtype)[:values.size]
+    array[:] = values.ravel()
+    return array.reshape(values.shape)
+
+def shardBounds(degree, numShards):
+    """
+    Splits investors 0..len(degree)-1 into numShards contiguous blocks with roughly the same amount of work (connections plus
+    investors) in each. Returns the numShards+1 boundaries
+    """
+    work = numpy.cumsum(degree + 1)
+    total = work[-1] if len(work) > 0 else 0
+    bounds = numpy.searchsorted(work, total * numpy.arange(1, numShards) / float(numShards), side='right')
+    return numpy.concatenate(([0], bounds, [len(degree)])).astype(numpy.int64)
+
+
+class Shard(VectorEngine.VectorEngine):
+    """
+    One shard of investors (ids low to high-1), as seen by whichever process runs it. Works like a VectorEngine over just those
+    investors, except that herd influence is added up from the pushes every shard has already written to shared memory
+    """
+
+    "Random arrays drawn per shard in the second round (2 starting probabilities, 4 for the market limit, 2 for the market change, 1 for past leaving, 1 roll)"
+    NUM_DRAWS = 10
+    "Random arrays drawn per shard in the first round (8 herd signals)"
+    NUM_PUSH_DRAWS = 8
+
+    def __init__(self, shared, number):
+        self.sphere = shared.sphere
+        self.csr = shared.csr
+        self.low = int(shared.bounds[number])
+        self.high = int(shared.bounds[number+1])
+        self.size = self.high - self.low
+        self.numShares = shared.numShares[self.low:self.high]
+        self.inMarket = shared.inMarket[self.low:self.high]
+        self.lastChange = shared.lastChange[self.low:self.high]
+        self.numTimesLeft = shared.numTimesLeft[self.low:self.high]
+        self.allPushes = shared.pushes
+        self.neighbourVisits = 0
+
+    def nodeStats(self, largestNumConnections, averageNumConnections):
+        hubs, strengths = VectorEngine.VectorEngine.nodeStats(self, largestNumConnections, averageNumConnections)
+        return hubs[self.low:self.high], strengths[self.low:self.high]
+
+    def herdInfluence(self, draws, largestNumConnections, averageNumConnections):
+        "Adds up the pushes (see VectorEngine.herdInfluence) each investor in the shard receives, from the pushes in shared memory"
+        start = self.csr.indptr[self.low]
+        end = self.csr.indptr[self.high]
+        rows = numpy.repeat(numpy.arange(self.size), self.csr.degree[self.low:self.high])
+        cols = self.csr.indices[start:end]
+        self.neighbourVisits = self.neighbourVisits + len(self.allPushes) * len(cols)
+        return tuple(numpy.bincount(rows, weights=push[cols], minlength=self.size) for push in self.allPushes)
+
+
+class SharedState(object):
+    """
+    Everything the shards of one engine share: the social sphere, the investor state, pushes and proposals (in shared memory), and
+    the shard boundaries. Worker processes get it once, when they start (see startWorker)
+    """
+
+    def __init__(self, sphere, state, numShards):
+        self.sphere = sphere
+        self.csr = sphere.get_csr()
+        self.bounds = shardBounds(self.csr.degree, numShards)
+        self.numShares = sharedArray('d', numpy.float64, state['numShares'])
+        self.inMarket = sharedArray('b', bool, state['inMarket'])
+        "A C long isn't 64 bits everywhere (such as on Windows), so these are given an exact size"
+        self.lastChange = sharedArray(ctypes.c_int64, numpy.int64, state['lastChange'])
+        self.numTimesLeft = sharedArray(ctypes.c_int64, numpy.int64, state['numTimesLeft'])
+        self.pushes = sharedArray('d', numpy.float64, numpy.zeros((4, self.csr.size)))
+        self.wantToLeave = sharedArray('b', bool, numpy.zeros(self.csr.size, dtype=bool))
+        self.wantToJoin = sharedArray('b', bool, numpy.zeros(self.csr.size, dtype=bool))
+
+    def run(self, task):
+        """
+        Runs one round of one shard, given as (round, shard number, seed, arguments): 'push' writes the shard's pushes, 'propose' its
+        proposals. Returns the number of neighbour entries looked at
+        """
+        name, number, seed, args = task
+        shard = Shard(self, number)
+        rng = RandomStreams.Stream(RandomStreams.deriveSeed(seed, name, number))
+        if(name == 'push'):
+            draws = RandomStreams.UniformBlock(rng, shard.size, Shard.NUM_PUSH_DRAWS)
+            self.pushes[:, shard.low:shard.high] = shard.pushes(draws, *args)
+        else:
+            wantToLeave, wantToJoin = shard.propose(*(args + (rng,)))
+            self.wantToLeave[shard.low:shard.high] = wantToLeave
+            self.wantToJoin[shard.low:shard.high] = wantToJoin
+        return shard.neighbourVisits
+
+
+"Shared state of the engine this worker process belongs to (see startWorker)"
+workerState = None
+
+def startWorker(shared):
+    "Runs when each worker process starts. The shared state is inherited from the main process, not copied"
+    global workerState
+    workerState = shared
+
+def runShard(task):
+    "Runs one round of one shard in a worker process (see SharedState.run)"
+    return workerState.run(task)
+
+
+class ShardedEngine(VectorEngine.VectorEngine):
+
+    def __init__(self, sphere, investors, numShards=16, processes=None):
+        """
+        Creates a new engine from an already set up social sphere and population of investors (see VectorEngine)
+        Investor state is copied into shared memory, and copied back to the population at the end of every timestep
+        processes is the number of worker processes (one per core by default). With 1 process, or inside a process that can't start
+        its own (such as an Ensemble worker), shards run one after the other in this process, with the same results
+        """
+        VectorEngine.VectorEngine.__init__(self, sphere, investors)
+        self.population = investors.arrays()
+        self.shared = SharedState(sphere, self.population, numShards)
+        self.numShards = len(self.shared.bounds) - 1
+        self.numShares = self.shared.numShares
+        self.inMarket = self.shared.inMarket
+        self.lastChange = self.shared.lastChange
+        self.numTimesLeft = self.shared.numTimesLeft
+
+        if(processes is None):
+            processes = multiprocessing.cpu_count()
+        self.pool = None
+        if(processes > 1 and not multiprocessing.current_process().daemon):
+            self.pool = multiprocessing.Pool(min(processes, self.numShards), startWorker, (self.shared,))
+
+    def runRound(self, name, seed, args):
+        "Runs one round over every shard (see SharedState.run)"
+        tasks = [(name, number, seed, args) for number in range(self.numShards)]
+        if(self.pool is not None):
+            visits = self.pool.map(runShard, tasks)
+        else:
+            visits = [self.shared.run(task) for task in tasks]
+        self.neighbourVisits = self.neighbourVisits + sum(visits)
+
+    def propose(self, market, marketValues, curTime, largestNumConnections, averageNumConnections, herdBehaviour, rng=random):
+        """
+        Works out who wants to change stance this timestep (see VectorEngine.propose), one shard at a time
+        Returns (wantToLeave, wantToJoin) as boolean arrays
+        """
+        seed = rng.randint(0, 2**32 - 1)
+        "Shards only need the market values at the start of the look-back window and at the end of the previous timestep"
+        start = Market.MarketSignals.windowStart(market, curTime)
+        values = {start: marketValues[start], curTime-1: marketValues[curTime-1]}
+        if(herdBehaviour):
+            self.runRound('push', seed, (largestNumConnections, averageNumConnections))
+        "They get a copy of the market without its rolling statistics (see Market.snapshot), which would grow every timestep"
+        self.runRound('propose', seed, (market.snapshot(), values, curTime, largestNumConnections, averageNumConnections, herdBehaviour))
+        return self.shared.wantToLeave.copy(), self.shared.wantToJoin.copy()
+
+    def updateState(self, joiners, leavers):
+        "Updates investor state at the end of a timestep (see VectorEngine.updateState), and copies it back to the population"
+        VectorEngine.VectorEngine.updateState(self, joiners, leavers)
+        self.population['inMarket'][:] = self.inMarket
+        self.population['lastChange'][:] = self.lastChange
+        self.population['numTimesLeft'][:] = self.numTimesLeft
+
+    def edgesChanged(self, changes):
+        "Workers keep the social sphere they started with, so its edges can't change (see SocialSphere.churn)"
+        raise ValueError('the sharded engine needs a fixed social sphere: use another engine to change edges as the run goes')
+
+    def close(self):
+        "Shuts down the worker processes"
+        if(self.pool is not None):
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
@@ -1,48 +1,237 @@
 import Graph
+import Generators
 import random
+import numpy
+
+"Whether dividing arrays of integers rounds down (as in Python 2), so that strengths are whole numbers (see NodeStats)"
+WHOLE_STRENGTHS = (numpy.ones(1, dtype=numpy.int64) / 2)[0] == 0
+
+class NodeStats(object):
+    """
+    Per-node values that investors look up about their connections, in the order of the social sphere's CSR ids
+    degree: number of connections; hub: whether the node is a hub (at least 15 connections more than average); strength: number of
+    connections relative to the largest number any node has (with the same integer division as Market.Investor always used)
+    Each is kept as a numpy array, and as a plain list (hubList etc.) for fast element-at-a-time access from Python loops
+    """
+
+    def __init__(self, csr, largestNumConnections, averageNumConnections):
+        self.degree = csr.degree
+        self.hub = self.degree >= (averageNumConnections + 15)
+        self.strength = (self.degree / largestNumConnections).astype(numpy.float64)
+        self.degreeList = csr.degree_list()
+        self.hubList = self.hub.tolist()
+        self.strengthList = self.strength.tolist()
+
+    def update(self, ids, largestNumConnections, averageNumConnections):
+        """
+        Works out the hub flag and strength of the given nodes again (after their number of connections, or the largest or average
+        number, has changed), and returns the ids of the ones whose hub flag or strength changed
+        """
+        ids = numpy.asarray(sorted(ids), dtype=numpy.int64)
+        hub = self.degree[ids] >= (averageNumConnections + 15)
+        strength = (self.degree[ids] / largestNumConnections).astype(numpy.float64)
+        changed = ids[(hub != self.hub[ids]) | (strength != self.strength[ids])]
+        self.hub[ids] = hub
+        self.strength[ids] = strength
+        for i, isHub, s in zip(ids.tolist(), hub.tolist(), strength.tolist()):
+            self.hubList[i] = isHub
+            self.strengthList[i] = s
+        return changed
+
+
+class EdgeChanges(object):
+    """
+    The changes made to a social sphere's network in one go (see SocialSphere.churn)
+    removed and added: the edges removed and added, each as a pair of arrays (src, dst); restatted: ids of the nodes whose hub flag or
+    strength changed; largest and average: the largest and (rounded down) average number of connections afterwards
+    """
+
+    def __init__(self, removed, added, restatted, largest, average):
+        self.removed = (numpy.array([e[0] for e in removed], dtype=numpy.int64), numpy.array([e[1] for e in removed], dtype=numpy.int64))
+        self.added = (numpy.array([e[0] for e in added], dtype=numpy.int64), numpy.array([e[1] for e in added], dtype=numpy.int64))
+        self.restatted = restatted
+        self.largest = largest
+        self.average = average
+
 
 class SocialSphere(object):
 
-    g = None
+    _g = None
+    csr = None
+    csrVersion = -1
+    nodeStats = None
+    loadStats = None
+    "Most times churn looks for a new end for an edge before leaving it where it is"
+    MAX_TRIES = 20
 
-    def __init__(self, n=100, model='ba', k=2, p=0.15):
+    def __init__(self, n=100, model='ba', k=2, p=0.15, rng=random, edgeFile=None):
         """Creates a new SocialSphere
         n:  number of nodes/people (must be at least 3)
-        model:  model used for network construction. Should be 'ba' for Barabase-Albert, or 'ws' for Watts-Strogatz
+        model:  model used for network construction. Should be 'ba' for Barabase-Albert, 'ws' for Watts-Strogatz, or 'edgelist' to read the network from edgeFile
         k: The degree of each vertex. (Not relevant if the chosen model is Barabase-Albert)
+        rng: source of randomness used to build the network (see RandomStreams)
+        edgeFile: edge list file to read the network from, for the 'edgelist' model (see Generators.readEdgeList). n, k and p are ignored
         """
-        self.g = Graph.Graph()
         if(model == 'ba'): #Barabase-Albert model to be used. Construct scale-free network of specified size
-            "Starts by creating a graph with 3 nodes"
-            v1 = Graph.Vertex("1")
-            v2 = Graph.Vertex("2")
-            v3 = Graph.Vertex("3")
-            self.g.add_vertex(v1)
-            self.g.add_vertex(v2)
-            self.g.add_vertex(v3)
-            e1 = Graph.Edge(v1, v3)
-            e2 = Graph.Edge(v2, v3)
-            self.g.add_edge(e1)
-            self.g.add_edge(e2)
-
-            "Now, adds nodes using preferential attachment until n nodes are achieved"
-            while (len(self.g) != n):
-                self.add_preferential()
+            "Build the network on integer ids (same 3 node seed graph, and 2 edges per new node, as add_preferential)"
+            vertices = [Graph.Vertex(str(i+1)) for i in range(n)]
+            src, dst = Generators.barabasiAlbertEdges(n, rng)
+            self.set_edges(vertices, src, dst)
         elif(model == 'ws'): #Watts-Strogatz model to be used. Construct small-world graph of specified size
-            for i in range(n):
-                #Add all nodes
-                v = Graph.Vertex(str(i+1))
-                self.g.add_vertex(v)
-            #Make graph k-regular
-            self.g.add_regular_edges(k)
-            #Rewire edges to produce small world graph (according to WS model)
-            self.rewire(p)
+            "Build the k-regular ring lattice and rewire it (with probability p per edge) on integer ids"
+            vertices = [Graph.Vertex(str(i+1)) for i in range(n)]
+            src, dst = Generators.wattsStrogatzEdges(n, k, p, rng)
+            self.set_edges(vertices, src, dst)
+        elif(model == 'edgelist'): #Network read from a file. Nodes are labelled with their ids in the file
+            "Stream the edge list into arrays; Vertex objects are only made for nodes that are looked up (see Graph.VertexList)"
+            labels, src, dst, self.loadStats = Generators.readEdgeList(edgeFile)
+            width = max([len(str(labels.min())), len(str(labels.max()))]) if len(labels) else 1
+            self.set_edges(Graph.VertexList(labels.astype('S%d' % width)), src, dst)
+
+    @classmethod
+    def from_csr(cls, csr):
+        "Creates a social sphere around an existing network in CSR form (see Graph.CSRGraph), without building anything"
+        sphere = cls.__new__(cls)
+        sphere.csr = csr
+        return sphere
+
+    @classmethod
+    def load(cls, filename, mmap=True):
+        """
+        Opens a social sphere saved with save. With mmap, the network is memory mapped rather than read in, so opening it is near instant
+        and any number of processes can share the one copy (see Graph.CSRGraph.load)
+        """
+        return cls.from_csr(Graph.CSRGraph.load(filename, mmap))
+
+    def save(self, filename):
+        "Saves the social sphere's network to a compact binary file (see Graph.CSRGraph.save), so it can be reused by later runs"
+        self.get_csr().save(filename)
+
+    @property
+    def g(self):
+        """
+        The social sphere's graph (see Graph.Graph)
+        Spheres built from edge arrays (see set_edges) only materialise Vertex/Edge objects the first time this is used
+        """
+        if(self._g is None and self.csr is not None):
+            self._g = self.csr.thaw()
+            self.csrVersion = self._g.version
+        return self._g
+
+    @g.setter
+    def g(self, graph):
+        self._g = graph
 
+    def set_edges(self, vertices, src, dst):
+        """
+        Sets the social sphere's network from a list of vertices and two arrays of vertex ids, where src[j]-dst[j] is an edge
+        The compact CSR form is built straight away; the Graph.Graph form is only built if it's asked for
+        """
+        self._g = None
+        self.csr = Graph.CSRGraph.from_edges(vertices, src, dst)
 
     def get_size(self):
-        return len(self.g)
+        if(self._g is None and self.csr is not None):
+            return self.csr.size
+        return len(self._g)
+
+    def get_csr(self):
+        """
+        Returns the social sphere's graph frozen into compressed sparse row form (see Graph.CSRGraph)
+        The CSR copy is cached, and only rebuilt if the graph has changed since it was made
+        """
+        if(self._g is None):
+            return self.csr
+        if(self.csr is None or self.csrVersion != self._g.version):
+            self.csr = self._g.freeze()
+            self.csrVersion = self._g.version
+        return self.csr
+
+    def get_node_stats(self, largestNumConnections, averageNumConnections):
+        """
+        Returns the degree, hub flag and strength of every node (see NodeStats)
+        These are cached, and only worked out again if the graph has changed (or different largest/average numbers of connections are given)
+        """
+        csr = self.get_csr()
+        key = (csr, largestNumConnections, averageNumConnections)
+        if(self.nodeStats is None or self.nodeStats[0] != key):
+            self.nodeStats = (key, NodeStats(csr, largestNumConnections, averageNumConnections))
+        return self.nodeStats[1]
+
+    def make_dynamic(self):
+        """
+        Lets edges be added and removed from now on (see churn), by switching the network to its dynamic CSR form (see
+        Graph.DynamicCSRGraph), and returns it. Anything holding on to the old CSR form (or node stats) should get them again
+        """
+        csr = self.get_csr()
+        if(not isinstance(csr, Graph.DynamicCSRGraph)):
+            self._g = None
+            self.csr = Graph.DynamicCSRGraph(csr)
+            self.nodeStats = None
+        return self.csr
+
+    def churn(self, rate, mode='rewire', rng=random):
+        """
+        Changes about rate times the number of edges, one edge at a time: an edge is picked at random, and one of its ends is moved to
+        another node. mode: 'rewire' moves it to a node picked uniformly (like Watts-Strogatz rewiring), 'preferential' to a node picked
+        with probability proportional to its number of connections (like Barabasi-Albert attachment). Loops and duplicate edges are never
+        made, so the number of edges stays the same
+        Each change costs O(log n) (plus a look through the neighbours of the edge's end, for duplicates), and the cached node stats are
+        updated for the nodes affected, rather than worked out again (see update_node_stats)
+        Returns the changes made (see EdgeChanges)
+        """
+        csr = self.make_dynamic()
+        expected = rate * csr.num_edges()
+        numChanges = int(expected) + (1 if rng.random() < expected - int(expected) else 0)
+        removed = []
+        added = []
+        for change in range(numChanges):
+            "Pick an edge (and which end of it stays), and a new node for the other end"
+            slot = csr.pick_slot(rng)
+            i = int(csr.slot_row[slot])
+            for attempt in range(self.MAX_TRIES):
+                k = csr.pick_vertex(rng) if mode == 'preferential' else rng.randrange(csr.size)
+                if(k != i and not csr.has_edge(i, k)):
+                    break
+            else:
+                continue
+            j = csr.move_end(slot, k)
+            removed.append((i, j))
+            added.append((i, k))
+
+        largest = csr.largest_degree()
+        average = int(csr.average_degree())
+        touched = set([e[1] for e in removed] + [e[1] for e in added])
+        restatted = self.update_node_stats(touched, largest, average)
+        return EdgeChanges(removed, added, restatted, largest, average)
+
+    def update_node_stats(self, ids, largestNumConnections, averageNumConnections):
+        """
+        Updates the cached node stats (see get_node_stats) after the numbers of connections of the given nodes have changed, and makes
+        them the stats for the new largest and average numbers of connections. Returns the ids of the nodes whose hub flag or strength
+        changed
+        Besides the given nodes, only nodes that could be affected by the largest or average number changing are looked at: strengths
+        are whole numbers (1 for the nodes with the largest number of connections, 0 for the rest) when worked out with integer division,
+        and a change in the average only moves the hub threshold past the nodes in between
+        """
+        if(self.nodeStats is None):
+            return numpy.zeros(0, dtype=numpy.int64)
+        csr = self.get_csr()
+        (oldCsr, oldLargest, oldAverage), stats = self.nodeStats
+        ids = set(ids)
+        if(largestNumConnections != oldLargest):
+            if(WHOLE_STRENGTHS):
+                for d in range(min(oldLargest, largestNumConnections), largestNumConnections + 1):
+                    ids.update(csr.vertices_with_degree(d))
+            else:
+                ids = set(range(csr.size))
+        if(averageNumConnections != oldAverage):
+            for d in range(min(oldAverage, averageNumConnections) + 15, max(oldAverage, averageNumConnections) + 15):
+                ids.update(csr.vertices_with_degree(d))
+        self.nodeStats = ((csr, largestNumConnections, averageNumConnections), stats)
+        return stats.update(ids, largestNumConnections, averageNumConnections)
 
-    def add_preferential(self):
+    def add_preferential(self, rng=random):
         "Adds a new node to the graph using preferential attachment"
 
         "Get list of all nodes in graph"
@@ -60,7 +249,7 @@ class SocialSphere(object):
         "Add 2 edges to nodes within the graph"
         for i in range(2):
             "Use roulette wheel selection to determine where new edge goes"
-            s = random.randint(0, sumOfDegrees)
+            s = rng.randint(0, sumOfDegrees)
             chosenNode = None
             for node in nodes:
                 s = s - len(self.g[node])
@@ -72,7 +261,7 @@ class SocialSphere(object):
             self.g.add_edge(e)
             sumOfDegrees = sumOfDegrees - len(self.g[chosenNode])
 
-    def rewire(self, p):
+    def rewire(self, p, rng=random):
         "Probabilistically rewires the edges in the graph to produce a Watts-Strogatz model of a small-world graph"
 
         #Start from ring lattice
@@ -96,14 +285,14 @@ class SocialSphere(object):
                 e = self.g.get_edge(vertices[index], vertices[neighbourIndex])
 
                 #Determine whether or not it will be rewired
-                if(random.random() <= p):
+                if(rng.random() <= p):
                     #It's getting rewired. Pick a node to move the edge to, disallowing duplicate edges and loops
                     self.g.remove_edge(e) #Remove old edge
                     found = False
                     targetIndex = 0
                     #Find vertex for new edge
                     while(not found):
-                        targetIndex = random.randint(0,numVertices-1)
+                        targetIndex = rng.randint(0,numVertices-1)
                         if (targetIndex != index and targetIndex != neighbourIndex):
                             #It's not a loop. Make sure it isn't a duplicate
                             eCheck = self.g.get_edge(vertices[index], vertices[targetIndex])
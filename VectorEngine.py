@@ -0,0 +1,228 @@
+import Market
+import numpy
+import random
+import RandomStreams
+import Profiler
+
+class VectorEngine(object):
+    """
+    Alternative tick engine for the simulation
+    Instead of asking every Investor object for a probability in turn, all investor state is kept in flat numpy arrays (one entry per investor),
+    and the join/leave probabilities of every investor are computed in one batch per timestep, using sparse adjacency matrix-vector products
+    over the social sphere and bulk random draws
+
+    Each investor's influence on its connections is summarised as a single random draw per timestep (rather than a fresh draw per edge),
+    and the pushes towards 0 and towards 1 are accumulated separately (in log space) and then applied together. Otherwise the
+    factors and ranges are the same as in Market.Investor.probToJoin/probToLeave
+    """
+
+    "Most random arrays drawn per timestep (8 herd signals, 2 starting probabilities, 4 for the market limit, 2 for the market change, 1 for past leaving, 1 roll)"
+    NUM_DRAWS = 18
+    "Order candidate joiners are let into the market in ('arrival', 'largest' or 'random', see Market.admitBatch)"
+    admission = 'arrival'
+
+    def __init__(self, sphere, investors):
+        """
+        Creates a new engine from an already set up social sphere, and population of investors (see Runner.setUpInvestors/setUpMarket)
+        Investor ids are the ids of the social sphere's nodes in its CSR form (see SocialSphere.get_csr)
+        The engine works directly on the population's arrays, so the population always holds the latest state
+        """
+        self.sphere = sphere
+        self.csr = sphere.get_csr()
+        self.size = self.csr.size
+        self.degree = self.csr.degree
+
+        "Investor state, as numpy views of the population's arrays"
+        state = investors.arrays()
+        self.numShares = state['numShares']
+        self.inMarket = state['inMarket']
+        self.lastChange = state['lastChange']
+        self.numTimesLeft = state['numTimesLeft']
+
+        "Number of neighbour entries looked at so far (each sweep over the social sphere's edges looks at every one)"
+        self.neighbourVisits = 0
+
+    def neighbourSum(self, values):
+        "Returns the sparse adjacency matrix-vector product A.values (i.e. for each investor, the sum of values over its connections)"
+        self.neighbourVisits = self.neighbourVisits + 2 * self.csr.num_edges()
+        return self.csr.neighbour_sum(values)
+
+    def signalWeights(self, draws, low, high, hubs, strengths):
+        """
+        Returns log(1-a) for every investor, where a is the size of the push that investor gives its connections
+        Hubs push with a in [0.7, 0.9]; everyone else pushes with their strength scaled by a draw in [low, high]
+        """
+        u = draws.random()
+        a = numpy.where(hubs, 0.7 + 0.2 * u, strengths * (low + (high - low) * u))
+        return numpy.log1p(-a)
+
+    def nodeStats(self, largestNumConnections, averageNumConnections):
+        "Returns whether each investor is a hub, and each investor's strength (same rules as in Market.Investor, see SocialSphere.NodeStats)"
+        stats = self.sphere.get_node_stats(largestNumConnections, averageNumConnections)
+        return stats.hub, stats.strength
+
+    def pushes(self, draws, largestNumConnections, averageNumConnections):
+        """
+        Returns the pushes every investor gives their connections, as four arrays (joinDown, joinUp, leaveDown, leaveUp)
+        Each one is the log of the product of (1-a) over that investor's pushes in that direction (0 if it doesn't push that way)
+        """
+        inMarket = self.inMarket
+        outOfMarket = ~inMarket
+        recent = self.lastChange <= 20
+        recentlyLeft = recent & outOfMarket
+        recentlyJoined = recent & inMarket
+        hubs, strengths = self.nodeStats(largestNumConnections, averageNumConnections)
+
+        joinDown = self.signalWeights(draws, 0.35, 0.7, hubs, strengths) * outOfMarket + self.signalWeights(draws, 0.4, 0.8, hubs, strengths) * recentlyLeft
+        joinUp = self.signalWeights(draws, 0.3, 0.6, hubs, strengths) * inMarket + self.signalWeights(draws, 0.4, 0.83, hubs, strengths) * recentlyJoined
+        leaveDown = self.signalWeights(draws, 0.3, 0.65, hubs, strengths) * inMarket + self.signalWeights(draws, 0.35, 0.8, hubs, strengths) * recentlyJoined
+        leaveUp = self.signalWeights(draws, 0.45, 0.9, hubs, strengths) * outOfMarket + self.signalWeights(draws, 0.55, 0.99, hubs, strengths) * recentlyLeft
+        return joinDown, joinUp, leaveDown, leaveUp
+
+    def herdInfluence(self, draws, largestNumConnections, averageNumConnections):
+        """
+        Returns the aggregated influence of every investor's connections, as four arrays (joinDown, joinUp, leaveDown, leaveUp)
+        Each one is the log of the product of (1-a) over all pushes in that direction
+        """
+        return tuple(self.neighbourSum(push) for push in self.pushes(draws, largestNumConnections, averageNumConnections))
+
+    def mixPushes(self, prob, down, up):
+        """
+        Applies aggregated pushes towards 0 (down) and towards 1 (up) to an array of probabilities
+        down and up are log products of (1-a), as returned by herdInfluence. The pushes are treated as finely interleaved, so neither
+        direction gets the last word: prob relaxes towards up/(up+down) at a rate given by the total push
+        """
+        total = -(down + up)
+        target = numpy.where(total > 0, -up / numpy.where(total > 0, total, 1.0), prob)
+        return target + (prob - target) * numpy.exp(-total)
+
+    def probabilities(self, draws, marketValues, curTime, market, largestNumConnections, averageNumConnections, herdBehaviour):
+        """
+        Calculates, for every investor, a probability to join the market and a probability to leave it
+        draws is a RandomStreams.UniformBlock holding all of this timestep's random arrays
+        Returns (probToJoin, probToLeave) as arrays; only the entry matching each investor's current stance is meaningful
+        """
+
+        "Start off with random probabilities"
+        join = draws.uniform(0.0, 0.2)
+        leave = draws.uniform(0.0, 0.3)
+
+        "Look at all connections in the social sphere"
+        if(herdBehaviour):
+            joinDown, joinUp, leaveDown, leaveUp = self.herdInfluence(draws, largestNumConnections, averageNumConnections)
+            join = self.mixPushes(join, joinDown, joinUp)
+            leave = self.mixPushes(leave, leaveDown, leaveUp)
+
+        "Look at whether or not the number of shares purchased is approaching the market's limit (see Market.MarketSignals)"
+        signals = Market.MarketSignals(market, marketValues, curTime)
+        previousValue = signals.previousValue
+        limitRatio = signals.limitRatio()
+        nearLimit = previousValue >= market.limit * draws.uniform(0.75, 0.95)
+        a = nearLimit * limitRatio * draws.uniform(0.3, 0.7)
+        join = join - a * join
+        nearLimit = previousValue >= market.limit * draws.uniform(0.75, 0.95)
+        a = nearLimit * limitRatio * draws.uniform(0.3, 0.8)
+        leave = leave + a * (1.0 - leave)
+
+        "Look at how the market has changed since the start"
+        recentChange = signals.recentChange
+        changeRatio = signals.changeRatio
+        if(recentChange > 0):
+            join = join - changeRatio * draws.uniform(0.25, 0.65) * (1.0 - join)
+            leave = leave - changeRatio * draws.uniform(0.3, 0.7) * leave
+        elif(recentChange < 0):
+            join = join - changeRatio * draws.uniform(0.25, 0.65) * join
+            leave = leave + changeRatio * draws.uniform(0.3, 0.7) * (1.0 - leave)
+
+        "Follow the trend, and shy away from volatility and drawdown, if switched on"
+        join = signals.statsPush(join, True)
+        leave = signals.statsPush(leave, False)
+
+        "Investors who have left in the past are much less likely to join again"
+        a = (self.numTimesLeft > 0) * draws.uniform(0.4, 0.75)
+        join = join - a * join
+
+        return join, leave
+
+    def updateState(self, joiners, leavers):
+        "Updates investor state at the end of a timestep, given the ids of the investors that joined and left the market"
+        self.lastChange += 1
+        self.lastChange[leavers] = 0
+        self.lastChange[joiners] = 0
+        self.inMarket[leavers] = False
+        self.inMarket[joiners] = True
+        self.numTimesLeft[leavers] += 1
+
+    def propose(self, market, marketValues, curTime, largestNumConnections, averageNumConnections, herdBehaviour, rng=random):
+        """
+        Works out who wants to change stance this timestep, before the cooldown, the cap on moves and the market's limit are applied
+        Returns (wantToLeave, wantToJoin) as boolean arrays
+        """
+        draws = RandomStreams.UniformBlock(rng, self.size, self.NUM_DRAWS)
+        probToJoin, probToLeave = self.probabilities(draws, marketValues, curTime, market, largestNumConnections, averageNumConnections, herdBehaviour)
+        roll = draws.random()
+        return self.inMarket & (roll <= probToLeave), ~self.inMarket & (roll <= probToJoin)
+
+    def tick(self, market, marketValues, curTime, largestNumConnections, averageNumConnections, herdBehaviour, rng=random, profiler=Profiler.NULL):
+        """
+        Performs a 'tick' operation on the simulation, moving it forward by one timestep (the vectorized equivalent of Runner.tick)
+        rng is the source of randomness for this timestep (see RandomStreams). All of the timestep's random arrays are drawn from it in bulk
+        If a profiler is given (see Profiler), the time spent in each part of the timestep is recorded, along with how many joins and
+        leaves happened or were blocked
+        Leavers are applied before joiners. Returns (numJoined, numLeft)
+        """
+        with profiler.time('tick.probability'):
+            visitsBefore = self.neighbourVisits
+            wantToLeave, wantToJoin = self.propose(market, marketValues, curTime, largestNumConnections, averageNumConnections, herdBehaviour, rng)
+
+        with profiler.time('tick.decision'):
+            "If the investor has changed stance recently, they can't change again yet"
+            settled = self.lastChange >= 15
+            maxMoves = int(self.size / 50) + 1
+            leavers = numpy.flatnonzero(wantToLeave & settled)[:maxMoves]
+            candidates = numpy.flatnonzero(wantToJoin & settled)
+
+            "Remove leavers from the market, then admit as many joiners as the market allows"
+            joiners, capped = market.admitBatch(candidates, self.numShares[candidates], self.numShares[leavers].sum(), maxMoves, self.admission, rng)
+
+        with profiler.time('tick.market_update'):
+            self.updateState(joiners, leavers)
+
+            with profiler.time('tick.market_update.messages'):
+                for i in leavers[self.degree[leavers] > averageNumConnections + 15]:
+                    print('Investor with ' + str(self.degree[i]) + ' connections left market at ' + str(curTime))
+                for i in joiners[self.degree[joiners] >= averageNumConnections + 15]:
+                    print('Investor with ' + str(self.degree[i]) + ' connections joined market at ' + str(curTime))
+
+        if(profiler.enabled):
+            self.countMoves(profiler, wantToLeave, wantToJoin, settled, leavers, candidates, joiners, capped)
+            profiler.count('neighbour_visits', self.neighbourVisits - visitsBefore)
+
+        return len(joiners), len(leavers)
+
+    def countMoves(self, profiler, wantToLeave, wantToJoin, settled, leavers, candidates, joiners, capped):
+        """
+        Counts this timestep's joins and leaves in a profiler, along with the ones that were blocked and why: the investor changed stance
+        too recently (cooldown), the market had no room (market_full), or too many investors had already moved (cap)
+        capped is the number of candidate joiners turned away by the cap (see Market.admitBatch)
+        """
+        profiler.count('joins', len(joiners))
+        profiler.count('leaves', len(leavers))
+        profiler.count('blocked_leaves.cooldown', int(numpy.count_nonzero(wantToLeave & ~settled)))
+        profiler.count('blocked_leaves.cap', int(numpy.count_nonzero(wantToLeave & settled)) - len(leavers))
+        profiler.count('blocked_joins.cooldown', int(numpy.count_nonzero(wantToJoin & ~settled)))
+        "Candidates that weren't turned away by the cap didn't fit in the market"
+        profiler.count('blocked_joins.cap', capped)
+        profiler.count('blocked_joins.market_full', len(candidates) - len(joiners) - capped)
+
+    def edgesChanged(self, changes):
+        """
+        Called after the social sphere's edges have changed (see SocialSphere.churn). This engine reads the social sphere's (dynamic) CSR
+        form and node stats as they are at every timestep, so it only needs to pick up the current CSR form
+        """
+        self.csr = self.sphere.get_csr()
+        self.degree = self.csr.degree
+
+    def close(self):
+        "Releases anything the engine started when the run is over (nothing, for this engine; see ShardedEngine)"
+        pass
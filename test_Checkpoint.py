@@ -0,0 +1,86 @@
+"""
+Tests for resuming a run from a checkpoint (see Checkpoint and Runner.runSimulation), and the results it writes (see ResultsWriter)
+Run with: python -m unittest test_Checkpoint
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+import ResultsWriter
+import Runner
+
+class ResumeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        "Runs print a message whenever a hub joins the market"
+        self.stdout = sys.stdout
+        sys.stdout = open(os.devnull, 'w')
+
+    def tearDown(self):
+        sys.stdout.close()
+        sys.stdout = self.stdout
+        shutil.rmtree(self.directory)
+
+    def params(self, engine, timesteps, resume):
+        return {'model': 'ba', 'size': 300, 'timesteps': timesteps, 'investor_start': 0.35, 'herd': True, 'seed': 7, 'engine': engine,
+                'checkpoint_interval': 10, 'checkpoint_file': os.path.join(self.directory, engine + '.npz'), 'resume': resume, 'processes': 1}
+
+    def simulate(self, engine, output, filename, timesteps, resume, crash=False):
+        """
+        Runs a simulation writing its results to filename. If crash is set, rows not yet flushed are thrown away instead of written,
+        as if the process had been killed
+        Returns the market values
+        """
+        writer = ResultsWriter.openWriter(output, filename, bufferRows=256)
+        market, marketValues = Runner.runSimulation(self.params(engine, timesteps, resume), writer)
+        if(crash):
+            writer.rows = []
+            writer.columns = [[] for column in ResultsWriter.COLUMNS]
+        writer.close()
+        return marketValues
+
+    def read(self, output, filename):
+        "Returns the (tick, market_value) rows of a results file"
+        if(output == 'binary'):
+            columns = ResultsWriter.readBinary(filename)
+            return zip(columns['tick'].tolist(), columns['market_value'].tolist())
+        with open(filename) as fin:
+            next(fin)
+            return [(int(line.split(',')[0]), float(line.split(',')[1])) for line in fin]
+
+    def checkResume(self, engine, output):
+        "A run killed at timestep 25 and resumed from its checkpoint at 20 writes every timestep exactly once"
+        uninterrupted = os.path.join(self.directory, 'uninterrupted')
+        resumed = os.path.join(self.directory, 'resumed')
+        values = self.simulate(engine, output, uninterrupted, 40, False)
+        self.simulate(engine, output, resumed, 25, False, crash=True)
+        resumedValues = self.simulate(engine, output, resumed, 40, True)
+        self.assertEqual(resumedValues, values)
+        rows = self.read(output, resumed)
+        self.assertEqual([tick for tick, value in rows], range(41))
+        self.assertEqual(rows, self.read(output, uninterrupted))
+
+    def testResumeCsv(self):
+        self.checkResume('vectorized', 'csv')
+
+    def testResumeBinary(self):
+        self.checkResume('vectorized', 'binary')
+
+    def testResumeLegacy(self):
+        self.checkResume('legacy', 'csv')
+
+    def testMissingRows(self):
+        "Resuming with results that stop short of the checkpoint is refused, rather than leaving a gap"
+        filename = os.path.join(self.directory, 'results.csv')
+        self.simulate('vectorized', 'csv', filename, 25, False)
+        writer = ResultsWriter.openWriter('csv', filename)
+        writer.start(5)
+        writer.close()
+        self.assertRaises(ValueError, lambda: self.simulate('vectorized', 'csv', filename, 40, True))
+
+
+if __name__ == '__main__':
+    unittest.main()
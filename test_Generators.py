@@ -0,0 +1,59 @@
+"""
+Tests for reading edge list files (see Generators.edgeChunks and Generators.readEdgeList)
+Run with: python -m unittest test_Generators
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+import numpy
+import Generators
+
+class EdgeListTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, text):
+        "Writes text to an edge list file, and returns its name"
+        filename = os.path.join(self.directory, 'edges.txt')
+        out = open(filename, 'w')
+        out.write(text)
+        out.close()
+        return filename
+
+    def testWeightedEdgeList(self):
+        "Extra columns (here weights and timestamps that aren't integers) are ignored"
+        filename = self.write('# source target weight\n1 2 0.5\n2,3,1.25\n% comment\n3 1 2e-3 17\n1 4 0.7\n')
+        chunks = list(Generators.edgeChunks(filename))
+        self.assertEqual(numpy.concatenate(chunks).tolist(), [[1, 2], [2, 3], [3, 1], [1, 4]])
+        labels, src, dst, stats = Generators.readEdgeList(filename)
+        self.assertEqual(labels.tolist(), [1, 2, 3, 4])
+        self.assertEqual(sorted(zip(src.tolist(), dst.tolist())), [(0, 1), (0, 2), (0, 3), (1, 2)])
+        self.assertEqual(stats['edges_read'], 4)
+
+    def testWeightedEdgeListInChunks(self):
+        "Small chunks give the same edges"
+        filename = self.write(''.join(['%d %d %.3f\n' % (i, (i * 7 + 1) % 50, i / 3.0) for i in range(5000)]))
+        chunks = list(Generators.edgeChunks(filename, 1024))
+        self.assertTrue(len(chunks) > 1)
+        self.assertEqual(numpy.concatenate(chunks).tolist(), [[i, (i * 7 + 1) % 50] for i in range(5000)])
+
+    def testPlainEdgeList(self):
+        filename = self.write('5 6\n6 7\n7 5\n6 5\n5 5\n')
+        labels, src, dst, stats = Generators.readEdgeList(filename)
+        self.assertEqual(labels.tolist(), [5, 6, 7])
+        self.assertEqual(sorted(zip(src.tolist(), dst.tolist())), [(0, 1), (0, 2), (1, 2)])
+        self.assertEqual((stats['edges_read'], stats['edges']), (5, 3))
+
+    def testMissingNodeId(self):
+        filename = self.write('1 2 0.5\n3\n')
+        self.assertRaises(ValueError, lambda: list(Generators.edgeChunks(filename)))
+
+
+if __name__ == '__main__':
+    unittest.main()